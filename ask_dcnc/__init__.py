@@ -1,3 +1,4 @@
+import importlib
 import pathlib
 
 # Import environment if not in Docker
@@ -6,14 +7,59 @@ if not pathlib.Path("/.dockerenv").exists():
 
     load_dotenv(override=False)
 
-from .agent import get_agent
-from .client import get_aws_keys
-from .prompt import get_system_prompt
-from .ui import get_time_str
+# Submodules are imported on first use, so e.g. ask_dcnc.sql and ask_dcnc.advisor load without the LLM client
+_EXPORTS = {
+    "AUTO_MODEL": "models",
+    "FAST_PATH": "router",
+    "HistoryState": "history",
+    "PoolFullError": "pool",
+    "Tracer": "tracing",
+    "answer_lookup": "router",
+    "cache_answer": "answers",
+    "choose_models": "models",
+    "compact_history": "history",
+    "get_agent": "agent",
+    "get_agent_pool": "pool",
+    "get_answer_key": "answers",
+    "get_aws_keys": "client",
+    "get_cached_answer": "answers",
+    "get_metrics": "tracing",
+    "get_prompt_time": "prompt",
+    "get_system_prompt": "prompt",
+    "get_time_str": "ui",
+    "route": "router",
+    "stream_answer": "ui",
+    "stream_with_fallback": "models",
+    "wait_for_turn": "ui",
+}
 
 __all__ = [
+    "AUTO_MODEL",
+    "FAST_PATH",
+    "HistoryState",
+    "PoolFullError",
+    "Tracer",
+    "answer_lookup",
+    "cache_answer",
+    "choose_models",
+    "compact_history",
     "get_agent",
+    "get_agent_pool",
+    "get_answer_key",
     "get_aws_keys",
+    "get_cached_answer",
+    "get_metrics",
+    "get_prompt_time",
     "get_system_prompt",
-    "get_time_str"
+    "get_time_str",
+    "route",
+    "stream_answer",
+    "stream_with_fallback",
+    "wait_for_turn",
 ]
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
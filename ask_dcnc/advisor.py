@@ -0,0 +1,284 @@
+"""
+ask_dcnc/advisor.py
+Index advisor for the slow queries the agent wrote, tested against an in-memory copy of the database
+
+Usage: python -m ask_dcnc.advisor [--log FILE] [--write] [--apply]
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import statistics
+import time
+from contextlib import closing
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from ask_dcnc.db import BASE_DIR, SQLITE_PATH
+from ask_dcnc.sql import SLOW_QUERY_LOG_PATH, normalize_query, writable_copy
+
+INDEXES_PATH = os.path.join(BASE_DIR, "data/indexes.sql")  # Applied by the database build
+MAX_COVERING_COLUMNS = 4  # Extra columns a covering index may carry
+COVERING_GAIN = 0.8  # A covering index must be at least 20% faster than the plain index to be preferred
+TIMING_RUNS = 5
+
+TABLE_PATTERN = re.compile(
+    r"\b(?:from|join)\s+(\w+)"
+    r"(?:\s+(?:as\s+)?(?!(?:on|where|join|left|inner|cross|natural|using|group|order|limit)\b)(\w+))?",
+    re.IGNORECASE,
+)
+# Plan lines that read a whole table, e.g. "SCAN cc" or "SCAN course AS c"
+SCAN_PATTERN = re.compile(r"^SCAN (\w+)(?: AS (\w+))?(?! USING (?:COVERING )?INDEX)")
+# Plan lines where SQLite builds a throwaway index on every run, e.g. "USING AUTOMATIC COVERING INDEX (code=?)"
+AUTOMATIC_PATTERN = re.compile(r"^SEARCH (\w+)(?: AS (\w+))? USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \(([^)]+)\)")
+
+
+@dataclass
+class SlowQuery:
+    query: str
+    count: int = 0
+    total_ms: float = 0.0
+
+
+@dataclass
+class Proposal:
+    table: str
+    columns: tuple[str, ...]
+    queries: list[SlowQuery] = field(default_factory=list)
+    saved_ms: float = 0.0  # Per occurrence, summed over the queries, weighted by how often they ran
+
+    @property
+    def name(self) -> str:
+        return f"advised_{self.table}_{'_'.join(self.columns)}"
+
+    @property
+    def sql(self) -> str:
+        return f"create index if not exists {self.name} on {self.table} ({', '.join(self.columns)});"
+
+
+def load_slow_queries(path: str = SLOW_QUERY_LOG_PATH) -> list[SlowQuery]:
+    """
+    Aggregate the slow query log by normalised query
+    :param path: Log written by `ask_dcnc.sql.log_slow_query`
+    :return: Slow queries, by total time
+    """
+    queries: dict[str, SlowQuery] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            key = normalize_query(record["query"])
+            slow_query = queries.setdefault(key, SlowQuery(record["query"]))
+            slow_query.count += 1
+            slow_query.total_ms += record["duration_ms"]
+    return sorted(queries.values(), key=lambda q: q.total_ms, reverse=True)
+
+
+def get_aliases(query: str) -> dict[str, str]:
+    """
+    :return: Alias or table name to table name, for every table in the FROM and JOIN clauses
+    """
+    aliases = {}
+    for table, alias in TABLE_PATTERN.findall(query):
+        aliases[table.lower()] = table.lower()
+        if alias:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def get_filter_columns(query: str, alias: str, columns: set[str], only_table: bool) -> tuple[list[str], list[str]]:
+    """
+    Find the columns of a table that a query filters or joins on
+    :param query: SQL query
+    :param alias: Alias of the table in the query
+    :param columns: Column names of the table
+    :param only_table: Whether unqualified column names refer to this table
+    :return: Columns compared for equality, and columns compared by range or prefix, in order of appearance
+    """
+    prefix = rf"\b{re.escape(alias)}\." if not only_table else rf"(?:\b{re.escape(alias)}\.|(?<![\w.]))"
+    equality, ranges = [], []
+    for match in re.finditer(rf"{prefix}(\w+)\s*(=|\bin\b|<=?|>=?|\bbetween\b|\blike\s+'[^%_'])", query, re.IGNORECASE):
+        column, operator = match.group(1).lower(), match.group(2).lower()
+        if column not in columns:
+            continue
+        target = equality if operator in ("=", "in") else ranges
+        if column not in equality and column not in ranges:
+            target.append(column)
+    # Join conditions written the other way round, e.g. "c.id = cc.id" when looking at cc
+    for match in re.finditer(rf"=\s*{prefix}(\w+)", query, re.IGNORECASE):
+        column = match.group(1).lower()
+        if column in columns and column not in equality:
+            equality.append(column)
+    return equality, ranges
+
+
+def get_referenced_columns(query: str, alias: str, columns: set[str], only_table: bool) -> list[str]:
+    """
+    :return: Columns of a table used anywhere in a query, for covering indexes
+    """
+    if only_table:
+        words = [word.lower() for word in re.findall(r"\b\w+\b", query)]
+    else:
+        words = [word.lower() for word in re.findall(rf"\b{re.escape(alias)}\.(\w+)", query, re.IGNORECASE)]
+    return list(dict.fromkeys(word for word in words if word in columns))
+
+
+def get_indexed_prefixes(conn: sqlite3.Connection, table: str) -> set[tuple[str, ...]]:
+    """
+    :return: Leading columns of every existing index on a table, including the primary key
+    """
+    prefixes = set()
+    for row in conn.execute(f'pragma index_list("{table}")'):
+        index_columns = [info[2] for info in conn.execute(f'pragma index_info("{row[1]}")')]
+        if index_columns and index_columns[0]:
+            prefixes.add((index_columns[0].lower(),))
+    return prefixes
+
+
+def find_candidates(conn: sqlite3.Connection, query: str) -> list[tuple[str, tuple[str, ...], tuple[str, ...]]]:
+    """
+    Propose indexes for the tables a query scans, from its query plan and WHERE and JOIN clauses
+    :param conn: Connection to the database
+    :param query: SQL query
+    :return: Table, index columns, and extra columns for a covering index
+    """
+    aliases = get_aliases(query)
+    candidates = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {query.rstrip().rstrip(';')}"):
+        detail = row[3]
+        if match := AUTOMATIC_PATTERN.match(detail):
+            table, alias = match.group(1).lower(), (match.group(2) or match.group(1)).lower()
+            keys = tuple(term.split("=")[0].strip().lower() for term in match.group(3).split(" AND "))
+        elif match := SCAN_PATTERN.match(detail):
+            alias = (match.group(2) or match.group(1)).lower()
+            table = aliases.get(alias, match.group(1).lower())
+            keys = None
+        else:
+            continue
+
+        columns = {info[1].lower() for info in conn.execute(f'pragma table_info("{table}")')}
+        if not columns:
+            continue  # Subqueries and CTEs
+        only_table = len(set(aliases.values())) == 1
+        if keys is None:
+            equality, ranges = get_filter_columns(query, alias, columns, only_table)
+            keys = tuple(equality + ranges[:1])
+        if not keys or keys[:1] in get_indexed_prefixes(conn, table):
+            continue
+        extra = tuple(c for c in get_referenced_columns(query, alias, columns, only_table) if c not in keys)
+        candidates.append((table, keys, extra[:MAX_COVERING_COLUMNS]))
+    return candidates
+
+
+def time_query(conn: sqlite3.Connection, query: str) -> float:
+    """
+    :return: Median milliseconds to run a query and fetch all rows
+    """
+    durations = []
+    for _ in range(TIMING_RUNS):
+        start = time.perf_counter()
+        conn.execute(query).fetchall()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def try_index(conn: sqlite3.Connection, query: str, table: str, columns: tuple[str, ...]) -> float | None:
+    """
+    Create an index, time the query with it, and drop it again
+    :return: Milliseconds with the index, or None if SQLite does not use it
+    """
+    name = f"advisor_trial_{table}"
+    conn.execute(f"create index {name} on {table} ({', '.join(columns)})")
+    try:
+        plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query.rstrip().rstrip(';')}"))
+        return time_query(conn, query) if name in plan else None
+    finally:
+        conn.execute(f"drop index {name}")
+
+
+def advise(queries: list[SlowQuery], db_path: str = SQLITE_PATH) -> list[Proposal]:
+    """
+    Test candidate indexes for the slow queries against an in-memory copy of the database
+    :param queries: Slow queries from `load_slow_queries`
+    :param db_path: Path to the database file
+    :return: Indexes that made at least one query faster, by time saved
+    """
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as source, \
+            closing(sqlite3.connect(":memory:")) as conn:
+        source.backup(conn)
+        proposals: dict[tuple, Proposal] = {}
+        for slow_query in queries:
+            try:
+                candidates = find_candidates(conn, slow_query.query)
+                before = time_query(conn, slow_query.query) if candidates else 0.0
+            except sqlite3.Error as e:
+                logger.debug(f"Skipped query: {e}")
+                continue
+
+            for table, keys, extra in candidates:
+                after = try_index(conn, slow_query.query, table, keys)
+                columns = keys
+                if extra and (covered := try_index(conn, slow_query.query, table, keys + extra)) is not None:
+                    if after is None or covered < after * COVERING_GAIN:
+                        after, columns = covered, keys + extra
+                if after is None or after >= before:
+                    continue
+
+                proposal = proposals.setdefault((table, columns), Proposal(table, columns))
+                proposal.queries.append(slow_query)
+                proposal.saved_ms += (before - after) * slow_query.count
+                logger.debug(f"{proposal.name}: {before:.2f}ms -> {after:.2f}ms for {slow_query.query}")
+
+    return sorted(proposals.values(), key=lambda p: p.saved_ms, reverse=True)
+
+
+def apply_indexes(db_path: str = SQLITE_PATH, path: str = INDEXES_PATH) -> None:
+    """
+    Create the advised indexes in a database, e.g. while building it
+    The app's database must not be written in place, so pass a copy from `ask_dcnc.sql.writable_copy`
+    :param db_path: Path to the database file
+    :param path: SQL file of `create index` statements
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f, closing(sqlite3.connect(db_path)) as conn:
+        with conn:
+            conn.executescript(f.read())
+        conn.execute("analyze")
+    logger.success(f"Indexes from {os.path.relpath(path, BASE_DIR)} applied.")
+
+
+def write_indexes(proposals: list[Proposal], path: str = INDEXES_PATH) -> None:
+    """
+    Add proposed indexes to the SQL file applied by the database build, keeping the indexes already in it
+    """
+    existing = open(path, encoding="utf-8").read().splitlines() if os.path.exists(path) else []
+    statements = list(dict.fromkeys(existing + [proposal.sql for proposal in proposals]))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(statements) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=SLOW_QUERY_LOG_PATH, help="Slow query log")
+    parser.add_argument("--db", default=SQLITE_PATH, help="Database to test indexes against")
+    parser.add_argument("--write", action="store_true", help=f"Add the proposals to {os.path.relpath(INDEXES_PATH)}")
+    parser.add_argument("--apply", action="store_true", help="Create the indexes in a copy that replaces the database")
+    args = parser.parse_args()
+
+    slow_queries = load_slow_queries(args.log)
+    logger.info(f"{sum(q.count for q in slow_queries)} slow queries, {len(slow_queries)} distinct.")
+    proposals = advise(slow_queries, args.db)
+    if not proposals:
+        logger.info("No index made the slow queries faster.")
+    for proposal in proposals:
+        print(f"-- Saves {proposal.saved_ms:.1f}ms over {sum(q.count for q in proposal.queries)} logged runs")
+        print(proposal.sql)
+
+    if proposals and (args.write or args.apply):
+        write_indexes(proposals)
+    if args.apply:
+        with writable_copy(args.db) as copy:
+            apply_indexes(copy)
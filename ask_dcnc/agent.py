@@ -3,12 +3,16 @@ ask_dcnc/agent.py
 Functions to get the LangGraph ReAct
 """
 
+import os
 import pathlib
 
 import streamlit as st
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_community.agent_toolkits.openapi.toolkit import RequestsToolkit
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import SystemMessage
 from langgraph.prebuilt import create_react_agent
+from langgraph.prebuilt.chat_agent_executor import AgentState
 from loguru import logger
 
 from ask_dcnc.db import SQLITE_URI, get_db
@@ -19,29 +23,65 @@ if not pathlib.Path("/.dockerenv").exists():
 
     load_dotenv()
 
-from ask_dcnc.client import client
+from ask_dcnc.client import client, get_token_retry_policy
+from ask_dcnc.history import format_history
 from ask_dcnc.html import HTMLStripRequestsWrapper
+from ask_dcnc.prompt import format_system_prompt, get_prompt_hash, get_system_prompt
+from ask_dcnc.router import format_context
+from ask_dcnc.schema import QUERY_TOOL_DESCRIPTION, SCHEMA_TOOLS, get_schema_digest
+from ask_dcnc.search import SearchCoursesTool, SearchProgramsTool, has_search_index
+from ask_dcnc.sql import CachedQuerySQLDatabaseTool, LocalQueryCheckerTool, get_db_path
+from ask_dcnc.throttle import get_retry_policy
 
 ALLOW_DANGEROUS_REQUEST = True  # For LangChain RequestsToolkit to visit the Internet
+AGENT_CACHE_TTL = 45 * 60  # Recompile now and then to pick up tools that depend on the data, e.g. a new search index
+AGENT_CACHE_MAX_ENTRIES = 16
+HIDE_SCHEMA_TOOLS = os.getenv("HIDE_SCHEMA_TOOLS", "false").lower() == "true"  # Schema is in the system prompt
 
 
-def get_agent(system_prompt: str):
+class AskState(AgentState):
     """
-    Get the LangGraph ReAct agent
-    :param system_prompt: System prompt for the agent
-    :return: LangChain runnable for interactions
+    Agent state with the per-turn values of the system prompt
     """
-    llm = client(
-        llm_model=st.session_state.llm_model,
-        temperature=st.session_state.llm_temperature
-    )
+    time: str
+    context: str  # Rows prefetched by the router
+    history: str  # Summary of the turns compacted out of the messages
+
 
+def build_agent(llm: BaseChatModel, system_prompt: str):
+    """
+    Build and compile a LangGraph ReAct agent without caching
+    :param llm: Chat model for the agent
+    :param system_prompt: System prompt template from `get_system_prompt`
+    :return: LangChain runnable for interactions
+    """
     db = get_db(SQLITE_URI)
 
-    tools = SQLDatabaseToolkit(
-        db=db,
-        llm=llm
-    ).get_tools() + RequestsToolkit(
+    # Swap the LLM-backed query checker for a local validator, and serve repeated queries from memory
+    local_tools = {
+        "sql_db_query": CachedQuerySQLDatabaseTool,
+        "sql_db_query_checker": LocalQueryCheckerTool,
+    }
+    sql_tools = [
+        local_tools[tool.name](db=db, description=tool.description) if tool.name in local_tools else tool
+        for tool in SQLDatabaseToolkit(
+            db=db,
+            llm=llm
+        ).get_tools()
+    ]
+
+    # The schema digest in the system prompt makes these tools redundant, and replaces them in the query tool's hints
+    if HIDE_SCHEMA_TOOLS and get_schema_digest():
+        sql_tools = [tool for tool in sql_tools if tool.name not in SCHEMA_TOOLS]
+        for tool in sql_tools:
+            if tool.name == "sql_db_query":
+                tool.description = QUERY_TOOL_DESCRIPTION
+
+    # Ranked full-text search, available once `python -m ask_dcnc.search` has built the index
+    if has_search_index(get_db_path(db)):
+        sql_tools += [SearchCoursesTool(db=db), SearchProgramsTool(db=db)]
+
+    tools = sql_tools + RequestsToolkit(
         requests_wrapper=HTMLStripRequestsWrapper(headers={}),
         allow_dangerous_requests=ALLOW_DANGEROUS_REQUEST
     ).get_tools()
@@ -50,8 +90,82 @@ def get_agent(system_prompt: str):
     for tool in tools:
         logger.debug(f"Tool: {tool.name}, Description: {tool.description}")
 
-    return create_react_agent(
+    def prompt(state: AskState) -> list:
+        return [
+            SystemMessage(
+                content=format_system_prompt(system_prompt, state.get("time", ""))
+                        + format_history(state.get("history", ""))
+                        + format_context(state.get("context", ""))
+            )
+        ] + state["messages"]
+
+    agent = create_react_agent(
         model=llm,
         tools=tools,
-        prompt=system_prompt
+        prompt=prompt,
+        state_schema=AskState
+    )
+
+    # Retry steps throttled by Bedrock, slowing down the model's rate limiter, or rejected with expired credentials
+    agent.retry_policy = [get_retry_policy(getattr(llm, "rate_limiter", None)), get_token_retry_policy()]
+    return agent
+
+
+@st.cache_resource(ttl=AGENT_CACHE_TTL, max_entries=AGENT_CACHE_MAX_ENTRIES, show_spinner=False)
+def _get_cached_agent(
+        llm_model: str,
+        temperature: float,
+        answer_style: str,
+        prompt_hash: str,
+        llm_name: str,
+        _llm: BaseChatModel,
+        _system_prompt: str,
+):
+    """
+    Agent registry shared by all sessions
+    Keyed on the model, temperature, answer style, prompt template, and the name of the chat model
+    """
+    logger.info(
+        f"Compiling agent for {llm_model} (temperature {temperature}, {answer_style}, prompt {prompt_hash[:8]})"
+    )
+    return build_agent(llm=_llm, system_prompt=_system_prompt)
+
+
+def get_agent(
+        llm_model: str,
+        temperature: float,
+        answer_style: str,
+        llm: BaseChatModel | None = None,
+        llm_name: str | None = None,
+):
+    """
+    Get a cached LangGraph ReAct agent
+    The current time is not part of the compiled agent, pass it as `time` in the input state
+    :param llm_model: Bedrock model ID
+    :param temperature: Temperature for the LLM
+    :param answer_style: "Brief" or "Comprehensive"
+    :param llm: Chat model to use instead of the Bedrock client
+    :param llm_name: Name of `llm` in the registry, the agent of an unnamed chat model is compiled on every call
+    :return: LangChain runnable for interactions
+    """
+    if llm is None:
+        # The client of a model and temperature is cached and its credentials are refreshed in place
+        llm = client(
+            llm_model=llm_model,
+            temperature=temperature
+        )
+        llm_name = "bedrock"
+
+    system_prompt = get_system_prompt(answer_style)
+    if llm_name is None:
+        return build_agent(llm=llm, system_prompt=system_prompt)
+
+    return _get_cached_agent(
+        llm_model=llm_model,
+        temperature=temperature,
+        answer_style=answer_style,
+        prompt_hash=get_prompt_hash(system_prompt),
+        llm_name=llm_name,
+        _llm=llm,
+        _system_prompt=system_prompt,
     )
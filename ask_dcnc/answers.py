@@ -0,0 +1,79 @@
+"""
+ask_dcnc/answers.py
+On-disk cache of answers to first-turn questions
+"""
+
+import hashlib
+import json
+import os
+import re
+from datetime import timedelta
+
+import streamlit as st
+from loguru import logger
+
+from ask_dcnc.cache import DiskCache
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+ANSWER_CACHE_PATH = os.path.join(BASE_DIR, "cache/answers.sqlite")
+ANSWER_CACHE_TTL = 24 * 60 * 60  # Data and the RMIT website rarely change within a day
+ANSWER_CACHE_MAX_SIZE = 16 * 1024 * 1024  # Characters
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache() -> DiskCache:
+    """
+    Answer cache shared by all sessions
+    :return: DiskCache object
+    """
+    return DiskCache(path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, max_size=ANSWER_CACHE_MAX_SIZE)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalise a question so trivially different spellings share a cache entry
+    :param question: User question
+    :return: Lowercase question without surrounding punctuation and repeated whitespace
+    """
+    return re.sub(r"\s+", " ", question).strip().strip("?!. ").lower()
+
+
+def get_answer_key(question: str, llm_model: str, answer_style: str, temperature: float) -> str:
+    """
+    Cache key of a question for a model and answer style
+    :param question: User question
+    :param llm_model: Bedrock model ID
+    :param answer_style: "Brief" or "Comprehensive"
+    :param temperature: Temperature for the LLM
+    :return: Hex digest
+    """
+    key = json.dumps([normalize_question(question), llm_model, answer_style, temperature])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_cached_answer(key: str) -> tuple[str, list[str], timedelta] | None:
+    """
+    Look up a cached answer
+    :param key: Cache key from `get_answer_key`
+    :return: Answer, thoughts, and the original thinking time, or None on a miss
+    """
+    cached = get_answer_cache().get(key)
+    if cached is None:
+        return None
+    logger.debug(f"Answer cache hit: {get_answer_cache().stats().as_dict()}")
+    return cached["answer"], cached["thoughts"], timedelta(seconds=cached["seconds"])
+
+
+def cache_answer(key: str, answer: str, thoughts: list[str], time_diff: timedelta) -> None:
+    """
+    Store an answer with the thoughts that led to it
+    :param key: Cache key from `get_answer_key`
+    :param answer: Final answer
+    :param thoughts: Thoughts shown in the expander
+    :param time_diff: Time taken to answer
+    """
+    get_answer_cache().put(key, {
+        "answer": answer,
+        "thoughts": thoughts,
+        "seconds": time_diff.total_seconds(),
+    })
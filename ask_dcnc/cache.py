@@ -0,0 +1,200 @@
+"""
+ask_dcnc/cache.py
+In-memory and on-disk caches shared by all sessions
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Hashable
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return asdict(self) | {"hit_rate": self.hit_rate}
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and total size
+    The cache is cleared when its version changes, e.g. the mtime of the database file
+    """
+
+    def __init__(self, max_entries: int, max_size: int):
+        """
+        :param max_entries: Maximum number of entries
+        :param max_size: Maximum total size of the values, as measured by `len`
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Hashable = None
+        self._stats = CacheStats()
+
+    def _check_version(self, version: Hashable) -> None:
+        if version != self._version:
+            if self._entries:
+                self._stats.invalidations += 1
+            self._entries.clear()
+            self._stats.size = 0
+            self._version = version
+
+    def get(self, key: Hashable, version: Hashable = None) -> Any | None:
+        """
+        Get a value and mark it as recently used
+        :param key: Cache key
+        :param version: Current version of the underlying data
+        :return: Cached value, or None on a miss
+        """
+        with self._lock:
+            self._check_version(version)
+            if key not in self._entries:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any, version: Hashable = None) -> None:
+        """
+        Store a value, evicting the least recently used entries to stay within bounds
+        :param key: Cache key
+        :param value: Value, must support `len`
+        :param version: Current version of the underlying data
+        """
+        size = len(value)
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._stats.size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._stats.size += size
+
+            while len(self._entries) > self.max_entries or self._stats.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._stats.size -= len(evicted)
+                self._stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.size = 0
+
+    def stats(self) -> CacheStats:
+        """
+        :return: Snapshot of the hit, miss, and eviction counters
+        """
+        with self._lock:
+            return CacheStats(**asdict(self._stats) | {"entries": len(self._entries)})
+
+
+class DiskCache:
+    """
+    Thread-safe SQLite-backed cache of JSON values with a TTL, bounded by total size with LRU eviction
+    """
+
+    def __init__(self, path: str, ttl: float | None, max_size: int):
+        """
+        :param path: Path to the SQLite cache file, created if missing
+        :param ttl: Seconds before an entry expires, or None to keep entries until evicted
+        :param max_size: Maximum total size of the serialised values in characters
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("pragma journal_mode = wal")
+        self._conn.execute(
+            "create table if not exists cache ("
+            "key text primary key, value text not null, size integer not null, "
+            "created_at real not null, accessed_at real not null)"
+        )
+        self._conn.execute("create index if not exists cache_accessed_at on cache (accessed_at)")
+
+    def get(self, key: str) -> Any | None:
+        """
+        Get a value and mark it as recently used
+        :param key: Cache key
+        :return: Cached value, or None on a miss or if the entry has expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("select value, created_at from cache where key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats.misses += 1
+                return None
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("delete from cache where key = ?", (key,))
+                self._stats.invalidations += 1
+                self._stats.misses += 1
+                return None
+            self._conn.execute("update cache set accessed_at = ? where key = ?", (now, key))
+            self._stats.hits += 1
+        return json.loads(value)
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entries to stay within the size cap
+        :param key: Cache key
+        :param value: JSON-serialisable value
+        """
+        serialised = json.dumps(value, ensure_ascii=False)
+        if len(serialised) > self.max_size:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "insert or replace into cache (key, value, size, created_at, accessed_at) values (?, ?, ?, ?, ?)",
+                (key, serialised, len(serialised), now, now),
+            )
+            total = self._conn.execute("select coalesce(sum(size), 0) from cache").fetchone()[0]
+            while total > self.max_size:
+                oldest_key, size = self._conn.execute(
+                    "select key, size from cache order by accessed_at limit 1"
+                ).fetchone()
+                self._conn.execute("delete from cache where key = ?", (oldest_key,))
+                total -= size
+                self._stats.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("delete from cache where key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("delete from cache")
+
+    def stats(self) -> CacheStats:
+        """
+        :return: Snapshot of the hit, miss, and eviction counters
+        """
+        with self._lock:
+            entries, size = self._conn.execute("select count(*), coalesce(sum(size), 0) from cache").fetchone()
+            return CacheStats(**asdict(self._stats) | {"entries": entries, "size": size})
@@ -4,11 +4,21 @@ Functions related to AWS Bedrock
 """
 
 import os
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Callable
 
 import boto3
 import streamlit as st
 from langchain_aws import ChatBedrock
+from langchain_aws.utils import create_aws_client
+from langgraph.types import RetryPolicy
 from loguru import logger
+from pydantic import SecretStr
+
+from ask_dcnc.throttle import get_error_code, get_rate_limiter
 
 AWS_REGION = os.getenv("AWS_REGION")
 AWS_IDENTITY_POOL_ID = os.getenv("AWS_IDENTITY_POOL_ID")
@@ -19,15 +29,23 @@ COGNITO_PASSWORD = os.getenv("COGNITO_PASSWORD")
 BEDROCK_TOP_P = os.getenv("BEDROCK_TOP_P")
 BEDROCK_MAX_TOKENS = os.getenv("BEDROCK_MAX_TOKENS")
 
+AWS_CREDENTIALS_REFRESH_MARGIN = int(os.getenv("AWS_CREDENTIALS_REFRESH_MARGIN", 10 * 60))  # Refresh ahead of expiry
+AWS_CREDENTIALS_RETRY_INTERVAL = 30
+AWS_CREDENTIALS_DEFAULT_LIFETIME = 45 * 60  # Used if Cognito does not return an expiration
 
-@st.cache_resource(ttl=45 * 60, show_spinner=False)
-def get_aws_keys() -> dict:
+# Bedrock clients rebuilt in place when the credentials are refreshed
+_bedrock_llms: weakref.WeakValueDictionary[int, ChatBedrock] = weakref.WeakValueDictionary()
+
+
+def fetch_aws_keys(idp_client=None, identity_client=None) -> dict:
     """
-    Obtain AWS credentials using Cognito and cache them in Streamlit
+    Obtain AWS credentials using Cognito
     Original authors: Cyrus Gao, extended by Xiang Li
-    :return: Dictionary with AWS credentials
+    :param idp_client: cognito-idp client, created if not given
+    :param identity_client: cognito-identity client, created if not given
+    :return: Dictionary with AWS credentials, including their expiration
     """
-    idp_client = boto3.client("cognito-idp", region_name=AWS_REGION)
+    idp_client = idp_client or boto3.client("cognito-idp", region_name=AWS_REGION)
     response = idp_client.initiate_auth(
         AuthFlow="USER_PASSWORD_AUTH",
         AuthParameters={
@@ -37,7 +55,7 @@ def get_aws_keys() -> dict:
     )
     id_token = response["AuthenticationResult"]["IdToken"]
 
-    identity_client = boto3.client(
+    identity_client = identity_client or boto3.client(
         "cognito-identity", region_name=AWS_REGION,
     )
     identity_response = identity_client.get_id(
@@ -54,46 +72,237 @@ def get_aws_keys() -> dict:
         },
     )
 
-    creds = creds_response["Credentials"]
-    logger.success(f"AWS credentials obtained")
-    return creds
+    return creds_response["Credentials"]
+
+
+def get_expiration(credentials: dict) -> float:
+    """
+    :param credentials: Credentials from `fetch_aws_keys`
+    :return: Unix time the credentials expire at
+    """
+    expiration = credentials.get("Expiration")
+    if isinstance(expiration, str):
+        expiration = datetime.fromisoformat(expiration)
+    if isinstance(expiration, datetime):
+        return expiration.timestamp()
+    return time.time() + AWS_CREDENTIALS_DEFAULT_LIFETIME
+
+
+def is_expired_token_error(e: Exception) -> bool:
+    """
+    :param e: Exception raised by boto3
+    :return: True if the exception was caused by expired credentials
+    """
+    return get_error_code(e) == "ExpiredTokenException"
+
+
+class CredentialManager:
+    """
+    Keeps AWS credentials valid by refreshing them in a background thread ahead of their expiry
+    Concurrent refreshes are coalesced, so Cognito is only called once per expiry
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[], dict] = fetch_aws_keys,
+            refresh_margin: float = AWS_CREDENTIALS_REFRESH_MARGIN,
+            retry_interval: float = AWS_CREDENTIALS_RETRY_INTERVAL,
+    ):
+        """
+        :param fetch: Function obtaining new credentials, see `fetch_aws_keys`
+        :param refresh_margin: Seconds before expiry to refresh the credentials
+        :param retry_interval: Seconds between attempts after a failed background refresh
+        """
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.refreshes = 0
+        self._credentials: dict | None = None
+        self._expires_at = 0.0
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._listeners: list[Callable[[dict], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def get(self) -> dict:
+        """
+        Get valid credentials, only blocking if there are none yet or they have already expired
+        :return: Dictionary with AWS credentials
+        """
+        credentials = self._credentials
+        if credentials is not None and time.time() < self._expires_at:
+            return credentials
+        return self.refresh(stale=credentials)
+
+    def refresh(self, stale: dict | None = None) -> dict:
+        """
+        Obtain new credentials, unless another caller already replaced the stale ones
+        :param stale: Credentials the caller considers outdated
+        :return: Dictionary with AWS credentials
+        """
+        with self._refresh_lock:
+            if self._credentials is not stale and time.time() < self._expires_at:
+                return self._credentials
+            return self._replace()
+
+    def invalidate(self) -> dict:
+        """
+        Replace credentials AWS rejected as expired ahead of their expiration, e.g. because of clock skew
+        Callers that fail together are coalesced, credentials obtained within the retry interval are kept
+        :return: Dictionary with AWS credentials
+        """
+        with self._refresh_lock:
+            if self._credentials is not None and time.time() - self._refreshed_at < self.retry_interval:
+                return self._credentials
+            return self._replace()
+
+    def _replace(self) -> dict:
+        # Called with the refresh lock held
+        credentials = self.fetch()
+        self._credentials = credentials
+        self._expires_at = get_expiration(credentials)
+        self._refreshed_at = time.time()
+        self.refreshes += 1
+        logger.success(f"AWS credentials obtained, valid for {self._expires_at - time.time():.0f}s")
+
+        for listener in self._listeners:
+            try:
+                listener(credentials)
+            except Exception as e:
+                logger.error(f"Error applying refreshed AWS credentials: {e}")
+        return credentials
+
+    def subscribe(self, listener: Callable[[dict], None]) -> None:
+        """
+        :param listener: Function called with the new credentials after every refresh
+        """
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        """
+        Start the background refresh thread if it is not running
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="aws-credentials", daemon=True)
+        self._thread.start()
 
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
 
-@st.cache_resource(ttl=45 * 60, show_spinner=False)
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            delay = self._expires_at - self.refresh_margin - time.time()
+            if self._credentials is not None and self._stop.wait(max(delay, self.retry_interval)):
+                return
+            try:
+                self.refresh(stale=self._credentials)
+            except Exception as e:
+                logger.error(f"Error refreshing AWS credentials, retrying in {self.retry_interval}s: {e}")
+                if self._stop.wait(self.retry_interval):
+                    return
+
+
+def _rebuild_bedrock_clients(credentials: dict) -> None:
+    for llm in list(_bedrock_llms.values()):
+        llm.aws_access_key_id = SecretStr(credentials["AccessKeyId"])
+        llm.aws_secret_access_key = SecretStr(credentials["SecretKey"])
+        llm.aws_session_token = SecretStr(credentials["SessionToken"])
+        llm.client = create_aws_client(
+            region_name=llm.region_name,
+            aws_access_key_id=llm.aws_access_key_id,
+            aws_secret_access_key=llm.aws_secret_access_key,
+            aws_session_token=llm.aws_session_token,
+            endpoint_url=llm.endpoint_url,
+            config=llm.config,
+            service_name="bedrock-runtime",
+        )
+    logger.debug(f"Rebuilt {len(_bedrock_llms)} Bedrock clients with refreshed credentials")
+
+
+@st.cache_resource(show_spinner=False)
+def get_credential_manager() -> CredentialManager:
+    """
+    Credential manager shared by all sessions, started on first use
+    :return: CredentialManager with valid credentials
+    """
+    manager = CredentialManager()
+    manager.subscribe(_rebuild_bedrock_clients)
+    manager.get()
+    manager.start()
+    return manager
+
+
+def get_aws_keys() -> dict:
+    """
+    Obtain AWS credentials, refreshed in the background before they expire
+    :return: Dictionary with AWS credentials
+    """
+    return get_credential_manager().get()
+
+
+def _create_llm(llm_model: str, temperature: float, credentials: dict) -> ChatBedrock:
+    return ChatBedrock(
+        region_name=AWS_REGION,
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretKey"],
+        aws_session_token=credentials["SessionToken"],
+        model_id=llm_model,
+        temperature=temperature,
+        max_tokens=int(BEDROCK_MAX_TOKENS),
+        model_kwargs={
+            "top_p": float(BEDROCK_TOP_P),
+        },
+        rate_limiter=get_rate_limiter(llm_model),
+    )
+
+
+@st.cache_resource(show_spinner=False)
 def client(
         llm_model: str,
         temperature: float,
 ) -> ChatBedrock:
     """
     Bedrock Client for LangChain cached in Streamlit
+    The client is rebuilt in place when the credentials are refreshed, so the object never changes
     :param llm_model: Bedrock model ID
     :param temperature: Temperature for the LLM
     :return: ChatBedrock object
     """
-    credentials = get_aws_keys()
-    try:
-        llm = ChatBedrock(
-            region_name=AWS_REGION,
-            aws_access_key_id=credentials["AccessKeyId"],
-            aws_secret_access_key=credentials["SecretKey"],
-            aws_session_token=credentials["SessionToken"],
-            model_id=llm_model,
-            temperature=temperature,
-            max_tokens=int(BEDROCK_MAX_TOKENS),
-            model_kwargs={
-                "top_p": float(BEDROCK_TOP_P),
-            },
-        )
-        logger.success("LLM client loaded.")
-        logger.debug(f"LLM model: {llm_model}")
-        logger.debug(f"LLM temperature: {temperature}")
-        logger.debug(f"LLM top P: {BEDROCK_TOP_P}")
-        logger.debug(f"LLM max Tokens: {BEDROCK_MAX_TOKENS}")
-    except Exception as e:
-        logger.error(f"Error loading LLM: {e}")
-        if e.response["Error"]["Code"] == "ExpiredTokenException":
-            get_aws_keys.clear()
-            llm = client(llm_model=llm_model, temperature=temperature)
-        else:
-            raise
+    # Building the client makes no AWS call, expired credentials surface when it is invoked, see get_token_retry_policy
+    llm = _create_llm(llm_model, temperature, get_credential_manager().get())
+    _bedrock_llms[id(llm)] = llm
+    logger.success("LLM client loaded.")
+    logger.debug(f"LLM model: {llm_model}")
+    logger.debug(f"LLM temperature: {temperature}")
+    logger.debug(f"LLM top P: {BEDROCK_TOP_P}")
+    logger.debug(f"LLM max Tokens: {BEDROCK_MAX_TOKENS}")
     return llm
+
+
+def get_token_retry_policy(manager: Callable[[], CredentialManager] = get_credential_manager) -> RetryPolicy:
+    """
+    Retry graph nodes whose Bedrock call was rejected with expired credentials once, after replacing the credentials
+    :param manager: Function returning the credential manager of the Bedrock clients
+    :return: RetryPolicy for the agent graph
+    """
+
+    def retry_on(e: Exception) -> bool:
+        if not is_expired_token_error(e):
+            return False
+        try:
+            manager().invalidate()
+        except Exception as refresh_error:
+            logger.error(f"Error replacing expired AWS credentials: {refresh_error}")
+            return False
+        return True
+
+    return RetryPolicy(initial_interval=0.1, max_attempts=2, retry_on=retry_on)
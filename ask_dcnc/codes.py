@@ -0,0 +1,12 @@
+"""
+ask_dcnc/codes.py
+Patterns of RMIT course, program, and plan codes, without dependencies so ingestion can use them
+"""
+
+import re
+
+# Formats from prompts/system.md
+COURSE_CODE_PATTERN = re.compile(r"\b[A-Z]{4}\d{4}[A-Z]?\b", re.IGNORECASE)
+PROGRAM_CODE_PATTERN = re.compile(r"\b[A-Z]{2}\d{3}\b", re.IGNORECASE)
+PLAN_CODE_PATTERN = re.compile(r"\b[A-Z]{2}\d{3}[A-Z]\d{2,3}(?:[A-Z]{5})?\b", re.IGNORECASE)
+PLAN_PROGRAM_PATTERN = re.compile(r"^[A-Z]{2}\d{3}(?=[A-Z]\d)", re.IGNORECASE)  # Program code of a plan code
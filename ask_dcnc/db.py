@@ -1,10 +1,17 @@
 import os
+from functools import partial
 
 import streamlit as st
 from langchain_community.utilities import SQLDatabase
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DisconnectionError
+
+from ask_dcnc.sql import SQLITE_POOL_SIZE, connect_read_only, get_file_signature, get_internal_tables
 
 BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
-SQLITE_URI = f"sqlite:///{BASE_DIR}/data/dcnc.sqlite"
+SQLITE_PATH = os.path.join(BASE_DIR, "data/dcnc.sqlite")
+SQLITE_URI = f"sqlite:///{SQLITE_PATH}"
 
 
 @st.cache_resource(show_spinner=False)
@@ -14,6 +21,23 @@ def get_db(uri: str) -> SQLDatabase:
     :param uri: SQLAlchemy URI for the database
     :return: SQLDatabase object
     """
-    return SQLDatabase.from_uri(
+    db_path = make_url(uri).database
+    db = SQLDatabase.from_uri(
         uri,
+        # Same read-only, tuned connections as the local tools, pooled by SQLAlchemy across session threads
+        engine_args={"creator": partial(connect_read_only, db_path), "pool_size": SQLITE_POOL_SIZE},
+        ignore_tables=get_internal_tables(db_path),  # Search index is exposed via its own tools
         max_string_length=6144)
+
+    # Immutable connections never notice the file being replaced, e.g. by `python -m ask_dcnc.ingest`, so pooled
+    # connections to the old file are discarded on checkout, like `ask_dcnc.sql.ConnectionPool` does
+    @event.listens_for(db._engine, "connect")
+    def record_signature(dbapi_connection, connection_record) -> None:
+        connection_record.info["signature"] = get_file_signature(db_path)
+
+    @event.listens_for(db._engine, "checkout")
+    def check_signature(dbapi_connection, connection_record, connection_proxy) -> None:
+        if connection_record.info.get("signature") != get_file_signature(db_path):
+            raise DisconnectionError(f"{db_path} was replaced")
+
+    return db
@@ -0,0 +1,123 @@
+"""
+ask_dcnc/history.py
+Conversation history compaction so long chats do not resend everything on every turn
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from loguru import logger
+
+from ask_dcnc.client import client
+from ask_dcnc.tokens import estimate_tokens
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 4000))
+HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", 4))  # Recent question/answer pairs kept verbatim
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "anthropic.claude-3-haiku-20240307-v1:0")
+HISTORY_SUMMARY_WORDS = 150
+HISTORY_SUMMARY_TIMEOUT = float(os.getenv("HISTORY_SUMMARY_TIMEOUT", 5))  # Seconds before truncating instead
+
+SUMMARY_PROMPT = (
+    "Summarise the conversation between a student and the RMIT program and course advisor below in under "
+    f"{HISTORY_SUMMARY_WORDS} words. Keep every course code, program code, plan code, name, and URL that was "
+    "mentioned. Reply with the summary only.\n\n{conversation}"
+)
+
+
+@dataclass
+class HistoryState:
+    """
+    Rolling summary of the turns that have left the window, kept in the session state
+    """
+    summary: str = ""
+    summarized: int = 0  # Number of leading messages folded into the summary
+
+
+# Summary calls that time out finish in the background instead of holding up the turn
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history")
+
+
+def count_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+def format_transcript(messages: list[dict]) -> str:
+    return "\n\n".join(f"{message['role'].title()}: {message['content']}" for message in messages)
+
+
+def summarize(previous_summary: str, messages: list[dict], llm_model: str = HISTORY_SUMMARY_MODEL) -> str:
+    """
+    Fold messages into the rolling summary with a cheap model, or by truncation if the model is unavailable or slower
+    than HISTORY_SUMMARY_TIMEOUT
+    :param previous_summary: Current summary
+    :param messages: Messages leaving the window
+    :param llm_model: Bedrock model ID for summarising
+    :return: New summary
+    """
+    conversation = format_transcript(messages)
+    if previous_summary:
+        conversation = f"Summary of earlier turns: {previous_summary}\n\n{conversation}"
+
+    try:
+        llm = client(llm_model=llm_model, temperature=0.0)
+        future = _summary_executor.submit(llm.invoke, SUMMARY_PROMPT.format(conversation=conversation))
+        return future.result(timeout=HISTORY_SUMMARY_TIMEOUT).content.strip()
+    except Exception as e:
+        logger.warning(f"Unable to summarise history, truncating instead: {e!r}")
+        truncated = [f"{message['role'].title()}: {message['content'][:200]}" for message in messages]
+        return " ".join(filter(None, [previous_summary] + truncated))
+
+
+def compact_history(
+        messages: list[dict],
+        state: HistoryState,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        window_turns: int = HISTORY_WINDOW_TURNS,
+        summarizer=summarize,
+) -> list[dict]:
+    """
+    Keep the latest turns within a token budget and fold older turns into a rolling summary
+    The summary is passed to the agent separately, see `format_history`. Calling this again after the answer folds the
+    turns that the next question would push out of the window, so the next turn rarely waits for the summary
+    :param messages: Full chat history ending with the new question, or with the answer to fold in advance
+    :param state: Rolling summary of this session, updated in place
+    :param token_budget: Maximum estimated tokens of the messages sent
+    :param window_turns: Maximum number of earlier question/answer pairs sent verbatim
+    :param summarizer: Function folding messages into a summary, see `summarize`
+    :return: Messages to send
+    """
+    if state.summarized > len(messages):
+        state.summary, state.summarized = "", 0
+
+    start = max(state.summarized, len(messages) - 1 - 2 * window_turns)
+    while start < len(messages) - 1 and count_tokens(messages[start:]) > token_budget:
+        start += 1
+
+    # The window must start with a question
+    while start < len(messages) - 1 and messages[start]["role"] != "user":
+        start += 1
+
+    if start > state.summarized:
+        state.summary = summarizer(state.summary, messages[state.summarized:start])
+        state.summarized = start
+
+    window = messages[start:]
+    full_tokens = count_tokens(messages)
+    sent_tokens = count_tokens(window) + (estimate_tokens(state.summary) if state.summary else 0)
+    logger.info(
+        f"History: {len(messages)} messages, {full_tokens} tokens -> "
+        f"{len(window)} messages + summary, {sent_tokens} tokens (saved {full_tokens - sent_tokens})"
+    )
+    return window
+
+
+def format_history(summary: str) -> str:
+    """
+    Section appended to the system prompt with the summary of earlier turns
+    :param summary: Rolling summary
+    :return: System prompt section, or an empty string if there is no summary
+    """
+    if not summary:
+        return ""
+    return f"\n\n# Earlier Conversation\n\n{summary}"
@@ -3,36 +3,162 @@ ask_dcnc/html.py
 HTML-related utilities
 """
 
-import re
+import os
+import time
+from typing import Optional
 
-from bs4 import BeautifulSoup
+import requests
+import streamlit as st
 from langchain_community.utilities import TextRequestsWrapper
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ask_dcnc.cache import DiskCache
+from ask_dcnc.snapshots import SnapshotStore
+from ask_dcnc.strip import HTML_MAX_CHARS, HTML_STRIP_ENGINE, TRUNCATION_MARKER, strip_html
+from ask_dcnc.tracing import trace_span
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+HTTP_CACHE_PATH = os.path.join(BASE_DIR, "cache/http.sqlite")
+HTTP_CACHE_FRESHNESS = 60 * 60  # Serve without revalidating for an hour
+HTTP_CACHE_TTL = 7 * 24 * 60 * 60  # Keep stale entries for a week so they can be revalidated with a conditional GET
+HTTP_CACHE_MAX_SIZE = 256 * 1024 * 1024  # Characters of raw HTML and stripped text
+HTTP_POOL_SIZE = 16
+HTTP_TIMEOUT = 10
+
+
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    """
+    Pooled HTTP session shared by all sessions
+    :return: requests Session with keep-alive connections and retries
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504)),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_cache() -> DiskCache:
+    """
+    HTTP cache shared by all sessions
+    :return: DiskCache of responses keyed by URL
+    """
+    return DiskCache(path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL, max_size=HTTP_CACHE_MAX_SIZE)
+
+
+@st.cache_resource(show_spinner=False)
+def get_snapshot_store() -> SnapshotStore:
+    """
+    Snapshot store shared by all sessions
+    :return: SnapshotStore at SNAPSHOT_PATH
+    """
+    return SnapshotStore()
+
+
+def strip_response(response: requests.Response) -> str:
+    """
+    Strip a response according to its content type, skipping the HTML parser for other text
+    :param response: HTTP response
+    :return: Plain text
+    """
+    content_type = response.headers.get("Content-Type", "").lower()
+    if not content_type or "html" in content_type:
+        return strip_html(response.text)
+    if content_type.startswith("text/") or "json" in content_type or "xml" in content_type:
+        text = response.text
+        if HTML_MAX_CHARS and len(text) > HTML_MAX_CHARS:
+            text = text[:HTML_MAX_CHARS] + TRUNCATION_MARKER
+        return text
+    return f"Unsupported content type: {content_type}"
 
 
 class HTMLStripRequestsWrapper(TextRequestsWrapper):
     """
     Strips down HTML tags from the webpages to avoid exceeding token limits
+    Pages in the snapshot store are served from it, others are cached on disk and revalidated with conditional requests
     """
 
+    http_cache: Optional[DiskCache] = None  # Defaults to the shared cache from `get_http_cache`
+    snapshots: Optional[SnapshotStore] = None  # Defaults to the shared store from `get_snapshot_store`
+    freshness: float = HTTP_CACHE_FRESHNESS
+
+    def _fetch(self, url: str, headers: dict, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        return get_session().get(
+            url,
+            headers=(self.headers or {}) | headers,
+            auth=self.auth,
+            verify=self.verify,
+            **kwargs,
+        )
+
     def get(self, url: str, **kwargs) -> str:
-        html = super().get(url, **kwargs)
+        snapshots = self.snapshots or get_snapshot_store()
+        with trace_span("snapshot_lookup", url=url) as span:
+            snapshot = snapshots.get(url)
+            span.update(result="miss" if snapshot is None else "hit" if snapshot.fresh else "stale")
+        if snapshot and snapshot.fresh:
+            logger.debug(f"Snapshot hit: {url}")
+            return snapshot.text
+
+        # Stale snapshots are refetched, but still beat a failed request or an error page
+        try:
+            text, ok = self._get_live(url, **kwargs)
+        except requests.RequestException as e:
+            if snapshot is None:
+                raise
+            logger.warning(f"Request failed, serving stale snapshot: {e}")
+            return snapshot.text
+        if not ok and snapshot:
+            logger.warning(f"Request failed, serving stale snapshot: {url}")
+            return snapshot.text
+        return text
+
+    def _get_live(self, url: str, **kwargs) -> tuple[str, bool]:
+        """
+        Get a page through the HTTP cache
+        :return: Stripped text, and whether it is the page rather than an error
+        """
+        cache = self.http_cache or get_http_cache()
+        cached = cache.get(url)
 
-        # Parse and remove script/style tags
-        soup = BeautifulSoup(html, "html.parser")
-        for tag in soup(["script", "style"]):
-            tag.decompose()
+        if cached and time.time() - cached["fetched_at"] < self.freshness:
+            logger.debug(f"HTTP cache hit: {url}")
+            return cached["text"], True
 
-        # Preserve URLs
-        for a in soup.find_all("a", href=True):
-            text = a.get_text(strip=True) or a["href"]
-            a.replace_with(f"[{text}]({a['href']})")
+        # Revalidate stale entries
+        headers = {}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
 
-        # Remove all mobile nav elements
-        for tag in soup.select("[class*='mobinav']"):
-            tag.decompose()
+        with trace_span("http_fetch", url=url) as span:
+            response = self._fetch(url, headers, **kwargs)
+            span.update(status=response.status_code, html_chars=len(response.text))
 
-        # Strip tags, whitespaces, and newlines
-        text = soup.get_text(strip=True)
-        text = text.replace("\\n", " ")
+        if cached and response.status_code == 304:
+            logger.debug(f"HTTP cache revalidated: {url}")
+            cache.put(url, cached | {"fetched_at": time.time()})
+            return cached["text"], True
 
-        return re.sub(r'\s+', ' ', text)
+        with trace_span("html_strip", engine=HTML_STRIP_ENGINE) as span:
+            text = strip_response(response)
+            span.update(text_chars=len(text))
+        if response.ok:
+            cache.put(url, {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "html": response.text,
+                "text": text,
+            })
+        return text, response.ok
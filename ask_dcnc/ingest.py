@@ -0,0 +1,404 @@
+"""
+ask_dcnc/ingest.py
+Build dcnc.sqlite from the scraped course guides and program pages, and swap it in atomically
+
+Pages are streamed from the scraper CSVs, parsed in a process pool, and bulk-loaded in a single transaction into a new
+file next to the database. The search index and advised indexes are built before the new file replaces the old one, so
+the running app only ever sees a complete database.
+
+Usage: python -m ask_dcnc.ingest [--courses CSV] [--programs CSV] [--output DB] [--workers N] [--no-programs]
+"""
+
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import closing
+from html.parser import HTMLParser
+from typing import Callable, Iterable, Iterator
+
+from loguru import logger
+
+from ask_dcnc.advisor import apply_indexes
+from ask_dcnc.codes import COURSE_CODE_PATTERN, PLAN_CODE_PATTERN, PLAN_PROGRAM_PATTERN
+from ask_dcnc.db import BASE_DIR, SQLITE_PATH
+from ask_dcnc.search import build_search_index
+
+RAW_DATA_DIR = os.path.join(BASE_DIR, "data/raw_data")
+COURSES_CSV = os.path.join(RAW_DATA_DIR, "valid_courses_complete.csv")
+PROGRAMS_CSV = os.path.join(RAW_DATA_DIR, "programs.csv")
+BATCH_SIZE = 256  # Pages per task sent to a worker, and rows per executemany
+TASKS_PER_WORKER = 4  # Tasks in flight per worker, bounding memory however large the CSVs are
+
+SCHEMA_SQL = """
+create table course_coordinator(id integer primary key, name text, phone text, email text, location text);
+create table course(
+    id text primary key, title text, coordinator integer references course_coordinator(id), prerequisites text,
+    description text, url text
+);
+create table course_code(id text references course(id), code text, primary key(id, code));
+create table program(code text primary key, title text, url text);
+create table program_plan(
+    plan_code text primary key, program_code text references program(code), alt_title text, url text
+);
+create table program_course(
+    plan_code text references program_plan(plan_code), year integer, courses text, primary key(plan_code, year)
+);
+create table program_elective(
+    plan_code text references program_plan(plan_code), type text, title text, courses text,
+    primary key(plan_code,type,title)
+);
+"""
+# Created after the bulk load, which is faster than maintaining them on every insert
+INDEX_SQL = """
+create index course_code_code on course_code (code);
+create index program_plan_program_code on program_plan (program_code);
+"""
+
+# Labels of the course guide's contentArea, and the course fields they introduce
+COURSE_LABELS = {
+    "course title": "title",
+    "course code": "codes",
+    "course coordinator": "coordinator_name",
+    "course coordinator phone": "coordinator_phone",
+    "course coordinator email": "coordinator_email",
+    "course coordinator location": "coordinator_location",
+    "pre-requisite courses and assumed knowledge and capabilities": "prerequisites",
+    "course description": "description",
+}
+# Labels that end the field before them without starting one
+COURSE_STOP_LABELS = {
+    "credit points", "terms", "flexible terms", "course coordinator availability", "required prior study",
+    "objectives/learning outcomes/capability development", "course learning outcomes",
+    "overview of learning activities",
+    "overview of learning resources", "overview of assessment", "part b: course detail",
+}
+TITLE_SUFFIX_PATTERN = re.compile(r"\s+-\s+RMIT University$")
+YEAR_PATTERN = re.compile(r"^year\s+(one|two|three|four|five|six|\d)\b", re.IGNORECASE)
+YEAR_NUMBERS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6}
+ELECTIVE_PATTERN = re.compile(r"\b(major|minor|elective|option)s?\b", re.IGNORECASE)
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "table", "tr", "td", "th", "li", "ul", "ol", "dt", "dd", "br",
+    "h1", "h2", "h3", "h4", "h5", "h6", "strong", "b",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+INSERT_TABLE_PATTERN = re.compile(r"\binto (\w+)")
+
+
+class _BlockParser(HTMLParser):
+    """
+    Splits HTML into text blocks at block elements, keeping which blocks are headings
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: list[tuple[bool, str]] = []
+        self.pending: list[str] = []
+        self.heading_depth = 0
+        self.skip_depth = 0
+
+    def _flush(self) -> None:
+        text = " ".join("".join(self.pending).split())
+        self.pending = []
+        if text:
+            self.blocks.append((self.heading_depth > 0, text))
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in ("script", "style"):
+            self.skip_depth += 1
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in HEADING_TAGS:
+            self.heading_depth += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in ("script", "style"):
+            self.skip_depth = max(0, self.skip_depth - 1)
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in HEADING_TAGS:
+            self.heading_depth = max(0, self.heading_depth - 1)
+
+    def handle_data(self, data: str) -> None:
+        if not self.skip_depth:
+            self.pending.append(data)
+
+
+def html_blocks(html: str) -> list[tuple[bool, str]]:
+    """
+    :param html: HTML fragment
+    :return: Whether each block is a heading, and its text with whitespace collapsed
+    """
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+    parser._flush()
+    return parser.blocks
+
+
+def parse_course(row: dict) -> dict | None:
+    """
+    Parse a course guide into the fields of the course tables
+    :param row: Row of valid_courses_complete.csv
+    :return: Course fields, or None if the page has no course
+    """
+    fields: dict[str, list[str]] = {}
+    current = None
+    for _, text in html_blocks(row["body_html"]):
+        label, _, value = text.partition(":")
+        key = label.strip().lower()
+        if key in COURSE_LABELS:
+            current = COURSE_LABELS[key]
+            fields.setdefault(current, [])
+            text = value
+        elif key in COURSE_STOP_LABELS or text.lower() in COURSE_STOP_LABELS:
+            current = None
+            continue
+        if current and text.strip():
+            fields[current].append(text.strip())
+
+    def field(name: str, separator: str = " ") -> str | None:
+        return separator.join(fields[name]) if fields.get(name) else None
+
+    title = field("title") or TITLE_SUFFIX_PATTERN.sub("", row.get("title") or "").strip()
+    if not title:
+        return None
+    codes = list(dict.fromkeys(code.upper() for code in COURSE_CODE_PATTERN.findall(field("codes") or "")))
+    return {
+        "id": row["course_id"].zfill(6),
+        "title": title,
+        "codes": codes,
+        "coordinator": (
+            field("coordinator_name"), field("coordinator_phone"), field("coordinator_email"),
+            field("coordinator_location"),
+        ),
+        "prerequisites": field("prerequisites", "\n"),
+        "description": field("description", "\n"),
+        "url": row["url"],
+    }
+
+
+def parse_program(row: dict) -> dict | None:
+    """
+    Parse the sections of a program plan page into its core courses by year and its majors, minors, and electives
+    :param row: Row of programs.csv
+    :return: Program plan fields, or None if the URL is not a plan page
+    """
+    url = row["url"].rstrip("/")
+    parent_url, _, slug = url.rpartition("/")
+    # programs.csv also holds program pages, e.g. ".../bachelor-of-computer-science-bp094", which have no plan
+    if not PLAN_CODE_PATTERN.fullmatch(slug):
+        return None
+    plan_code = slug.upper()
+
+    title, years, electives = None, {}, {}
+    section = None  # ("year", n) or ("elective", type, title)
+    for is_heading, text in html_blocks(row["html"]):
+        if is_heading:
+            if title is None:
+                title = text
+            if match := YEAR_PATTERN.match(text):
+                year = match.group(1).lower()
+                section = ("year", int(year) if year.isdigit() else YEAR_NUMBERS[year])
+            elif match := ELECTIVE_PATTERN.search(text):
+                kind = match.group(1).lower()
+                name = " ".join(ELECTIVE_PATTERN.sub(" ", text).replace(":", " ").split()) or text
+                section = ("elective", kind, name)
+            continue
+        if section:
+            codes = [code.upper() for code in COURSE_CODE_PATTERN.findall(text)]
+            target = years if section[0] == "year" else electives
+            target.setdefault(section[1:] if section[0] == "elective" else section[1], []).extend(codes)
+
+    return {
+        "plan_code": plan_code,
+        "program_code": PLAN_PROGRAM_PATTERN.match(plan_code).group(0),
+        "title": title or plan_code,
+        "url": url,
+        "program_url": parent_url,
+        "years": [(year, ", ".join(dict.fromkeys(codes))) for year, codes in sorted(years.items()) if codes],
+        "electives": [(kind, name, ", ".join(dict.fromkeys(codes))) for (kind, name), codes in electives.items()],
+    }
+
+
+def read_csv(path: str) -> Iterator[dict]:
+    """
+    Stream the rows of a scraper CSV, whose HTML columns are larger than the csv module allows by default
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def _parse_batch(parse: Callable[[dict], dict | None], rows: list[dict]) -> list[dict]:
+    return [record for row in rows if (record := parse(row)) is not None]
+
+
+def parallel_parse(parse: Callable[[dict], dict | None], rows: Iterable[dict], executor: ProcessPoolExecutor,
+                   workers: int) -> Iterator[dict]:
+    """
+    Parse rows in worker processes, reading ahead only a bounded number of batches
+    :param parse: Module-level parse function
+    :param rows: Rows, read lazily
+    :param executor: Process pool
+    :param workers: Number of processes in the pool
+    :return: Parsed records, in the order of the rows
+    """
+    in_flight: deque[Future] = deque()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            in_flight.append(executor.submit(_parse_batch, parse, batch))
+            batch = []
+            if len(in_flight) >= workers * TASKS_PER_WORKER:
+                yield from in_flight.popleft().result()
+    if batch:
+        in_flight.append(executor.submit(_parse_batch, parse, batch))
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+
+class _Loader:
+    """
+    Buffers rows per table and inserts them with executemany
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.buffers: dict[str, list[tuple]] = {}
+        self.counts: dict[str, int] = {}
+
+    def add(self, sql: str, row: tuple) -> None:
+        buffer = self.buffers.setdefault(sql, [])
+        buffer.append(row)
+        if len(buffer) >= BATCH_SIZE:
+            self.flush(sql)
+
+    def flush(self, sql: str | None = None) -> None:
+        for key in [sql] if sql else list(self.buffers):
+            table = INSERT_TABLE_PATTERN.search(key).group(1)
+            self.conn.executemany(key, self.buffers[key])
+            self.counts[table] = self.counts.get(table, 0) + len(self.buffers[key])
+            self.buffers[key] = []
+
+
+def load(conn: sqlite3.Connection, courses: Iterable[dict], programs: Iterable[dict]) -> dict[str, int]:
+    """
+    Insert parsed courses and program plans
+    :return: Rows inserted per table
+    """
+    loader = _Loader(conn)
+    coordinators: dict[tuple, int] = {}
+    for course in courses:
+        coordinator_id = None
+        if any(course["coordinator"]):
+            if (coordinator_id := coordinators.get(course["coordinator"])) is None:
+                coordinator_id = coordinators[course["coordinator"]] = len(coordinators) + 1
+                loader.add(
+                    "insert into course_coordinator values (?, ?, ?, ?, ?)", (coordinator_id, *course["coordinator"])
+                )
+        loader.add(
+            "insert or ignore into course values (?, ?, ?, ?, ?, ?)",
+            (
+                course["id"], course["title"], coordinator_id, course["prerequisites"], course["description"],
+                course["url"],
+            ),
+        )
+        for code in course["codes"]:
+            loader.add("insert or ignore into course_code values (?, ?)", (course["id"], code))
+
+    for plan in programs:
+        loader.add(
+            "insert or ignore into program values (?, ?, ?)", (plan["program_code"], plan["title"], plan["program_url"])
+        )
+        loader.add(
+            "insert or ignore into program_plan values (?, ?, ?, ?)",
+            (plan["plan_code"], plan["program_code"], plan["title"], plan["url"]),
+        )
+        for year, courses in plan["years"]:
+            loader.add("insert or ignore into program_course values (?, ?, ?)", (plan["plan_code"], year, courses))
+        for kind, title, courses in plan["electives"]:
+            loader.add(
+                "insert or ignore into program_elective values (?, ?, ?, ?)", (plan["plan_code"], kind, title, courses)
+            )
+    loader.flush()
+    return loader.counts
+
+
+def build_database(
+        courses_csv: str = COURSES_CSV,
+        programs_csv: str = PROGRAMS_CSV,
+        output: str = SQLITE_PATH,
+        workers: int | None = None,
+        no_programs: bool = False,
+) -> None:
+    """
+    Build a new database from the scraper CSVs and atomically replace the output with it
+    :param courses_csv: valid_courses_complete.csv from data/scripts/scrape_courses.py
+    :param programs_csv: programs.csv from data/scripts/scrape_program_details.py
+    :param output: Database path, a symlink is followed so the file it points to is replaced
+    :param workers: Parser processes, defaults to the number of CPUs
+    :param no_programs: Build a database of courses only, rather than refusing to when no programs were parsed
+    """
+    if not no_programs and not os.path.exists(programs_csv):
+        raise FileNotFoundError(f"{programs_csv} not found, keeping the current database. Pass --no-programs to "
+                                f"build one without programs.")
+    workers = workers or os.cpu_count() or 1
+    target = os.path.realpath(output)
+    # Built in the same directory, so the final rename cannot cross file systems
+    building = f"{target}.building"
+    if os.path.exists(building):
+        os.remove(building)
+
+    start = time.perf_counter()
+    with closing(sqlite3.connect(building, isolation_level=None)) as conn:
+        # Nothing reads the new file until it is complete, so skip the rollback journal and fsyncs
+        conn.execute("pragma journal_mode = off")
+        conn.execute("pragma synchronous = off")
+        conn.execute("pragma cache_size = -65536")
+        conn.executescript(SCHEMA_SQL)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            conn.execute("begin")
+            counts = load(
+                conn,
+                parallel_parse(parse_course, read_csv(courses_csv), executor, workers),
+                [] if no_programs else parallel_parse(parse_program, read_csv(programs_csv), executor, workers),
+            )
+            conn.execute("commit")
+        logger.info(f"Loaded {counts} in {time.perf_counter() - start:.1f}s with {workers} workers.")
+        if not counts.get("course"):
+            raise RuntimeError(f"No courses parsed from {courses_csv}, keeping the current database.")
+        if not no_programs and not counts.get("program_plan"):
+            raise RuntimeError(f"No program plans parsed from {programs_csv}, keeping the current database.")
+
+    with closing(sqlite3.connect(building)) as conn:
+        conn.executescript(INDEX_SQL)
+    build_search_index(building)
+    apply_indexes(building)
+    with closing(sqlite3.connect(building)) as conn:
+        conn.execute("analyze")
+        if (result := conn.execute("pragma quick_check").fetchone()[0]) != "ok":
+            raise RuntimeError(f"New database failed its integrity check: {result}")
+
+    # Readers holding the old file keep reading it, new connections open the new one
+    os.replace(building, target)
+    logger.success(f"Built {os.path.relpath(target, BASE_DIR)} in {time.perf_counter() - start:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", default=COURSES_CSV)
+    parser.add_argument("--programs", default=PROGRAMS_CSV)
+    parser.add_argument("--output", default=SQLITE_PATH)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--no-programs", action="store_true", help="Build a database of courses only")
+    args = parser.parse_args()
+
+    build_database(args.courses, args.programs, args.output, args.workers, args.no_programs)
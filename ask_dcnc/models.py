@@ -0,0 +1,200 @@
+"""
+ask_dcnc/models.py
+Automatic model selection between Haiku and Sonnet with fallback on slow or throttled models
+"""
+
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Iterator
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+from ask_dcnc.codes import COURSE_CODE_PATTERN, PLAN_CODE_PATTERN, PROGRAM_CODE_PATTERN
+from ask_dcnc.pool import hold_slot
+from ask_dcnc.router import Lookup
+from ask_dcnc.throttle import FALLBACK_MAX_ATTEMPTS, is_throttling_error, with_max_attempts
+
+AUTO_MODEL = "auto"
+HAIKU_MODEL = "anthropic.claude-3-haiku-20240307-v1:0"
+SONNET_MODEL = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+MODEL_LATENCY_BUDGET = float(os.getenv("MODEL_LATENCY_BUDGET", 20))  # Seconds to the first token before falling back
+
+COMPLEX_QUESTION_WORDS = 25
+# Multi-hop questions about plans, structure, and eligibility need the stronger model
+COMPLEX_PATTERN = re.compile(
+    r"\b(plans?|majors?|minors?|electives?|prerequisites?|pre-?reqs?|compare|comparison|difference|versus|vs|"
+    r"pathways?|eligible|eligibility|requirements?|credit points?|which courses|what courses|year \d|"
+    r"semester \d|should i|can i|recommend|instead of|both|all of)\b",
+    re.IGNORECASE,
+)
+
+
+def classify_question(question: str, lookup: Lookup | None = None) -> tuple[str, list[str]]:
+    """
+    Classify the complexity of a question with cheap heuristics
+    :param question: User question
+    :param lookup: Codes found by the router, if any
+    :return: "simple" or "complex", and the reasons for the decision
+    """
+    if lookup and lookup.is_pure:
+        return "simple", ["pure lookup"]
+
+    reasons = []
+    if matches := sorted({match.lower() for match in COMPLEX_PATTERN.findall(question)}):
+        reasons.append(f"keywords {', '.join(matches)}")
+    codes = set(COURSE_CODE_PATTERN.findall(question) + PROGRAM_CODE_PATTERN.findall(question)
+                + PLAN_CODE_PATTERN.findall(question))
+    if len(codes) > 1:
+        reasons.append(f"{len(codes)} codes")
+    if len(question.split()) > COMPLEX_QUESTION_WORDS:
+        reasons.append(f"{len(question.split())} words")
+
+    return ("complex" if reasons else "simple"), reasons or ["no complexity signals"]
+
+
+def choose_models(question: str, lookup: Lookup | None = None) -> list[str]:
+    """
+    Pick the primary model for a question and the fallback
+    :param question: User question
+    :param lookup: Codes found by the router, if any
+    :return: Bedrock model IDs, primary first
+    """
+    complexity, reasons = classify_question(question, lookup)
+    models = [SONNET_MODEL, HAIKU_MODEL] if complexity == "complex" else [HAIKU_MODEL, SONNET_MODEL]
+    logger.info(f"Model routing: {complexity} ({'; '.join(reasons)}) -> {models[0]}, fallback {models[1]}")
+    return models
+
+
+class RunCancelled(Exception):
+    """
+    Raised inside an abandoned agent run to stop it
+    """
+
+
+class _CancelHandler(BaseCallbackHandler):
+    """
+    Stops a cancelled agent run at its next LLM call, token, or tool call, dropping the LLM response being streamed
+    """
+
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def _check(self, *args: Any, **kwargs: Any) -> None:
+        if self.cancelled.is_set():
+            raise RunCancelled()
+
+    on_llm_start = on_chat_model_start = on_llm_new_token = on_tool_start = _check
+
+
+class _Prefetcher:
+    """
+    Iterates an agent stream on a separate thread so the consumer can wait with a timeout
+    """
+
+    _DONE = object()
+
+    def __init__(self, agent: Any, agent_input: dict, config: dict | None = None):
+        """
+        :param agent: Agent from `get_agent`
+        :param agent_input: Agent input state
+        :param config: Runnable config, the handler that stops the run on `cancel` is added to its callbacks
+        """
+        self._cancelled = threading.Event()
+        config = dict(config or {})
+        config["callbacks"] = [*config.get("callbacks", []), _CancelHandler(self._cancelled)]
+        self._stream = agent.stream(input=agent_input, config=config, stream_mode="messages")
+        self._chunks: queue.Queue = queue.Queue()
+        # Tools use Streamlit caches, so the thread borrows the current thread's script context
+        self.thread = add_script_run_ctx(threading.Thread(target=self._run, name="model-stream", daemon=True))
+        self.thread.start()
+
+    def _run(self) -> None:
+        try:
+            for chunk in self._stream:
+                if self._cancelled.is_set():
+                    break
+                self._chunks.put((chunk, None))
+            self._chunks.put((self._DONE, None))
+        except RunCancelled:
+            logger.debug("Abandoned model stream stopped")
+        except Exception as e:
+            self._chunks.put((self._DONE, e))
+        finally:
+            if hasattr(self._stream, "close"):
+                self._stream.close()
+
+    def get(self, timeout: float | None = None) -> Any:
+        """
+        :param timeout: Seconds to wait for the next chunk, or None to wait forever
+        :return: Next chunk, or _DONE at the end of the stream
+        :raises queue.Empty: If no chunk arrived in time
+        """
+        chunk, error = self._chunks.get(timeout=timeout)
+        if error:
+            raise error
+        return chunk
+
+    def cancel(self) -> None:
+        """
+        Stop the run at its next LLM call, token, or tool call, holding the pool slot until it has stopped
+        """
+        self._cancelled.set()
+        hold_slot(self.thread)
+
+
+def stream_with_fallback(
+        agents: list[tuple[str, Any]],
+        agent_input: dict,
+        latency_budget: float = MODEL_LATENCY_BUDGET,
+        config: dict | None = None,
+) -> Iterator:
+    """
+    Stream an agent run, moving on to the next model if the first token takes too long or the model is throttled
+    Fallback only happens before the first chunk, so the user never sees two models' answers
+    An abandoned run is stopped as soon as its model streams a token or it calls a tool, and keeps the pool slot of the
+    run until then, so fallbacks never run more agents at once than the pool allows
+    Every model but the last retries a throttled step only FALLBACK_MAX_ATTEMPTS times, so throttling reaches the next
+    model within seconds rather than after the minute of backoff of the agent's retry policy, also for steps after the
+    first chunk, which fail instead of falling back
+    :param agents: Model IDs and their agents from `get_agent`, primary first
+    :param agent_input: Agent input state
+    :param latency_budget: Seconds to wait for the first token of every model but the last
+    :param config: Runnable config, e.g. callbacks for tracing
+    :return: Agent stream with stream_mode="messages"
+    """
+    for i, (llm_model, agent) in enumerate(agents):
+        is_last = i == len(agents) - 1
+        start = time.monotonic()
+        if not is_last:
+            agent = with_max_attempts(agent, FALLBACK_MAX_ATTEMPTS)
+        stream = _Prefetcher(agent, agent_input, config)
+
+        try:
+            chunk = stream.get(timeout=None if is_last else latency_budget)
+        except queue.Empty:
+            stream.cancel()
+            logger.warning(f"Model fallback: {llm_model} gave no tokens in {latency_budget:g}s")
+            continue
+        except Exception as e:
+            if is_last or not is_throttling_error(e):
+                raise
+            logger.warning(f"Model fallback: {llm_model} throttled after {time.monotonic() - start:.1f}s")
+            continue
+
+        first_token = time.monotonic() - start
+        while chunk is not _Prefetcher._DONE:
+            yield chunk
+            chunk = stream.get()
+        logger.info(
+            f"Model latency: {llm_model} first token {first_token:.2f}s, total {time.monotonic() - start:.2f}s"
+            + (f", fallback from {agents[0][0]}" if i else "")
+        )
+        return
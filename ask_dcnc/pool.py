@@ -0,0 +1,200 @@
+"""
+ask_dcnc/pool.py
+Shared worker pool for agent runs with admission control
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+import streamlit as st
+from loguru import logger
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+AGENT_CONCURRENCY = int(os.getenv("AGENT_CONCURRENCY", 8))  # Agent runs executing at once
+AGENT_QUEUE_LIMIT = int(os.getenv("AGENT_QUEUE_LIMIT", 32))  # Agent runs waiting, further runs are rejected
+AGENT_RUN_ESTIMATE = 30.0  # Seconds per run until real runs have been timed
+
+_worker = threading.local()  # Threads started by the run of the current worker, see hold_slot
+
+
+class PoolFullError(RuntimeError):
+    """
+    Raised when the queue of agent runs is full
+    """
+
+
+class Job:
+    """
+    Agent run submitted to the pool, iterate it to receive the chunks of the run as they are produced
+    Every iteration replays the run from the start, so sessions sharing a run all see every chunk
+    """
+
+    def __init__(self, pool: "AgentPool", key: str | None = None):
+        self.pool = pool
+        self.key = key
+        self.subscribers = 1
+        self.started = threading.Event()
+        self.submitted_at = time.monotonic()
+        self._chunks: list = []
+        self._done = False
+        self._error: BaseException | None = None
+        self._condition = threading.Condition()
+
+    @property
+    def position(self) -> int:
+        """
+        :return: Number of runs ahead in the queue, 0 once started
+        """
+        return self.pool.position(self)
+
+    @property
+    def estimated_wait(self) -> float:
+        """
+        :return: Estimated seconds until the run starts
+        """
+        return self.pool.estimated_wait(self)
+
+    def _put(self, chunk: Any) -> None:
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def _finish(self, error: BaseException | None = None) -> None:
+        with self._condition:
+            self._error = error
+            self._done = True
+            self._condition.notify_all()
+
+    def __iter__(self) -> Iterator:
+        i = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: i < len(self._chunks) or self._done)
+                chunks = self._chunks[i:]
+                done = self._done
+            yield from chunks
+            i += len(chunks)
+            if done and i == len(self._chunks):
+                break
+        if self._error:
+            raise self._error
+
+
+class AgentPool:
+    """
+    Bounded thread pool running agent streams for all sessions, in submission order
+    """
+
+    def __init__(self, max_workers: int = AGENT_CONCURRENCY, queue_limit: int = AGENT_QUEUE_LIMIT):
+        """
+        :param max_workers: Runs executing at once
+        :param queue_limit: Runs allowed to wait for a worker
+        """
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.run_estimate = AGENT_RUN_ESTIMATE
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self._waiting: deque[Job] = deque()
+        self._in_flight: dict[str, Job] = {}
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def submit(self, run: Callable[[], Iterable], key: str | None = None) -> tuple[Job, bool]:
+        """
+        Queue an agent run, or join the identical run already in flight
+        :param run: Function returning the agent stream, called on a worker thread
+        :param key: Identifies identical runs, e.g. the answer key of a first-turn question
+        :return: Job yielding the chunks of the stream, and whether it was joined, in which case `run` is not called and
+            callbacks bound in it, e.g. a tracer, only see the session that queued the run
+        :raises PoolFullError: If the queue is full
+        """
+        with self._lock:
+            if key and (job := self._in_flight.get(key)):
+                job.subscribers += 1
+                logger.debug(f"Joined in-flight agent run with {job.subscribers} subscribers")
+                return job, True
+            if len(self._waiting) >= self.queue_limit:
+                raise PoolFullError(f"{len(self._waiting)} agent runs are already waiting")
+            job = Job(self, key)
+            self._waiting.append(job)
+            if key:
+                self._in_flight[key] = job
+        self._executor.submit(self._run, job, run, get_script_run_ctx(suppress_warning=True))
+        return job, False
+
+    def _run(self, job: Job, run: Callable[[], Iterable], ctx) -> None:
+        # Tools use Streamlit caches, so the worker borrows the submitting session's context
+        add_script_run_ctx(threading.current_thread(), ctx)
+        with self._lock:
+            self._waiting.remove(job)
+            self._running += 1
+        job.started.set()
+        logger.debug(f"Agent run started after waiting {time.monotonic() - job.submitted_at:.1f}s")
+
+        start = time.monotonic()
+        _worker.held = []
+        try:
+            for chunk in run():
+                job._put(chunk)
+            job._finish()
+        except BaseException as e:
+            job._finish(e)
+        finally:
+            duration = time.monotonic() - start
+            # Work the run left behind still counts against the concurrency limit
+            for thread in _worker.held:
+                logger.debug(f"Agent run slot held until {thread.name} stops")
+                thread.join()
+            _worker.held = None
+            with self._lock:
+                self._running -= 1
+                if job.key:
+                    self._in_flight.pop(job.key, None)
+                # Moving average of run durations for wait estimates
+                self.run_estimate = 0.8 * self.run_estimate + 0.2 * duration
+
+    def position(self, job: Job) -> int:
+        with self._lock:
+            try:
+                return self._waiting.index(job) + 1
+            except ValueError:
+                return 0
+
+    def estimated_wait(self, job: Job) -> float:
+        position = self.position(job)
+        if not position:
+            return 0.0
+        return math.ceil(position / self.max_workers) * self.run_estimate
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+
+def hold_slot(thread: threading.Thread) -> None:
+    """
+    Keep the slot of the current run until a thread it started has finished, e.g. a model stream it abandoned
+    Outside the pool this does nothing
+    :param thread: Thread still running work of the run
+    """
+    held = getattr(_worker, "held", None)
+    if held is not None:
+        held.append(thread)
+
+
+@st.cache_resource(show_spinner=False)
+def get_agent_pool() -> AgentPool:
+    """
+    Agent pool shared by all sessions
+    :return: AgentPool
+    """
+    return AgentPool()
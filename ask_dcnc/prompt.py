@@ -2,6 +2,7 @@
 ask_dcnc/prompt.py
 System prompt generator
 """
+import hashlib
 import os
 from datetime import datetime
 
@@ -9,23 +10,74 @@ import pytz
 import streamlit as st
 from loguru import logger
 
+from ask_dcnc.schema import get_schema_digest
+
 BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+DEFAULT_TIMEZONE = "Australia/Melbourne"
+TIME_PLACEHOLDER = "{time}"
+SCHEMA_FALLBACK = "Schema unavailable. Use sql_db_list_tables and sql_db_schema to inspect the DB."
+
 
+def get_system_prompt(answer_style: str | None = None) -> str:
+    """
+    Get the system prompt template with the answer style and schema digest filled in
+    The current time is left as a placeholder so one compiled agent can be reused across turns,
+    see `format_system_prompt`
+    :param answer_style: "Brief" or "Comprehensive", defaults to the session's answer style
+    :return: System prompt template
+    """
+    if answer_style is None:
+        answer_style = st.session_state.answer_style
 
-def get_system_prompt() -> str:
     try:
         with open(os.path.join(BASE_DIR, "prompts/system.md"), encoding="utf-8") as f:
             system_prompt = f.read()
 
-        if st.session_state.answer_style == "Comprehensive":
+        if answer_style == "Comprehensive":
             answer_style = "comprehensive: You should answer the question in a detailed and thorough manner, providing all relevant information and context."
         else:
             answer_style = "brief: You should summarise the answer into one or two short paragraphs."
 
-        prompt = system_prompt.format(answer_style=answer_style, time=datetime.now(pytz.timezone(st.context.timezone)))
+        prompt = system_prompt.format(
+            answer_style=answer_style,
+            schema=get_schema_digest() or SCHEMA_FALLBACK,
+            time=TIME_PLACEHOLDER,
+        )
         logger.debug(f"System prompt loaded:\n{prompt}")
         return prompt
 
     except Exception as e:
         logger.error(e)
         return ""
+
+
+def get_prompt_hash(system_prompt: str) -> str:
+    """
+    Hash a system prompt template to key cached agents on
+    :param system_prompt: System prompt template
+    :return: Hex digest
+    """
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+def get_prompt_time() -> str:
+    """
+    Get the current time in the user's timezone for the system prompt
+    :return: Current time as a string
+    """
+    try:
+        timezone = pytz.timezone(st.context.timezone or DEFAULT_TIMEZONE)
+    except Exception as e:
+        logger.warning(f"Unable to get user timezone: {e}")
+        timezone = pytz.timezone(DEFAULT_TIMEZONE)
+    return str(datetime.now(timezone))
+
+
+def format_system_prompt(system_prompt: str, time: str) -> str:
+    """
+    Inject the per-turn values into a system prompt template
+    :param system_prompt: System prompt template from `get_system_prompt`
+    :param time: Current time from `get_prompt_time`
+    :return: System prompt
+    """
+    return system_prompt.replace(TIME_PLACEHOLDER, time)
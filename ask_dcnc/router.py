@@ -0,0 +1,212 @@
+"""
+ask_dcnc/router.py
+Fast path for questions that look up course or program codes directly
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+
+from langchain_core.messages import SystemMessage
+from loguru import logger
+
+from ask_dcnc.client import client
+from ask_dcnc.codes import COURSE_CODE_PATTERN, PLAN_CODE_PATTERN, PROGRAM_CODE_PATTERN
+from ask_dcnc.db import SQLITE_PATH
+from ask_dcnc.history import format_history
+from ask_dcnc.prompt import format_system_prompt, get_system_prompt
+from ask_dcnc.sql import pooled_connection
+
+# "llm" answers pure lookups with one LLM call, "template" answers without the LLM, "off" always uses the agent
+FAST_PATH = os.getenv("FAST_PATH", "llm").lower()
+
+# Words that do not turn a lookup into a question the agent needs to reason about
+LOOKUP_WORDS = {
+    "a", "about", "and", "anything", "can", "code", "course", "courses", "degree", "describe", "details", "do",
+    "explain", "give", "i", "info", "information", "is", "know", "me", "more", "of", "on", "overview", "plan",
+    "please", "program", "programme", "programs", "show", "subject", "summarise", "summarize", "tell", "the",
+    "what", "whats", "what's", "you",
+}
+
+MAX_DESCRIPTION_LENGTH = 1500
+
+COURSE_SQL = """
+select cc.code, c.id, c.title, c.prerequisites, c.description, c.url, cco.name, cco.email
+from course_code cc
+         join course c on c.id = cc.id
+         left join course_coordinator cco on c.coordinator = cco.id
+where upper(cc.code) = ?
+"""
+
+PROGRAM_SQL = """
+select p.code, p.title, p.url, pp.plan_code, pp.alt_title, pp.url
+from program p
+         left join program_plan pp on p.code = pp.program_code
+where upper(p.code) = ?
+"""
+
+PLAN_SQL = """
+select p.code, p.title, p.url, pp.plan_code, pp.alt_title, pp.url
+from program_plan pp
+         join program p on p.code = pp.program_code
+where upper(pp.plan_code) like ? || '%'
+"""
+
+
+@dataclass
+class Lookup:
+    """
+    Codes found in a question and the rows prefetched for them
+    """
+    courses: dict[str, tuple] = field(default_factory=dict)
+    programs: dict[str, list[tuple]] = field(default_factory=dict)
+    missing: list[str] = field(default_factory=list)
+    is_pure: bool = False
+
+    @property
+    def codes(self) -> list[str]:
+        return list(self.courses) + list(self.programs)
+
+    @property
+    def summary(self) -> str:
+        summary = f"Looked up {', '.join(self.codes)} in the database."
+        if self.missing:
+            summary += f" Not found: {', '.join(self.missing)}."
+        return summary
+
+    @property
+    def context(self) -> str:
+        """
+        :return: Prefetched rows formatted for the system prompt
+        """
+        lines = []
+        for code, (_, course_id, title, prerequisites, description, url, name, email) in self.courses.items():
+            if description and len(description) > MAX_DESCRIPTION_LENGTH:
+                description = description[:MAX_DESCRIPTION_LENGTH] + "…"
+            lines += [
+                f"Course {code} (ID {course_id}): {title}",
+                f"  URL: {url}",
+                f"  Coordinator: {name} {email}",
+                f"  Prerequisites: {prerequisites}",
+                f"  Description: {description}",
+            ]
+        for code, rows in self.programs.items():
+            _, title, url = rows[0][:3]
+            lines += [f"Program {code}: {title}", f"  URL: {url}"]
+            lines += [
+                f"  Plan {' '.join(filter(None, [plan_code, alt_title]))}: {plan_url}"
+                for _, _, _, plan_code, alt_title, plan_url in rows if plan_code
+            ]
+        return "\n".join(lines)
+
+
+def route(question: str, db_path: str = SQLITE_PATH) -> Lookup | None:
+    """
+    Detect course, program, and plan codes in a question and prefetch their rows
+    :param question: User question
+    :param db_path: Path to the database file
+    :return: Lookup, or None if the question has no codes
+    """
+    plan_codes = [code.upper() for code in PLAN_CODE_PATTERN.findall(question)]
+    program_codes = [code.upper() for code in PROGRAM_CODE_PATTERN.findall(question)]
+    course_codes = [code.upper() for code in COURSE_CODE_PATTERN.findall(question)]
+    if not (plan_codes or program_codes or course_codes):
+        return None
+
+    lookup = Lookup()
+    with pooled_connection(db_path) as conn:
+        for code in dict.fromkeys(course_codes):
+            if row := conn.execute(COURSE_SQL, (code,)).fetchone():
+                lookup.courses[code] = row
+            else:
+                lookup.missing.append(code)
+        for code, sql in [(code, PROGRAM_SQL) for code in dict.fromkeys(program_codes)] + \
+                         [(code, PLAN_SQL) for code in dict.fromkeys(plan_codes)]:
+            if rows := conn.execute(sql, (code,)).fetchall():
+                lookup.programs[code] = rows
+            else:
+                lookup.missing.append(code)
+
+    # Pure lookups only contain codes and filler words, and every code was found
+    remainder = PLAN_CODE_PATTERN.sub(" ", question)
+    remainder = PROGRAM_CODE_PATTERN.sub(" ", COURSE_CODE_PATTERN.sub(" ", remainder))
+    words = re.findall(r"[\w']+", remainder.lower())
+    lookup.is_pure = not lookup.missing and all(word in LOOKUP_WORDS for word in words)
+
+    logger.debug(f"Router: {lookup.summary} Pure lookup: {lookup.is_pure}")
+    return lookup
+
+
+def format_context(context: str) -> str:
+    """
+    Section appended to the system prompt with prefetched rows
+    :param context: Lookup context
+    :return: System prompt section, or an empty string if there is no context
+    """
+    if not context:
+        return ""
+    return (
+        "\n\n# Prefetched Data\n\n"
+        "These rows were already fetched from the DB for the codes in the question. Do not query them again.\n\n"
+        f"```\n{context}\n```"
+    )
+
+
+def answer_from_template(lookup: Lookup) -> str:
+    """
+    Answer a pure lookup without the LLM
+    :param lookup: Pure lookup
+    :return: Markdown answer
+    """
+    sections = []
+    for code, (_, course_id, title, prerequisites, description, url, name, email) in lookup.courses.items():
+        sections.append(
+            f"**{code} {title}** (course ID {course_id})\n\n{description or ''}\n\n"
+            f"- Coordinator: {name or 'Unknown'} {email or ''}\n"
+            f"- Prerequisites: {prerequisites or 'None'}\n"
+            f"- Course guide: {url}"
+        )
+    for code, rows in lookup.programs.items():
+        _, title, url = rows[0][:3]
+        plans = "\n".join(
+            f"- {' '.join(filter(None, [plan_code, alt_title]))}: {plan_url}"
+            for _, _, _, plan_code, alt_title, plan_url in rows if plan_code
+        )
+        sections.append(f"**{code} {title}**\n\n{url}\n\nProgram plans:\n{plans}")
+    return "\n\n".join(sections)
+
+
+def answer_lookup(
+        lookup: Lookup,
+        messages: list,
+        llm_model: str,
+        temperature: float,
+        answer_style: str,
+        time: str,
+        history: str = "",
+        callbacks: list | None = None,
+) -> str:
+    """
+    Answer a pure lookup with a single LLM call and no tools, or from a template if FAST_PATH is "template"
+    :param lookup: Pure lookup
+    :param messages: Chat history ending with the question
+    :param llm_model: Bedrock model ID
+    :param temperature: Temperature for the LLM
+    :param answer_style: "Brief" or "Comprehensive"
+    :param time: Current time from `get_prompt_time`
+    :param history: Summary of earlier turns from `compact_history`
+    :param callbacks: LangChain callbacks, e.g. a `Tracer`
+    :return: Response in the same format as the agent's
+    """
+    if FAST_PATH == "template":
+        return answer_from_template(lookup)
+
+    llm = client(llm_model=llm_model, temperature=temperature)
+    system_prompt = (
+            format_system_prompt(get_system_prompt(answer_style), time)
+            + format_history(history)
+            + format_context(lookup.context)
+            + "\n\nTools are unavailable for this question. Answer from the prefetched data with `Final Answer`."
+    )
+    response = llm.invoke([SystemMessage(content=system_prompt)] + messages, config={"callbacks": callbacks})
+    return response.content
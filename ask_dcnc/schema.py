@@ -0,0 +1,104 @@
+"""
+ask_dcnc/schema.py
+Compact schema digest embedded in the system prompt
+"""
+
+import os
+import re
+from functools import lru_cache
+
+from loguru import logger
+
+from ask_dcnc.db import SQLITE_PATH
+from ask_dcnc.sql import get_internal_tables, pooled_connection
+
+SAMPLE_ROWS = 2
+MAX_VALUE_LENGTH = 40
+
+# Domain notes appended to the table lines
+TABLE_NOTES = {
+    "program_course": "Core courses",
+    "program_elective": "Majors, minors, electives",
+}
+
+# Tools made redundant by the digest, see HIDE_SCHEMA_TOOLS in ask_dcnc/agent.py
+SCHEMA_TOOLS = ("sql_db_list_tables", "sql_db_schema")
+# Description of sql_db_query once they are hidden, the toolkit's tells the model to call sql_db_schema
+QUERY_TOOL_DESCRIPTION = (
+    "Input to this tool is a detailed and correct SQL query, output is a result from the database. "
+    "If the query is not correct, an error message will be returned. If an error is returned, rewrite the query, "
+    "check the query, and try again. If you encounter an unknown table or column, look up the correct names in the "
+    "schema in the system prompt."
+)
+
+
+def _compact(value) -> str:
+    """
+    Shorten a sample value so descriptions do not blow up the prompt
+    :param value: Column value
+    :return: Compact representation of the value
+    """
+    if not isinstance(value, str):
+        return repr(value)
+    value = re.sub(r"\s+", " ", value).strip()
+    if len(value) > MAX_VALUE_LENGTH:
+        value = value[:MAX_VALUE_LENGTH] + "…"
+    return repr(value)
+
+
+@lru_cache(maxsize=4)
+def _build_schema_digest(db_path: str, mtime: float) -> str:
+    """
+    Build the schema digest, cached until the database file changes
+    :param db_path: Path to the database file
+    :param mtime: Modification time of the database file, used as part of the cache key
+    :return: Schema digest
+    """
+    lines = ["Key format: _primary_, foreign*->table.column"]
+    with pooled_connection(db_path) as conn:
+        internal_tables = get_internal_tables(db_path)
+        tables = [
+            row[0] for row in conn.execute(
+                "select name from sqlite_master where type = 'table' and name not like 'sqlite_%' order by name"
+            )
+            if row[0] not in internal_tables
+        ]
+        for table in tables:
+            foreign_keys = {
+                row[3]: f"{row[2]}.{row[4]}" if row[4] else row[2]
+                for row in conn.execute(f'pragma foreign_key_list("{table}")')
+            }
+            columns = []
+            for _, name, column_type, _, _, primary_key in conn.execute(f'pragma table_info("{table}")'):
+                column = f"_{name}_" if primary_key else name
+                if name in foreign_keys:
+                    column += f"*->{foreign_keys[name]}"
+                if column_type:
+                    column += f" {column_type.lower()}"
+                columns.append(column)
+
+            row_count = conn.execute(f'select count(*) from "{table}"').fetchone()[0]
+            note = f"{row_count} rows"
+            if table in TABLE_NOTES:
+                note += f", {TABLE_NOTES[table]}"
+            lines.append(f"{table}({', '.join(columns)}) # {note}")
+            for row in conn.execute(f'select * from "{table}" limit {SAMPLE_ROWS}'):
+                lines.append(f"  ({', '.join(_compact(value) for value in row)})")
+
+    digest = "\n".join(lines)
+    logger.success(f"Schema digest built for {len(tables)} tables.")
+    return digest
+
+
+def get_schema_digest(db_path: str = SQLITE_PATH) -> str:
+    """
+    Get the tables, columns, keys, and sample rows of the database in a compact form
+    Rebuilt automatically when the database file's mtime changes
+    :param db_path: Path to the database file
+    :return: Schema digest, or an empty string if the database cannot be read
+    """
+    try:
+        return _build_schema_digest(db_path, os.path.getmtime(db_path))
+    except Exception as e:
+        logger.error(f"Unable to build schema digest: {e}")
+        return ""
@@ -0,0 +1,237 @@
+"""
+ask_dcnc/search.py
+SQLite FTS5 full-text search over course and program text
+
+Build the index with: python -m ask_dcnc.search
+"""
+
+import re
+import sqlite3
+import time
+from contextlib import closing
+from typing import Optional, Type
+
+from langchain_community.tools.sql_database.tool import BaseSQLDatabaseTool
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ask_dcnc.db import SQLITE_PATH
+from ask_dcnc.sql import get_db_path, pooled_connection, writable_copy
+
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+COURSE_FTS = "course_fts"
+PROGRAM_FTS = "program_fts"
+
+BUILD_SQL = f"""
+drop table if exists {COURSE_FTS};
+create virtual table {COURSE_FTS} using fts5(
+    id unindexed,
+    codes,
+    title,
+    description,
+    tokenize = 'porter unicode61'
+);
+insert into {COURSE_FTS} (id, codes, title, description)
+select c.id, coalesce(group_concat(cc.code, ' '), ''), c.title, coalesce(c.description, '')
+from course c
+         left join course_code cc on c.id = cc.id
+group by c.id;
+insert into {COURSE_FTS} ({COURSE_FTS}) values ('optimize');
+
+drop table if exists {PROGRAM_FTS};
+create virtual table {PROGRAM_FTS} using fts5(
+    code unindexed,
+    plan_codes,
+    title,
+    alt_titles,
+    tokenize = 'porter unicode61'
+);
+insert into {PROGRAM_FTS} (code, plan_codes, title, alt_titles)
+select p.code,
+       p.code || ' ' || coalesce(group_concat(pp.plan_code, ' '), ''),
+       p.title,
+       coalesce(group_concat(pp.alt_title, ' '), '')
+from program p
+         left join program_plan pp on p.code = pp.program_code
+group by p.code;
+insert into {PROGRAM_FTS} ({PROGRAM_FTS}) values ('optimize');
+"""
+
+# bm25 weights per column, titles and codes matter more than descriptions
+COURSE_SEARCH_SQL = f"""
+select f.id,
+       f.codes,
+       f.title,
+       c.url,
+       snippet({COURSE_FTS}, 3, '[', ']', '…', 12)
+from {COURSE_FTS} f
+         join course c on c.id = f.id
+where {COURSE_FTS} match ?
+order by bm25({COURSE_FTS}, 0, 10.0, 5.0, 1.0)
+limit ?
+"""
+
+PROGRAM_SEARCH_SQL = f"""
+select f.code,
+       f.plan_codes,
+       f.title,
+       p.url
+from {PROGRAM_FTS} f
+         join program p on p.code = f.code
+where {PROGRAM_FTS} match ?
+order by bm25({PROGRAM_FTS}, 0, 10.0, 5.0, 2.0)
+limit ?
+"""
+
+
+def build_search_index(db_path: str = SQLITE_PATH) -> None:
+    """
+    Create or rebuild the FTS5 tables over course and program text
+    :param db_path: Path to the database file
+    """
+    start = time.perf_counter()
+    with closing(sqlite3.connect(db_path)) as conn:
+        with conn:
+            conn.executescript(BUILD_SQL)
+    logger.success(f"Search index built in {time.perf_counter() - start:.2f}s.")
+
+
+def has_search_index(db_path: str = SQLITE_PATH) -> bool:
+    """
+    Check whether the FTS5 tables have been built
+    :param db_path: Path to the database file
+    :return: True if both FTS5 tables exist
+    """
+    try:
+        with pooled_connection(db_path) as conn:
+            count = conn.execute(
+                "select count(*) from sqlite_master where type = 'table' and name in (?, ?)",
+                (COURSE_FTS, PROGRAM_FTS),
+            ).fetchone()[0]
+        return count == 2
+    except (sqlite3.Error, OSError):
+        return False
+
+
+def to_match_query(query: str, operator: str = "AND") -> str:
+    """
+    Turn free text into an FTS5 query of quoted prefix terms, so user punctuation cannot break the syntax
+    :param query: Free text, e.g. "python studio"
+    :param operator: "AND" or "OR"
+    :return: FTS5 MATCH expression, e.g. '"python"* AND "studio"*'
+    """
+    terms = re.findall(r"\w+", query)
+    return f" {operator} ".join(f'"{term}"*' for term in terms)
+
+
+def search(db_path: str, sql: str, query: str, limit: int = SEARCH_LIMIT) -> list[tuple]:
+    """
+    Run a ranked full-text search, falling back to matching any term if all terms return nothing
+    :param db_path: Path to the database file
+    :param sql: COURSE_SEARCH_SQL or PROGRAM_SEARCH_SQL
+    :param query: Free text
+    :param limit: Maximum number of results
+    :return: Result rows
+    """
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    with pooled_connection(db_path) as conn:
+        for operator in ("AND", "OR"):
+            match = to_match_query(query, operator)
+            if not match:
+                return []
+            rows = conn.execute(sql, (match, limit)).fetchall()
+            if rows:
+                return rows
+    return []
+
+
+def search_courses(db_path: str, query: str, limit: int = SEARCH_LIMIT) -> str:
+    """
+    Search course codes, titles, and descriptions
+    :param db_path: Path to the database file
+    :param query: Free text
+    :param limit: Maximum number of results
+    :return: One course per line
+    """
+    rows = search(db_path, COURSE_SEARCH_SQL, query, limit)
+    if not rows:
+        return "No matching courses."
+    return "\n".join(
+        f"{course_id} | {codes} | {title} | {url} | {snippet}"
+        for course_id, codes, title, url, snippet in rows
+    )
+
+
+def search_programs(db_path: str, query: str, limit: int = SEARCH_LIMIT) -> str:
+    """
+    Search program codes, plan codes, and titles
+    :param db_path: Path to the database file
+    :param query: Free text
+    :param limit: Maximum number of results
+    :return: One program per line
+    """
+    rows = search(db_path, PROGRAM_SEARCH_SQL, query, limit)
+    if not rows:
+        return "No matching programs."
+    return "\n".join(
+        f"{code} | {plan_codes} | {title} | {url}"
+        for code, plan_codes, title, url in rows
+    )
+
+
+class _SearchToolInput(BaseModel):
+    query: str = Field(..., description="Keywords, course codes, or program codes to search for.")
+    limit: int = Field(SEARCH_LIMIT, description=f"Maximum number of results, up to {MAX_SEARCH_LIMIT}.")
+
+
+class SearchCoursesTool(BaseSQLDatabaseTool, BaseTool):
+    """
+    Ranked full-text search over courses
+    """
+
+    name: str = "search_courses"
+    description: str = (
+        "Ranked full-text search over course codes, titles, and descriptions. "
+        "Use this instead of LIKE queries to find courses by name, topic, or partial code. "
+        "Output is one course per line: id | codes | title | url | description snippet."
+    )
+    args_schema: Type[BaseModel] = _SearchToolInput
+
+    def _run(
+            self,
+            query: str,
+            limit: int = SEARCH_LIMIT,
+            run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        return search_courses(get_db_path(self.db), query, limit)
+
+
+class SearchProgramsTool(BaseSQLDatabaseTool, BaseTool):
+    """
+    Ranked full-text search over programs
+    """
+
+    name: str = "search_programs"
+    description: str = (
+        "Ranked full-text search over program codes, plan codes, and titles. "
+        "Use this instead of LIKE queries to find programs by name or partial code. "
+        "Output is one program per line: code | plan codes | title | url."
+    )
+    args_schema: Type[BaseModel] = _SearchToolInput
+
+    def _run(
+            self,
+            query: str,
+            limit: int = SEARCH_LIMIT,
+            run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        return search_programs(get_db_path(self.db), query, limit)
+
+
+if __name__ == "__main__":
+    with writable_copy(SQLITE_PATH) as copy:
+        build_search_index(copy)
@@ -0,0 +1,224 @@
+"""
+ask_dcnc/snapshots.py
+Local store of pre-fetched, pre-stripped RMIT pages, so the agent reads course and program pages without live HTTP
+
+The scrapers in data/scripts fill the store as they refresh pages. Every entry carries the time it was fetched and how
+long it stays fresh. Fresh entries are served as they are, stale entries are refetched and only served when the network
+fails, and URLs not in the store go to the network as before.
+
+Usage: python -m ask_dcnc.snapshots [--trace FILE] [--top N]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from ask_dcnc.cache import CacheStats
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+# Relative to the repository, the scrapers pass their own path since they may import an installed copy of the package
+SNAPSHOT_PATH = os.path.join(BASE_DIR, os.getenv("SNAPSHOT_PATH", "data/snapshots.sqlite"))
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE_DAYS", 14)) * 24 * 60 * 60  # Seconds a page is served as is
+
+SCHEMA = """
+create table if not exists snapshot (
+    key text primary key,
+    url text not null,
+    kind text not null,
+    text text not null,
+    html_hash text,
+    fetched_at real not null,
+    max_age real not null
+) without rowid;
+"""
+
+
+@dataclass
+class Snapshot:
+    url: str
+    kind: str
+    text: str
+    html_hash: str | None
+    fetched_at: float
+    max_age: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() - self.fetched_at < self.max_age
+
+
+def snapshot_key(url: str) -> str:
+    """
+    Normalise a URL so the forms the agent writes find the same page, e.g. with http or https, or a trailing slash
+    :param url: Page URL
+    :return: Host, path, and query
+    """
+    parts = urlsplit(url.strip())
+    key = f"{parts.netloc.lower()}{parts.path.rstrip('/')}"
+    return f"{key}?{parts.query}" if parts.query else key
+
+
+class SnapshotStore:
+    """
+    Thread-safe SQLite store of stripped pages keyed by normalised URL
+    A lookup is a single primary key search, and a missing file is treated as an empty store
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH, max_age: float = SNAPSHOT_MAX_AGE):
+        """
+        :param path: Path to the SQLite file, created by the first write
+        :param max_age: Seconds new entries stay fresh
+        """
+        self.path = path
+        self.max_age = max_age
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def _connect(self, create: bool) -> sqlite3.Connection | None:
+        if self._conn is None and (create or os.path.exists(self.path)):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("pragma journal_mode = wal")  # The app reads while the scrapers write
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def get(self, url: str) -> Snapshot | None:
+        """
+        Look up a page, counting fresh entries as hits, and stale entries as invalidations and misses
+        :param url: Page URL
+        :return: Snapshot, fresh or stale, or None if the page is not in the store
+        """
+        with self._lock:
+            conn = self._connect(create=False)
+            row = conn.execute(
+                "select url, kind, text, html_hash, fetched_at, max_age from snapshot where key = ?",
+                (snapshot_key(url),),
+            ).fetchone() if conn else None
+            if row is None:
+                self._stats.misses += 1
+                return None
+            snapshot = Snapshot(*row)
+            if snapshot.fresh:
+                self._stats.hits += 1
+            else:
+                self._stats.invalidations += 1
+                self._stats.misses += 1
+            return snapshot
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            conn = self._connect(create=False)
+            return bool(conn and conn.execute("select 1 from snapshot where key = ?", (snapshot_key(url),)).fetchone())
+
+    def put(self, url: str, kind: str, text: str, html_hash: str | None = None, max_age: float | None = None) -> None:
+        """
+        Store a stripped page
+        :param url: Page URL
+        :param kind: "course" or "program"
+        :param text: Stripped text, as `ask_dcnc.strip.strip_html` returns
+        :param html_hash: Hash of the raw HTML, so unchanged pages can be kept without stripping them again
+        :param max_age: Seconds the entry stays fresh, the store's default if not given
+        """
+        with self._lock:
+            self._connect(create=True).execute(
+                "insert or replace into snapshot (key, url, kind, text, html_hash, fetched_at, max_age) "
+                "values (?, ?, ?, ?, ?, ?, ?)",
+                (snapshot_key(url), url, kind, text, html_hash, time.time(), max_age or self.max_age),
+            )
+
+    def touch(self, url: str, html_hash: str | None = None) -> bool:
+        """
+        Mark a page as fetched now, e.g. after the server answered 304 or sent the same HTML
+        :param url: Page URL
+        :param html_hash: Hash of the HTML just fetched, the page is only touched if it matches
+        :return: Whether the page was in the store and touched
+        """
+        with self._lock:
+            cursor = self._connect(create=True).execute(
+                "update snapshot set fetched_at = ? where key = ? and (? is null or html_hash = ?)",
+                (time.time(), snapshot_key(url), html_hash, html_hash),
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, url: str) -> None:
+        with self._lock:
+            if conn := self._connect(create=False):
+                conn.execute("delete from snapshot where key = ?", (snapshot_key(url),))
+
+    def stats(self) -> CacheStats:
+        """
+        :return: Snapshot of the hit, miss, and stale counters of this process
+        """
+        with self._lock:
+            conn = self._connect(create=False)
+            entries, size = conn.execute(
+                "select count(*), coalesce(sum(length(text)), 0) from snapshot"
+            ).fetchone() if conn else (0, 0)
+            return CacheStats(**asdict(self._stats) | {"entries": entries, "size": size})
+
+
+def summarise_store(path: str = SNAPSHOT_PATH) -> list[tuple[str, int, int, float]]:
+    """
+    :return: Kind, entries, fresh entries, and age in days of the oldest entry, per kind of page
+    """
+    if not os.path.exists(path):
+        return []
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+        return conn.execute(
+            "select kind, count(*), sum(? - fetched_at < max_age), (? - min(fetched_at)) / 86400 "
+            "from snapshot group by kind order by kind",
+            (time.time(), time.time()),
+        ).fetchall()
+
+
+def summarise_lookups(path: str) -> tuple[Counter, Counter]:
+    """
+    Count the snapshot lookups of the agent's page fetches in the trace log
+    :param path: Trace log written by `ask_dcnc.tracing.Tracer`
+    :return: Lookups by result ("hit", "stale", or "miss"), and URLs by number of misses
+    """
+    results, missed = Counter(), Counter()
+    if not os.path.exists(path):
+        return results, missed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            if span.get("name") != "snapshot_lookup":
+                continue
+            results[span["result"]] += 1
+            if span["result"] == "miss":
+                missed[span["url"]] += 1
+    return results, missed
+
+
+if __name__ == "__main__":
+    from ask_dcnc.tracing import TRACE_LOG_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", default=TRACE_LOG_PATH, help="Trace log to compute the hit rate from")
+    parser.add_argument("--top", type=int, default=10, help="Most missed URLs to list")
+    args = parser.parse_args()
+
+    summary = summarise_store()
+    if not summary:
+        logger.warning("No snapshots yet, run the scrapers in data/scripts to fill the store.")
+    for kind, entries, fresh, oldest_days in summary:
+        print(f"{kind}: {entries} pages, {fresh} fresh, oldest fetched {oldest_days:.1f} days ago")
+
+    results, missed = summarise_lookups(args.trace)
+    lookups = sum(results.values())
+    if lookups:
+        print(f"Lookups: {lookups}, {results['hit'] / lookups:.1%} served from snapshots, "
+              f"{results['stale'] / lookups:.1%} stale, {results['miss'] / lookups:.1%} not in the store")
+    for url, count in missed.most_common(args.top):
+        print(f"{count:>6} misses  {url}")
@@ -0,0 +1,523 @@
+"""
+ask_dcnc/sql.py
+Local SQL tools that do not need an LLM
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from typing import Iterator, Optional, Type
+
+import streamlit as st
+from langchain_community.tools.sql_database.tool import BaseSQLDatabaseTool, QuerySQLDatabaseTool
+from langchain_community.utilities import SQLDatabase
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ask_dcnc.cache import LRUCache
+from ask_dcnc.tokens import estimate_tokens
+from ask_dcnc.tracing import trace_span
+
+# Statements a query may prepare without being rejected as a write
+READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+NAME_ERROR_PATTERN = re.compile(r"^no such (column|table): (\S+)$")
+STRING_LITERAL_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+SQLITE_IMMUTABLE = os.getenv("SQLITE_IMMUTABLE", "true").lower() == "true"  # Skip file locking, the app never writes
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 16))  # Idle read-only connections kept per database
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Bytes, larger than the database so reads come straight from the OS page cache
+SQLITE_CACHE_SIZE = -8 * 1024  # KiB per connection, enough for the indexes and hot pages of ~8k courses
+
+QUERY_CACHE_MAX_ENTRIES = 1024
+QUERY_CACHE_MAX_SIZE = 32 * 1024 * 1024  # Characters of query results
+
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", 50))  # Rows per sql_db_query call, the rest is paginated
+SQL_MAX_TOKENS = int(os.getenv("SQL_MAX_TOKENS", 2000))  # Estimated tokens per sql_db_query call
+SQL_MAX_CELL_CHARS = int(os.getenv("SQL_MAX_CELL_CHARS", 300))  # Characters per value of a multi-row result
+MAX_STRING_LENGTH = 6144  # Characters per value of a single-row result, as SQLDatabase truncated before
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", 50))  # Queries slower than this are logged with their plan
+SLOW_QUERY_LOG_PATH = os.path.join(BASE_DIR, "logs/ask-dcnc.slow-queries.jsonl")
+CURSOR_PATTERN = re.compile(r"^([0-9a-f]{8})-(\d+)$")
+
+
+def get_db_path(db: SQLDatabase) -> str:
+    """
+    Get the SQLite file path of a SQLDatabase
+    :param db: SQLDatabase object
+    :return: Path to the database file
+    """
+    return db._engine.url.database
+
+
+def connect_read_only(db_path: str) -> sqlite3.Connection:
+    """
+    Open a read-only connection to a SQLite database, tuned for concurrent reads
+    With SQLITE_IMMUTABLE, SQLite takes no locks and never checks for changes, so the file must only be replaced, e.g.
+    by renaming a new database over it, and not written in place
+    :param db_path: Path to the database file
+    :return: SQLite connection
+    """
+    uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro" + ("&immutable=1" if SQLITE_IMMUTABLE else "")
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"pragma mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute(f"pragma cache_size = {SQLITE_CACHE_SIZE}")
+    conn.execute("pragma temp_store = memory")
+    conn.execute("pragma query_only = 1")
+    return conn
+
+
+def get_file_signature(db_path: str) -> tuple:
+    """
+    :return: Inode, modification time, and size of a database file, which change when the file is replaced
+    """
+    stat = os.stat(db_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class ConnectionPool:
+    """
+    Read-only connections to one database shared by all threads, each connection is used by one thread at a time
+    Agent tools run on short-lived threads, so connections are checked out per use rather than kept per thread
+    Connections are reopened when the database file is replaced
+    """
+
+    def __init__(self, db_path: str, max_idle: int = SQLITE_POOL_SIZE):
+        """
+        :param db_path: Path to the database file
+        :param max_idle: Idle connections to keep, further connections are closed when returned
+        """
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle: list[sqlite3.Connection] = []
+        self._signature: tuple | None = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Check out a connection for the duration of the block
+        :return: SQLite connection
+        """
+        signature = get_file_signature(self.db_path)
+        stale = []
+        with self._lock:
+            if signature != self._signature:
+                stale, self._idle = self._idle, []
+                self._signature = signature
+            conn = self._idle.pop() if self._idle else None
+        for old in stale:
+            old.close()
+
+        conn = conn or connect_read_only(self.db_path)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if signature == self._signature and len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn:
+                conn.close()
+
+
+@lru_cache(maxsize=None)
+def get_connection_pool(db_path: str) -> ConnectionPool:
+    """
+    Connection pool of a database, shared by the whole process
+    :param db_path: Path to the database file
+    :return: ConnectionPool
+    """
+    return ConnectionPool(db_path)
+
+
+@contextmanager
+def pooled_connection(db_path: str, select_only: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    Borrow a read-only connection from the pool of a database
+    :param db_path: Path to the database file
+    :param select_only: Deny everything but SELECT statements while borrowed, e.g. pragmas in agent-written queries
+    :return: SQLite connection
+    """
+    with get_connection_pool(db_path).connection() as conn:
+        if select_only:
+            conn.set_authorizer(_authorize)
+        try:
+            yield conn
+        finally:
+            if select_only:
+                conn.set_authorizer(None)
+
+
+@contextmanager
+def writable_copy(db_path: str) -> Iterator[str]:
+    """
+    Write to a copy of a database, then atomically replace the database with it if the block succeeds
+    With SQLITE_IMMUTABLE, readers take no locks, so the app's database must never be written in place
+    :param db_path: Path to the database file, a symlink is followed so the file it points to is replaced
+    :return: Path to the copy, next to the database so the rename cannot cross file systems
+    """
+    target = os.path.realpath(db_path)
+    copy = f"{target}.writing"
+    if os.path.exists(copy):
+        os.remove(copy)
+    try:
+        with closing(sqlite3.connect(pathlib.Path(target).as_uri() + "?mode=ro", uri=True)) as source, \
+                closing(sqlite3.connect(copy)) as conn:
+            source.backup(conn)
+        yield copy
+        with closing(sqlite3.connect(copy)) as conn:
+            if (result := conn.execute("pragma quick_check").fetchone()[0]) != "ok":
+                raise RuntimeError(f"Database copy failed its integrity check: {result}")
+        # Readers holding the old file keep reading it, new connections open the new one
+        os.replace(copy, target)
+    finally:
+        if os.path.exists(copy):
+            os.remove(copy)
+
+
+def get_internal_tables(db_path: str) -> list[str]:
+    """
+    Get virtual tables and their shadow tables, e.g. the FTS5 search index
+    :param db_path: Path to the database file
+    :return: Table names
+    """
+    with pooled_connection(db_path) as conn:
+        return [
+            row[1] for row in conn.execute("pragma table_list")
+            if row[0] == "main" and row[2] in ("virtual", "shadow")
+        ]
+
+
+@lru_cache(maxsize=8)
+def _get_schema_names(db_path: str, mtime: float) -> tuple[tuple[str, ...], dict[str, tuple[str, ...]]]:
+    """
+    Table and column names of a database, cached until the file changes
+    :param db_path: Path to the database file
+    :param mtime: Modification time of the database file, used as part of the cache key
+    :return: Table names and a dictionary of table names to column names
+    """
+    with pooled_connection(db_path) as conn:
+        tables = tuple(
+            row[0] for row in conn.execute(
+                "select name from sqlite_master where type in ('table', 'view') and name not like 'sqlite_%'"
+            )
+        )
+        columns = {
+            table: tuple(row[1] for row in conn.execute(f'pragma table_info("{table}")'))
+            for table in tables
+        }
+    return tables, columns
+
+
+def get_schema_names(db_path: str) -> tuple[tuple[str, ...], dict[str, tuple[str, ...]]]:
+    """
+    Table and column names of a database
+    :param db_path: Path to the database file
+    :return: Table names and a dictionary of table names to column names
+    """
+    return _get_schema_names(db_path, os.path.getmtime(db_path))
+
+
+def _authorize(action: int, *args) -> int:
+    if action in READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _suggest(kind: str, name: str, db_path: str) -> str:
+    """
+    Suggest close matches for a table or column name that does not exist
+    :param kind: "table" or "column"
+    :param name: Name from the error message, columns may be qualified e.g. `c.titel`
+    :param db_path: Path to the database file
+    :return: Suggestion sentence, or the available names if nothing is close
+    """
+    tables, columns = get_schema_names(db_path)
+    if kind == "table":
+        candidates = tables
+    else:
+        name = name.rsplit(".", 1)[-1]
+        candidates = sorted({column for table_columns in columns.values() for column in table_columns})
+
+    matches = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+    if not matches:
+        return f" Available {kind}s: {', '.join(candidates)}."
+
+    if kind == "column":
+        matches = [
+            f"{table}.{match}"
+            for match in matches
+            for table in tables
+            if match in columns[table]
+        ]
+    return f" Did you mean: {', '.join(matches)}?"
+
+
+def check_query(db_path: str, query: str) -> str:
+    """
+    Validate a query by preparing it with EXPLAIN against a read-only connection
+    :param db_path: Path to the database file
+    :param query: SQL query
+    :return: The original query if it is valid, otherwise an error message starting with "Error:"
+    """
+    query = query.strip()
+    if not query:
+        return "Error: The query is empty."
+
+    with pooled_connection(db_path, select_only=True) as conn:
+        try:
+            conn.execute(f"EXPLAIN {query.rstrip(';')}").close()
+        except sqlite3.DatabaseError as e:
+            message = str(e).rstrip(".")
+            if message == "not authorized":
+                return "Error: The database is read-only. Only SELECT queries are allowed."
+            error = f"Error: {message}."
+            if match := NAME_ERROR_PATTERN.match(message):
+                error += _suggest(kind=match.group(1), name=match.group(2), db_path=db_path)
+            return error
+
+    return query
+
+
+class _LocalQueryCheckerToolInput(BaseModel):
+    query: str = Field(..., description="A detailed and SQL query to be checked.")
+
+
+class LocalQueryCheckerTool(BaseSQLDatabaseTool, BaseTool):
+    """
+    Drop-in replacement for `sql_db_query_checker` that validates queries locally instead of asking the LLM
+    """
+
+    name: str = "sql_db_query_checker"
+    description: str = """
+    Use this tool to double check if your query is correct before executing it.
+    Always use this tool before executing a query with sql_db_query!
+    """
+    args_schema: Type[BaseModel] = _LocalQueryCheckerToolInput
+
+    def _run(
+            self,
+            query: str,
+            run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        result = check_query(get_db_path(self.db), query)
+        if result.startswith("Error:"):
+            logger.debug(f"Query rejected: {result}")
+        return result
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalise a query so trivially different spellings share a cache entry
+    Whitespace and case are normalised outside string literals, trailing semicolons are removed
+    :param query: SQL query
+    :return: Normalised query
+    """
+    parts = STRING_LITERAL_PATTERN.split(query.strip().rstrip(";").strip())
+    return "".join(
+        part if i % 2 else re.sub(r"\s*([,()=<>])\s*", r"\1", re.sub(r"\s+", " ", part)).lower()
+        for i, part in enumerate(parts)
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_query_cache() -> LRUCache:
+    """
+    Process-wide cache of sql_db_query results
+    :return: LRUCache keyed on the database path and normalised query
+    """
+    return LRUCache(max_entries=QUERY_CACHE_MAX_ENTRIES, max_size=QUERY_CACHE_MAX_SIZE)
+
+
+def format_value(value, max_chars: int) -> str:
+    """
+    Format a value on one line, truncating long text with a marker
+    :param value: Column value
+    :param max_chars: Maximum characters before truncation
+    :return: Formatted value
+    """
+    if value is None:
+        return "NULL"
+    text = " ".join(str(value).split())
+    if len(text) > max_chars:
+        return f"{text[:max_chars]}…[+{len(text) - max_chars} chars]"
+    return text
+
+
+def _query_digest(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()[:8]
+
+
+def make_cursor(query: str, offset: int) -> str:
+    """
+    Continuation handle for the rows of a query after an offset, tied to the query so it cannot be reused for another
+    :param query: SQL query
+    :param offset: Number of rows already returned
+    :return: Cursor, e.g. "1a2b3c4d-50"
+    """
+    return f"{_query_digest(query)}-{offset}"
+
+
+def parse_cursor(query: str, cursor: str | None) -> int:
+    """
+    :param query: SQL query
+    :param cursor: Cursor from `make_cursor`, or None for the first page
+    :return: Offset of the next row
+    :raises ValueError: If the cursor is malformed or belongs to another query
+    """
+    if not cursor:
+        return 0
+    match = CURSOR_PATTERN.match(cursor.strip())
+    if not match or match.group(1) != _query_digest(query):
+        raise ValueError("The cursor does not belong to this query. Repeat the exact query the cursor came from.")
+    return int(match.group(2))
+
+
+_slow_query_lock = threading.Lock()
+
+
+def log_slow_query(conn: sqlite3.Connection, query: str, duration_ms: float, rows: int) -> None:
+    """
+    Log a slow query with its query plan, for `python -m ask_dcnc.advisor`
+    :param conn: Connection the query ran on
+    :param query: SQL query
+    :param duration_ms: Time to run the query and fetch its rows
+    :param rows: Rows fetched
+    """
+    try:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query.rstrip().rstrip(';')}")]
+    except sqlite3.Error as e:
+        plan = [f"Error: {e}"]
+    logger.warning(f"Slow query ({duration_ms:.0f}ms, {rows} rows): {' '.join(query.split())} | {'; '.join(plan)}")
+
+    record = {"time": time.time(), "query": query, "duration_ms": duration_ms, "rows": rows, "plan": plan}
+    try:
+        os.makedirs(os.path.dirname(SLOW_QUERY_LOG_PATH), exist_ok=True)
+        with _slow_query_lock, open(SLOW_QUERY_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning(f"Unable to write slow query log: {e}")
+
+
+def run_query(
+        db_path: str,
+        query: str,
+        offset: int = 0,
+        max_rows: int = SQL_MAX_ROWS,
+        max_tokens: int = SQL_MAX_TOKENS,
+) -> str:
+    """
+    Run a read-only query and format a page of its rows compactly, with the column names listed once
+    :param db_path: Path to the database file
+    :param query: SQL query
+    :param offset: Rows to skip, from a continuation cursor
+    :param max_rows: Maximum rows on the page
+    :param max_tokens: Maximum estimated tokens on the page, at least one row is always returned
+    :return: Header line, one line per row, and a continuation cursor if rows remain; or an error starting with "Error:"
+    """
+    with pooled_connection(db_path, select_only=True) as conn, trace_span("sql_execute") as span:
+        cursor = None
+        start = time.perf_counter()
+        try:
+            cursor = conn.execute(query)
+            if cursor.description is None:
+                return ""
+            columns = [column[0] for column in cursor.description]
+            if offset:
+                skipped = cursor.fetchmany(offset)
+                if len(skipped) < offset:
+                    return f"No rows after row {len(skipped)}."
+            # One row beyond the page tells whether another page exists
+            rows = cursor.fetchmany(max_rows + 1)
+            duration_ms = (time.perf_counter() - start) * 1000
+            span.update(rows=len(rows))
+            if duration_ms >= SQL_SLOW_QUERY_MS:
+                log_slow_query(conn, query, duration_ms, offset + len(rows))
+        except sqlite3.Error as e:
+            if str(e) == "not authorized":
+                return "Error: The database is read-only. Only SELECT queries are allowed."
+            return f"Error: {e}"
+        finally:
+            # Release the statement before the connection goes back to the pool
+            if cursor:
+                cursor.close()
+
+    if not rows:
+        return "No rows." if not offset else f"No rows after row {offset}."
+
+    max_chars = MAX_STRING_LENGTH if len(rows) == 1 else SQL_MAX_CELL_CHARS
+    lines = [" | ".join(columns)]
+    tokens = estimate_tokens(lines[0])
+    for row in rows[:max_rows]:
+        line = " | ".join(format_value(value, max_chars) for value in row)
+        tokens += estimate_tokens(line)
+        if tokens > max_tokens and len(lines) > 1:
+            break
+        lines.append(line)
+
+    shown = len(lines) - 1
+    if shown < len(rows):
+        lines.append(
+            f"[Rows {offset + 1}-{offset + shown} shown, more remain. "
+            f'Repeat the same query with cursor "{make_cursor(query, offset + shown)}" for the next rows, '
+            "or narrow the query.]"
+        )
+    return "\n".join(lines)
+
+
+class _QueryToolInput(BaseModel):
+    query: str = Field(..., description="A detailed and correct SQL query.")
+    cursor: Optional[str] = Field(
+        None, description="Cursor from a result with more rows, to get the next rows of the same query."
+    )
+
+
+class CachedQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """
+    `sql_db_query` with compact, paginated results, served from the query cache while the database file is unchanged
+    """
+
+    args_schema: Type[BaseModel] = _QueryToolInput
+
+    def _run(
+            self,
+            query: str,
+            cursor: Optional[str] = None,
+            run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        try:
+            offset = parse_cursor(query, cursor)
+        except ValueError as e:
+            return f"Error: {e}"
+
+        cache = get_query_cache()
+        db_path = get_db_path(self.db)
+        key = (db_path, normalize_query(query), offset)
+        version = os.path.getmtime(db_path)
+
+        if (result := cache.get(key, version)) is not None:
+            logger.debug(f"Query cache hit: {cache.stats().as_dict()}")
+            return result
+
+        result = run_query(db_path, query, offset)
+        if not result.startswith("Error:"):
+            cache.put(key, result, version)
+        return result
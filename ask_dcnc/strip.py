@@ -0,0 +1,214 @@
+"""
+ask_dcnc/strip.py
+HTML to plain text engines, free of the app's web and LLM dependencies so the scrapers can use them
+"""
+
+import os
+import re
+from html.parser import HTMLParser
+from typing import Callable
+
+from bs4 import BeautifulSoup
+
+HTML_STRIP_ENGINE = os.getenv("HTML_STRIP_ENGINE", "fast")  # "fast" or "bs4", see STRIP_ENGINES
+HTML_MAX_CHARS = int(os.getenv("HTML_MAX_CHARS", 48000))  # Roughly 12k tokens per page
+HTML_MAIN_ONLY = os.getenv("HTML_MAIN_ONLY", "false").lower() == "true"
+TRUNCATION_MARKER = " …[truncated]"
+PARSE_CHUNK_SIZE = 64 * 1024
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr",
+}
+MAIN_CONTENT_IDS = {"main", "main-content", "content"}
+MAIN_CONTENT_CLASSES = {"contentArea", "rmit-bs"}
+
+
+def strip_html_bs4(html: str) -> str:
+    """
+    Strip a webpage with BeautifulSoup, the reference engine
+    :param html: Raw HTML
+    :return: Plain text
+    """
+    # Parse and remove script/style tags
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+
+    # Preserve URLs
+    for a in soup.find_all("a", href=True):
+        text = a.get_text(strip=True) or a["href"]
+        a.replace_with(f"[{text}]({a['href']})")
+
+    # Remove all mobile nav elements
+    for tag in soup.select("[class*='mobinav']"):
+        tag.decompose()
+
+    # Strip tags, whitespaces, and newlines
+    text = soup.get_text(strip=True)
+    text = text.replace("\\n", " ")
+
+    return re.sub(r'\s+', ' ', text)
+
+
+class _StripParser(HTMLParser):
+    """
+    Single-pass event parser equivalent to `strip_html_bs4` without building a tree
+    """
+
+    def __init__(self, main_only: bool):
+        super().__init__(convert_charrefs=True)
+        self.main_only = main_only
+        self.stack: list[str] = []
+        self.skip_depth: int | None = None  # Stack depth of the script/style/mobinav element being skipped
+        self.main_depth: int | None = None  # Stack depth of the main content element
+        self.anchor_depth: int | None = None
+        self.anchor_href = ""
+        self.anchor_text: list[str] = []
+        self.pending: list[str] = []  # Consecutive data events form one string, as in BeautifulSoup
+        self.parts: list[str] = []
+        self.main_parts: list[str] = []
+        self.length = 0
+
+    def _append(self, text: str) -> None:
+        self.parts.append(text)
+        # Length once newlines and whitespace are collapsed, which joining stripped parts never shortens
+        self.length += len(WHITESPACE_PATTERN.sub(" ", text.replace("\\n", " ")).strip())
+        if self.main_depth is not None:
+            self.main_parts.append(text)
+
+    def _flush(self) -> None:
+        if not self.pending:
+            return
+        data = "".join(self.pending).strip()
+        self.pending = []
+        if not data:
+            return
+        if self.anchor_depth is not None:
+            self.anchor_text.append(data)
+        else:
+            self._append(data)
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        self._flush()
+        if tag in VOID_ELEMENTS:
+            return
+        self.stack.append(tag)
+        if self.skip_depth is not None:
+            return
+
+        attrs = dict(attrs)
+        if tag in ("script", "style") or "mobinav" in (attrs.get("class") or ""):
+            self.skip_depth = len(self.stack)
+        elif self.main_only and self.main_depth is None and _is_main(tag, attrs):
+            self.main_depth = len(self.stack)
+        elif tag == "a" and attrs.get("href") is not None and self.anchor_depth is None:
+            self.anchor_depth = len(self.stack)
+            self.anchor_href = attrs["href"]
+            self.anchor_text = []
+
+    def handle_startendtag(self, tag: str, attrs: list) -> None:
+        self._flush()
+        if tag not in VOID_ELEMENTS:
+            self.handle_starttag(tag, attrs)
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        self._flush()
+        if tag not in self.stack:
+            return
+
+        # Close any unclosed children like html.parser's tree builder does
+        while self.stack:
+            depth = len(self.stack)
+            closed = self.stack.pop()
+            if self.skip_depth == depth:
+                self.skip_depth = None
+            elif self.anchor_depth == depth:
+                self._append(f"[{''.join(self.anchor_text) or self.anchor_href}]({self.anchor_href})")
+                self.anchor_depth = None
+            if self.main_depth == depth:
+                self.main_depth = None
+            if closed == tag:
+                break
+
+    def handle_data(self, data: str) -> None:
+        if self.skip_depth is None:
+            self.pending.append(data)
+
+    def handle_comment(self, data: str) -> None:
+        self._flush()
+
+    def handle_decl(self, decl: str) -> None:
+        self._flush()
+
+    def handle_pi(self, data: str) -> None:
+        self._flush()
+
+    def unknown_decl(self, data: str) -> None:
+        # BeautifulSoup keeps the text of CDATA sections as a string of its own
+        self._flush()
+        if data.startswith("CDATA[") and self.skip_depth is None:
+            self.pending.append(data[len("CDATA["):])
+            self._flush()
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+        if self.anchor_depth is not None and self.skip_depth is None:
+            self._append(f"[{''.join(self.anchor_text) or self.anchor_href}]({self.anchor_href})")
+            self.anchor_depth = None
+
+
+def _is_main(tag: str, attrs: dict) -> bool:
+    classes = (attrs.get("class") or "").split()
+    return tag == "main" or attrs.get("id") in MAIN_CONTENT_IDS or any(c in MAIN_CONTENT_CLASSES for c in classes)
+
+
+def strip_html_fast(html: str, max_chars: int | None = None, main_only: bool = False) -> str:
+    """
+    Strip a webpage in a single pass with the standard library's event parser
+    It is faster than the bs4 engine because it builds no tree and stops at the budget, not because of a faster parser,
+    both use html.parser, whose quirks the output has to match
+    :param html: Raw HTML
+    :param max_chars: Stop parsing once this much text has been collected
+    :param main_only: Only keep the main content region if the page has one
+    :return: Plain text
+    """
+    parser = _StripParser(main_only=main_only)
+    for i in range(0, len(html), PARSE_CHUNK_SIZE):
+        parser.feed(html[i:i + PARSE_CHUNK_SIZE])
+        # The collected length is a lower bound of the final length, so no text within the budget is dropped
+        if max_chars and parser.length > max_chars and not main_only:
+            break
+    parser.close()
+
+    parts = parser.main_parts if main_only and parser.main_parts else parser.parts
+    text = "".join(parts).replace("\\n", " ")
+    return re.sub(r'\s+', ' ', text)
+
+
+STRIP_ENGINES: dict[str, Callable[..., str]] = {
+    "bs4": lambda html, max_chars=None, main_only=False: strip_html_bs4(html),
+    "fast": strip_html_fast,
+}
+
+
+def strip_html(
+        html: str,
+        engine: str = HTML_STRIP_ENGINE,
+        max_chars: int | None = HTML_MAX_CHARS,
+        main_only: bool = HTML_MAIN_ONLY,
+) -> str:
+    """
+    Strip tags, scripts, styles, and mobile navigation from a webpage, keeping links as Markdown
+    :param html: Raw HTML
+    :param engine: Key of STRIP_ENGINES
+    :param max_chars: Maximum length of the text, longer text is truncated with a marker
+    :param main_only: Only keep the main content region, ignored by the bs4 engine
+    :return: Plain text
+    """
+    text = STRIP_ENGINES[engine](html, max_chars=max_chars, main_only=main_only)
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars] + TRUNCATION_MARKER
+    return text
@@ -0,0 +1,137 @@
+"""
+ask_dcnc/throttle.py
+Client-side rate limiting and retries for Bedrock throttling
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any
+
+import streamlit as st
+from langchain_core.rate_limiters import BaseRateLimiter
+from langgraph.types import RetryPolicy
+from loguru import logger
+
+BEDROCK_REQUESTS_PER_SECOND = float(os.getenv("BEDROCK_REQUESTS_PER_SECOND", 2.0))  # Per model
+BEDROCK_BURST = int(os.getenv("BEDROCK_BURST", 4))
+THROTTLE_MAX_ATTEMPTS = 5
+FALLBACK_MAX_ATTEMPTS = 2  # Attempts per throttled step of a model with a fallback, which is tried instead of waiting
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException"}
+
+
+def get_error_code(e: BaseException) -> str | None:
+    """
+    :param e: Exception raised by boto3, possibly wrapped by LangChain
+    :return: AWS error code, or None if the exception did not come from AWS
+    """
+    while e is not None:
+        response = getattr(e, "response", None)
+        if isinstance(response, dict) and "Error" in response:
+            return response["Error"].get("Code")
+        e = e.__cause__
+    return None
+
+
+def is_throttling_error(e: BaseException) -> bool:
+    return get_error_code(e) in THROTTLING_ERROR_CODES
+
+
+class TokenBucket(BaseRateLimiter):
+    """
+    Thread-safe token bucket shared by all LLM clients of a model
+    The rate halves whenever Bedrock throttles and creeps back up with every request let through
+    """
+
+    def __init__(self, rate: float, capacity: int, min_rate: float | None = None):
+        """
+        :param rate: Requests per second
+        :param capacity: Maximum burst of requests
+        :param min_rate: Lowest rate after throttling, an eighth of the rate by default
+        """
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 8
+        self.rate = rate
+        self.capacity = capacity
+        self.throttles = 0
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """
+        :return: 0 if a token was taken, otherwise seconds until the next token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        while delay := self._take():
+            if not blocking:
+                return False
+            time.sleep(delay)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        while delay := self._take():
+            if not blocking:
+                return False
+            await asyncio.sleep(delay)
+        return True
+
+    def throttled(self) -> None:
+        """
+        Slow down after Bedrock rejected a request
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            self.throttles += 1
+        logger.warning(f"Bedrock throttled, rate limit lowered to {self.rate:.2f} requests/s")
+
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter(llm_model: str) -> TokenBucket:
+    """
+    Rate limiter shared by all clients of a model
+    :param llm_model: Bedrock model ID
+    :return: TokenBucket
+    """
+    return TokenBucket(rate=BEDROCK_REQUESTS_PER_SECOND, capacity=BEDROCK_BURST)
+
+
+def get_retry_policy(rate_limiter: BaseRateLimiter | None = None) -> RetryPolicy:
+    """
+    Retry graph nodes throttled by Bedrock with jittered exponential backoff
+    :param rate_limiter: Rate limiter of the model, slowed down on every throttle
+    :return: RetryPolicy for the agent graph
+    """
+
+    def retry_on(e: Exception) -> bool:
+        if not is_throttling_error(e):
+            return False
+        if isinstance(rate_limiter, TokenBucket):
+            rate_limiter.throttled()
+        return True
+
+    return RetryPolicy(initial_interval=1.0, max_interval=20.0, max_attempts=THROTTLE_MAX_ATTEMPTS, retry_on=retry_on)
+
+
+def with_max_attempts(agent: Any, max_attempts: int) -> Any:
+    """
+    Copy a compiled agent with fewer attempts per throttled step, the cached agent is left as it is
+    :param agent: Agent from `ask_dcnc.agent.get_agent`
+    :param max_attempts: Attempts per step, including the first
+    :return: Agent sharing the graph of the original
+    """
+    return agent.copy(update={
+        "retry_policy": [policy._replace(max_attempts=max_attempts) for policy in agent.retry_policy or []],
+    })
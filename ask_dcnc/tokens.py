@@ -0,0 +1,15 @@
+"""
+ask_dcnc/tokens.py
+Token estimates for budgeting text sent to the LLM, without a tokenizer or the LLM client
+"""
+
+CHARS_PER_TOKEN = 4  # Rough estimate for English text, good enough for budgeting
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in some text
+    :param text: Text
+    :return: Estimated token count
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
@@ -0,0 +1,346 @@
+"""
+ask_dcnc/tracing.py
+Per-turn tracing of LLM calls, tools, and other steps, with Prometheus-format metrics
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator
+from uuid import UUID
+
+import streamlit as st
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from loguru import logger
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+TRACE_LOG_PATH = os.path.join(BASE_DIR, "logs/ask-dcnc.trace.jsonl")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # 0 disables the metrics endpoint
+# Histogram bucket upper bounds by the unit suffix of the metric name
+METRICS_BUCKETS = {
+    "_seconds": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+    "_tokens": (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+    "_chars": (100, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000),
+}
+SPAN_LABELS = {"llm": "model", "tool": "tool", "step": "step"}  # Metric label holding the span name per kind
+
+# Trace and span of the tool being run, so steps inside tools can add child spans
+_current: ContextVar[tuple["Tracer", str] | None] = ContextVar("ask_dcnc_trace", default=None)
+
+_write_lock = threading.Lock()
+
+
+class Metrics:
+    """
+    Thread-safe Prometheus histograms, so p50, p95, and p99 can be computed with histogram_quantile() across replicas
+    """
+
+    def __init__(self):
+        self._buckets: dict[tuple, list[int]] = {}
+        self._counts: dict[tuple, int] = defaultdict(int)
+        self._sums: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def bounds(name: str) -> tuple:
+        """
+        :param name: Metric name ending in a unit suffix of METRICS_BUCKETS
+        :return: Bucket upper bounds, without +Inf
+        """
+        return next(bounds for suffix, bounds in METRICS_BUCKETS.items() if name.endswith(suffix))
+
+    def observe(self, name: str, value: float, labels: dict[str, str] | None = None) -> None:
+        """
+        :param name: Metric name
+        :param value: Observed value
+        :param labels: Metric labels
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+        bounds = self.bounds(name)
+        with self._lock:
+            buckets = self._buckets.setdefault(key, [0] * len(bounds))
+            if (i := bisect_left(bounds, value)) < len(bounds):
+                buckets[i] += 1
+            self._counts[key] += 1
+            self._sums[key] += value
+
+    def render(self) -> str:
+        """
+        :return: Metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            series = {key: list(buckets) for key, buckets in self._buckets.items()}
+            counts, sums = dict(self._counts), dict(self._sums)
+
+        lines, typed = [], set()
+        for (name, labels), buckets in sorted(series.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            label_str = ",".join(f'{key}="{value}"' for key, value in labels)
+            separator = "," if label_str else ""
+            cumulative = 0
+            for bound, count in zip(self.bounds(name), buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label_str}{separator}le="{float(bound)}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_str}{separator}le="+Inf"}} {counts[(name, labels)]}')
+            suffix = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{name}_sum{suffix} {sums[(name, labels)]}")
+            lines.append(f"{name}_count{suffix} {counts[(name, labels)]}")
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics() -> Metrics:
+    """
+    Metrics shared by all sessions
+    :return: Metrics
+    """
+    return Metrics()
+
+
+class Tracer(BaseCallbackHandler):
+    """
+    Callback handler recording a span for every LLM call and tool invocation of a turn
+    Call `finish` at the end of the turn to write the spans to the trace log
+    """
+
+    run_inline = True  # Tool callbacks must run in the tool's context for child spans
+
+    def __init__(self, metrics: Metrics | None = None, path: str = TRACE_LOG_PATH, **attributes: Any):
+        """
+        :param metrics: Metrics to record the spans in, none if not given
+        :param path: JSONL file the spans are appended to
+        :param attributes: Extra fields written with every span, e.g. the model and answer style
+        """
+        self.trace_id = uuid.uuid4().hex
+        self.metrics = metrics
+        self.path = path
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.spans: list[dict] = []
+        self._open: dict[str, dict] = {}
+        self._tool_tokens: dict[str, Token] = {}  # Resets the current tool span when the tool ends
+        self._lock = threading.Lock()
+
+    def _start(self, span_id: str, kind: str, name: str, parent_id: str | None = None, **fields: Any) -> None:
+        with self._lock:
+            self._open[span_id] = {
+                "trace_id": self.trace_id,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "kind": kind,
+                "name": name,
+                "start": time.time(),
+                "_perf": time.perf_counter(),
+                **fields,
+            }
+
+    def _end(self, span_id: str, error: BaseException | None = None, **fields: Any) -> dict | None:
+        with self._lock:
+            span = self._open.pop(span_id, None)
+            if span is None:
+                return None
+            span["duration_ms"] = (time.perf_counter() - span.pop("_perf")) * 1000
+            if error:
+                span["error"] = f"{type(error).__name__}: {error}"
+            span.update(fields)
+            self.spans.append(span)
+        if self.metrics:
+            self.metrics.observe(f"askdcnc_{span['kind']}_duration_seconds", span["duration_ms"] / 1000,
+                                 {SPAN_LABELS[span["kind"]]: span["name"]})
+        return span
+
+    def on_chat_model_start(
+            self,
+            serialized: dict[str, Any],
+            messages: list[list],
+            *,
+            run_id: UUID,
+            parent_run_id: UUID | None = None,
+            metadata: dict[str, Any] | None = None,
+            **kwargs: Any,
+    ) -> None:
+        name = (metadata or {}).get("ls_model_name") or (serialized.get("kwargs") or {}).get("model_id") or "llm"
+        self._start(str(run_id), "llm", name, ttft_ms=None, input_tokens=None, output_tokens=None)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            span = self._open.get(str(run_id))
+            if span and span["ttft_ms"] is None:
+                span["ttft_ms"] = (time.perf_counter() - span["_perf"]) * 1000
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        input_tokens, output_tokens = _get_token_usage(response)
+        span = self._end(str(run_id), input_tokens=input_tokens, output_tokens=output_tokens)
+        if span and self.metrics:
+            if span["ttft_ms"] is not None:
+                self.metrics.observe("askdcnc_llm_ttft_seconds", span["ttft_ms"] / 1000, {"model": span["name"]})
+            for direction, tokens in (("input", input_tokens), ("output", output_tokens)):
+                if tokens is not None:
+                    self.metrics.observe("askdcnc_llm_tokens", tokens, {"model": span["name"], "direction": direction})
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(str(run_id), error=error)
+
+    def on_tool_start(
+            self,
+            serialized: dict[str, Any],
+            input_str: str,
+            *,
+            run_id: UUID,
+            inputs: dict[str, Any] | None = None,
+            **kwargs: Any,
+    ) -> None:
+        # Inputs are kept so recorded turns can be replayed by benchmarks/bench_e2e.py
+        self._start(
+            str(run_id), "tool", serialized.get("name") or "tool",
+            input=inputs if inputs is not None else input_str, input_chars=len(input_str),
+        )
+        token = _current.set((self, str(run_id)))
+        with self._lock:
+            self._tool_tokens[str(run_id)] = token
+
+    def _reset_current(self, run_id: UUID) -> None:
+        with self._lock:
+            token = self._tool_tokens.pop(str(run_id), None)
+        if token is None:
+            return
+        try:
+            _current.reset(token)
+        except ValueError:
+            # The tool ended in another context than it started in, which then holds no span of this tool
+            pass
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._reset_current(run_id)
+        content = getattr(output, "content", output)
+        span = self._end(str(run_id), result_chars=len(str(content)))
+        if span and self.metrics:
+            self.metrics.observe("askdcnc_tool_result_chars", span["result_chars"], {"tool": span["name"]})
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._reset_current(run_id)
+        self._end(str(run_id), error=error)
+
+    @contextmanager
+    def span(self, name: str, parent_id: str | None = None, **fields: Any) -> Iterator[dict]:
+        """
+        Record a step that is neither an LLM call nor a tool, e.g. an HTTP fetch inside a tool
+        :param name: Span name
+        :param parent_id: ID of the enclosing span
+        :param fields: Extra fields, the yielded dict can be updated with more
+        """
+        span_id = uuid.uuid4().hex
+        extra = dict(fields)
+        self._start(span_id, "step", name, parent_id)
+        try:
+            yield extra
+        except BaseException as e:
+            self._end(span_id, error=e, **extra)
+            raise
+        self._end(span_id, **extra)
+
+    def finish(self, **fields: Any) -> dict:
+        """
+        Write the spans of the turn to the trace log
+        :param fields: Extra fields of the turn, e.g. whether the answer was cached
+        :return: Turn summary with the total time per span kind
+        """
+        duration_ms = (time.time() - self.started_at) * 1000
+        turn = {
+            "trace_id": self.trace_id,
+            "kind": "turn",
+            "start": self.started_at,
+            "duration_ms": duration_ms,
+            **{f"{kind}_ms": sum(s["duration_ms"] for s in self.spans if s["kind"] == kind) for kind in
+               ("llm", "tool", "step")},
+            "llm_calls": sum(1 for s in self.spans if s["kind"] == "llm"),
+            "tool_calls": sum(1 for s in self.spans if s["kind"] == "tool"),
+            **self.attributes,
+            **fields,
+        }
+        if self.metrics:
+            self.metrics.observe("askdcnc_turn_duration_seconds", duration_ms / 1000)
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with _write_lock, open(self.path, "a", encoding="utf-8") as f:
+                for span in self.spans + [turn]:
+                    f.write(json.dumps(span | self.attributes, default=str, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Unable to write trace: {e}")
+
+        logger.debug(
+            f"Trace {self.trace_id}: {duration_ms / 1000:.2f}s total, LLM {turn['llm_ms'] / 1000:.2f}s "
+            f"in {turn['llm_calls']} calls, tools {turn['tool_ms'] / 1000:.2f}s in {turn['tool_calls']} calls"
+        )
+        return turn
+
+
+def _get_token_usage(response: LLMResult) -> tuple[int | None, int | None]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+@contextmanager
+def trace_span(name: str, **fields: Any) -> Iterator[dict]:
+    """
+    Record a span in the trace of the tool being run, or do nothing outside a traced tool
+    :param name: Span name
+    :param fields: Extra fields, the yielded dict can be updated with more
+    """
+    current = _current.get()
+    if current is None:
+        yield dict(fields)
+        return
+    tracer, parent_id = current
+    with tracer.span(name, parent_id=parent_id, **fields) as extra:
+        yield extra
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics: Metrics
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@st.cache_resource(show_spinner=False)
+def serve_metrics(port: int = METRICS_PORT) -> ThreadingHTTPServer | None:
+    """
+    Serve the shared metrics at /metrics in a background thread if METRICS_PORT is set
+    :param port: Port to listen on, 0 to disable
+    :return: HTTP server, or None if disabled
+    """
+    if not port:
+        return None
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": get_metrics()})
+    server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.success(f"Metrics served at http://0.0.0.0:{port}/metrics")
+    return server
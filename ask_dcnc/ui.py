@@ -4,6 +4,12 @@ Functions related to user-facing components
 """
 
 from datetime import timedelta
+from typing import Iterator
+
+from langchain_core.messages import AIMessageChunk, BaseMessage, ToolMessage
+from loguru import logger
+
+from ask_dcnc.pool import Job
 
 
 def get_time_str(time_diff: timedelta) -> str:
@@ -26,3 +32,128 @@ def get_time_str(time_diff: timedelta) -> str:
         return time_diff_str
     else:
         return ""
+
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+THOUGHT_PREFIX = "Thought:"
+
+
+def get_message_text(message: BaseMessage) -> str:
+    """
+    Get the text of a message or message chunk, ignoring tool use blocks
+    :param message: LangChain message
+    :return: Text content
+    """
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        block.get("text", "") if isinstance(block, dict) else str(block)
+        for block in message.content
+        if not isinstance(block, dict) or block.get("type") == "text"
+    )
+
+
+class StepParser:
+    """
+    Splits the streamed text of one agent step into the thought and the final answer
+    Text is fed in partial chunks, so the markers may arrive split across chunks
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._answer_sent = 0
+
+    @property
+    def has_answer(self) -> bool:
+        return FINAL_ANSWER_MARKER in self.text
+
+    @property
+    def thought(self) -> str:
+        """
+        :return: Text before "Final Answer:" without the "Thought:" prefix
+        """
+        thought = self.text.split(FINAL_ANSWER_MARKER, 1)[0].strip()
+        if not self.has_answer:
+            # Hide a marker that is still arriving on a new line, e.g. "\nFinal Ans"
+            for i in range(len(FINAL_ANSWER_MARKER) - 1, 0, -1):
+                if thought.endswith("\n" + FINAL_ANSWER_MARKER[:i]):
+                    thought = thought[:-i].strip()
+                    break
+        if thought.startswith(THOUGHT_PREFIX):
+            thought = thought[len(THOUGHT_PREFIX):].strip()
+        elif THOUGHT_PREFIX.startswith(thought):
+            return ""  # The prefix itself is still arriving
+        return thought
+
+    def feed(self, text: str) -> str:
+        """
+        Add a chunk of text
+        :param text: Text of the chunk
+        :return: New final answer text, empty until "Final Answer:" has arrived
+        """
+        self.text += text
+        if not self.has_answer:
+            return ""
+        answer = self.text.split(FINAL_ANSWER_MARKER, 1)[1].lstrip()
+        delta = answer[self._answer_sent:]
+        self._answer_sent = len(answer)
+        return delta
+
+
+def stream_answer(stream: Iterator, thoughts_expander, thoughts: list[str]) -> Iterator[str]:
+    """
+    Show thoughts and tool calls as they arrive, and yield the final answer token by token for `st.write_stream`
+    :param stream: Agent stream with stream_mode="messages"
+    :param thoughts_expander: Streamlit container for the thoughts
+    :param thoughts: List to add the text of each completed step to, the last one is the final response
+    :return: Generator of final answer text
+    """
+    step, step_id, thought_box, shown_thought = None, None, None, ""
+
+    def end_step():
+        if step and step.text:
+            logger.debug(step.text)
+            thoughts.append(step.text)
+
+    for message, metadata in stream:
+        if isinstance(message, ToolMessage):
+            thoughts_expander.caption(f"Used {message.name}")
+            continue
+        if not isinstance(message, AIMessageChunk) or metadata.get("langgraph_node") != "agent":
+            continue
+
+        # Each LLM call in the ReAct loop streams chunks with its own message ID
+        if message.id != step_id:
+            end_step()
+            step, step_id, thought_box, shown_thought = StepParser(), message.id, thoughts_expander.empty(), ""
+
+        for tool_call in message.tool_call_chunks:
+            if tool_call.get("name"):
+                thoughts_expander.caption(f"Using {tool_call['name']}")
+
+        answer = step.feed(get_message_text(message))
+        if step.thought != shown_thought:
+            shown_thought = step.thought
+            thought_box.write(shown_thought)
+        if answer:
+            yield answer
+    end_step()
+
+    # A last step without "Final Answer:" is the answer itself
+    if step and not step.has_answer:
+        thought_box.empty()
+        yield step.text
+
+
+def wait_for_turn(job: Job, status) -> None:
+    """
+    Show the queue position and estimated wait until a worker starts the agent run
+    :param job: Agent run from `AgentPool.submit`
+    :param status: Streamlit placeholder for the queue status
+    """
+    while not job.started.wait(timeout=1):
+        status.caption(
+            f":material/hourglass_top: You are number {job.position} in the queue. "
+            f"Estimated wait: {job.estimated_wait:.0f} seconds."
+        )
+    status.empty()
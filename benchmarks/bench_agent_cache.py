@@ -0,0 +1,42 @@
+"""
+benchmarks/bench_agent_cache.py
+Per-turn agent setup latency with and without the agent registry
+
+Usage: python -m benchmarks.bench_agent_cache [--iterations N]
+"""
+
+import argparse
+
+from loguru import logger
+
+from ask_dcnc.agent import build_agent, get_agent
+from ask_dcnc.prompt import get_system_prompt
+from benchmarks.fakes import FakeToolChatModel
+from benchmarks.stats import summary, timeit
+
+LLM_MODEL = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+TEMPERATURE = 0.5
+ANSWER_STYLE = "Brief"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    logger.remove()
+    llm = FakeToolChatModel()
+
+    # Before: toolkits and graph rebuilt on every submit
+    rebuild = timeit(
+        lambda: build_agent(llm=llm, system_prompt=get_system_prompt(ANSWER_STYLE)),
+        args.iterations,
+    )
+
+    # After: first call compiles, later turns hit the registry
+    cold = timeit(lambda: get_agent(LLM_MODEL, TEMPERATURE, ANSWER_STYLE, llm=llm, llm_name="fake"), 1)
+    warm = timeit(lambda: get_agent(LLM_MODEL, TEMPERATURE, ANSWER_STYLE, llm=llm, llm_name="fake"), args.iterations)
+
+    print(summary("rebuild per turn", rebuild))
+    print(summary("registry (cold)", cold))
+    print(summary("registry (warm)", warm))
+    print(f"Per-turn setup saved: {sum(rebuild) / len(rebuild) - sum(warm) / len(warm):.3f}ms")
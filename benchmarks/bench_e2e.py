@@ -0,0 +1,298 @@
+"""
+benchmarks/bench_e2e.py
+End-to-end agent turns with a replay LLM, the real database, and a local stand-in for the RMIT website
+
+The replay model repeats recorded tool calls, from benchmarks/scenarios.json or from the trace log of a running app
+(logs/ask-dcnc.trace.jsonl), so everything except Bedrock runs for real: the agent graph, SQL, search, HTTP, HTML
+stripping, and stream parsing. Compare runs with --json and --baseline to catch regressions in CI.
+
+Usage: python -m benchmarks.bench_e2e [--scenarios FILE | --traces FILE] [--sessions N] [--latency S]
+                                      [--json FILE] [--baseline FILE] [--tolerance R]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+import ask_dcnc.html
+from ask_dcnc.agent import get_agent
+from ask_dcnc.models import stream_with_fallback
+from ask_dcnc.pool import AgentPool
+from ask_dcnc.tracing import TRACE_LOG_PATH, Tracer
+from ask_dcnc.ui import stream_answer
+from benchmarks.bench_html import CORPUS_DIR
+from benchmarks.fakes import ReplayChatModel
+from benchmarks.stats import summary
+
+SCENARIOS_PATH = os.path.join(os.path.dirname(__file__), "scenarios.json")
+RMIT_URL_PATTERN = re.compile(r"https?://([\w.-]*rmit\.edu\.au)")
+LLM_MODEL = "replay"
+
+
+class NullContainer:
+    """
+    Stands in for the Streamlit containers `stream_answer` writes to
+    """
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+
+def load_traces(path: str) -> list[dict]:
+    """
+    Turn recorded traces into scenarios, one per answered turn that ran the agent itself, not served from the cache or
+    joined to another session's run
+    :param path: Trace log written by `Tracer`
+    :return: Scenarios in the format of scenarios.json
+    """
+    turns, spans = {}, defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["kind"] == "turn":
+                ran_agent = not (record.get("cached") or record.get("joined"))
+                if record.get("question") and record.get("answered") and ran_agent:
+                    turns[record["trace_id"]] = record
+            elif record["kind"] in ("llm", "tool"):
+                spans[record["trace_id"]].append(record)
+
+    scenarios = {}
+    for trace_id, turn in turns.items():
+        # Tools belong to the step of the LLM call before them
+        steps = []
+        for span in sorted(spans[trace_id], key=lambda s: s["start"]):
+            if span["kind"] == "llm":
+                steps.append([])
+            elif steps and isinstance(span.get("input"), dict):
+                steps[-1].append({"name": span["name"], "args": span["input"]})
+        scenarios[turn["question"]] = {
+            "question": turn["question"],
+            "steps": [step for step in steps if step],
+            "answer": "Replayed answer.",
+        }
+    return list(scenarios.values())
+
+
+def rewrite_urls(scenarios: list[dict], base_url: str) -> None:
+    """
+    Point RMIT URLs in tool arguments at the stand-in server, keeping the original host in the path
+    """
+    for scenario in scenarios:
+        for step in scenario["steps"]:
+            for call in step:
+                for key, value in call["args"].items():
+                    if isinstance(value, str):
+                        call["args"][key] = RMIT_URL_PATTERN.sub(lambda m: f"{base_url}/{m.group(1)}", value)
+
+
+def synthetic_page(url: str) -> str:
+    """
+    Deterministic page shaped like an RMIT course guide, about 60 kB
+    """
+    seed = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    nav = "".join(f'<li class="mobinav-item"><a href="/nav/{i}">Menu {i}</a></li>' for i in range(200))
+    sections = "".join(
+        f"<h2>Section {i}</h2><p>{seed[i % 32:] } Learning outcomes, assessment tasks, and resources for this course "
+        f"are described here in detail. <a href='/courses/{i}'>Related course {i}</a></p>"
+        for i in range(150)
+    )
+    return (
+        f"<html><head><title>{url}</title><style>body {{ margin: 0 }}</style>"
+        f"<script>var tracking = '{seed}';</script></head><body><nav><ul>{nav}</ul></nav>"
+        f"<main id='main-content'><h1>{url}</h1>{sections}</main><footer>RMIT University</footer></body></html>"
+    )
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves saved pages from the corpus of bench_html, or synthetic pages for URLs not in the corpus
+    """
+
+    corpus = pathlib.Path(CORPUS_DIR)
+
+    def do_GET(self) -> None:
+        host, _, path = self.path.lstrip("/").partition("/")
+        html = None
+        for scheme in ("https", "http"):
+            name = hashlib.sha256(f"{scheme}://{host}/{path}".encode("utf-8")).hexdigest()[:16]
+            if (page := self.corpus / f"{name}.html").exists():
+                html = page.read_text(encoding="utf-8")
+                break
+        body = (html or synthetic_page(f"https://{host}/{path}")).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def run_turn(agent, scenario: dict, tracer: Tracer | None = None, pool: AgentPool | None = None) -> list[str]:
+    """
+    Run one turn the way pages/1_ask.py does
+    :return: Thoughts of the turn, the last one is the response
+    """
+    agent_input = {
+        "messages": [{"role": "user", "content": scenario["question"]}],
+        "time": "",
+        "context": "",
+        "history": "",
+    }
+    config = {"callbacks": [tracer]} if tracer else None
+    run = lambda: stream_with_fallback([(LLM_MODEL, agent)], agent_input, config=config)
+    stream = pool.submit(run)[0] if pool else run()
+
+    thoughts = []
+    "".join(stream_answer(stream=stream, thoughts_expander=NullContainer(), thoughts=thoughts))
+    return thoughts
+
+
+def measure_stages(agent, scenarios: list[dict], trace_path: str) -> dict[str, list[float]]:
+    """
+    Run every scenario once and split the turn time by stage
+    :return: Stage name to durations in milliseconds
+    """
+    stages = defaultdict(list)
+    for scenario in scenarios:
+        tracer = Tracer(path=trace_path)
+        start = time.perf_counter()
+        run_turn(agent, scenario, tracer)
+        total = (time.perf_counter() - start) * 1000
+        tracer.finish()
+
+        for span in tracer.spans:
+            stages[f"{span['kind']} {span['name']}"].append(span["duration_ms"])
+        traced = sum(span["duration_ms"] for span in tracer.spans if span["kind"] in ("llm", "tool"))
+        stages["graph, streaming, and parsing"].append(total - traced)
+        stages["turn"].append(total)
+    return stages
+
+
+def measure_sessions(agent, scenarios: list[dict], sessions: int) -> tuple[list[float], float, float, float]:
+    """
+    Run every scenario in N concurrent sessions through the agent pool, keeping each session's state alive
+    :return: Turn durations in milliseconds, throughput in turns per second, retained and peak kB per session
+    """
+    pool = AgentPool(max_workers=sessions, queue_limit=sessions)
+    durations, states, lock = [], [], threading.Lock()
+
+    def session() -> None:
+        state = []
+        for scenario in scenarios:
+            start = time.perf_counter()
+            state.append(run_turn(agent, scenario, pool=pool))
+            with lock:
+                durations.append((time.perf_counter() - start) * 1000)
+        with lock:
+            states.append(state)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (
+        durations,
+        len(durations) / elapsed,
+        (current - baseline) / sessions / 1024,
+        (peak - baseline) / sessions / 1024,
+    )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    :return: Descriptions of the metrics that regressed by more than the tolerance
+    """
+    regressions = []
+    for stage, mean in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before and mean > before * (1 + tolerance) and mean - before > 1:
+            regressions.append(f"{stage}: {before:.2f}ms -> {mean:.2f}ms")
+    before = baseline.get("throughput")
+    if before and results["throughput"] < before * (1 - tolerance):
+        regressions.append(f"throughput: {before:.1f} -> {results['throughput']:.1f} turns/s")
+    before = baseline.get("memory_kb_per_session")
+    if before and results["memory_kb_per_session"] > before * (1 + tolerance):
+        regressions.append(f"memory: {before:.0f} -> {results['memory_kb_per_session']:.0f} kB/session")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--scenarios", default=SCENARIOS_PATH, help="Scenarios in the format of scenarios.json")
+    source.add_argument("--traces", nargs="?", const=TRACE_LOG_PATH, help="Replay turns recorded in a trace log")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent simulated sessions")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per replayed LLM call")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Fail if the results regressed from this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression ratio")
+    args = parser.parse_args()
+
+    logger.remove()
+    scenarios = load_traces(args.traces) if args.traces else json.load(open(args.scenarios, encoding="utf-8"))
+    if not scenarios:
+        sys.exit("No scenarios to replay.")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rewrite_urls(scenarios, f"http://127.0.0.1:{server.server_port}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the app's HTTP cache free of stand-in pages
+        ask_dcnc.html.HTTP_CACHE_PATH = os.path.join(tmp, "http.sqlite")
+
+        llm = ReplayChatModel(scenarios={s["question"]: s for s in scenarios}, latency=args.latency)
+        agent = get_agent(llm_model=LLM_MODEL, temperature=0.0, answer_style="Brief", llm=llm)
+        for scenario in scenarios:  # Warm up caches and connections
+            run_turn(agent, scenario)
+
+        stages = measure_stages(agent, scenarios, os.path.join(tmp, "trace.jsonl"))
+        durations, throughput, retained_kb, peak_kb = measure_sessions(agent, scenarios, args.sessions)
+
+    server.shutdown()
+
+    print(f"Scenarios: {len(scenarios)}, replayed LLM latency: {args.latency * 1000:.0f}ms")
+    for stage, values in sorted(stages.items()):
+        print(summary(stage, values))
+    print(summary(f"turn with {args.sessions} sessions", durations))
+    print(f"Throughput: {throughput:.1f} turns/s with {args.sessions} concurrent sessions")
+    print(f"Memory per session: {retained_kb:.0f} kB retained, {peak_kb:.0f} kB peak")
+
+    results = {
+        "stages": {stage: statistics.mean(values) for stage, values in stages.items()},
+        "throughput": throughput,
+        "memory_kb_per_session": retained_kb,
+        "peak_memory_kb_per_session": peak_kb,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
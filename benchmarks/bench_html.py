@@ -0,0 +1,145 @@
+"""
+benchmarks/bench_html.py
+HTML stripping engines over a saved corpus of RMIT program and course pages
+
+The corpus is a directory of .html files. It is not shipped with the repository, fill it from the HTTP cache of a
+running app with --from-cache, or download pages with --fetch URLS_FILE, e.g. the program_urls.txt produced by
+data/scripts/parse_sitemap.py. Without a corpus the benchmark runs over the synthetic pages in benchmarks/samples.
+
+Both engines are always checked against the expected text of the synthetic pages, the .txt file next to each page,
+with and without a character budget.
+After an intended change to the reference engine, rewrite them with --write-expected.
+
+Usage: python -m benchmarks.bench_html [--corpus DIR] [--from-cache] [--fetch URLS_FILE] [--iterations N]
+                                       [--write-expected]
+"""
+
+import argparse
+import hashlib
+import os
+import pathlib
+import sqlite3
+from contextlib import closing
+
+from loguru import logger
+
+from ask_dcnc.html import HTTP_CACHE_PATH, get_session
+from ask_dcnc.strip import HTML_MAX_CHARS, STRIP_ENGINES, TRUNCATION_MARKER, strip_html, strip_html_bs4
+from benchmarks.stats import summary, timeit
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "samples")
+
+
+def save_page(corpus: pathlib.Path, url: str, html: str) -> None:
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    (corpus / f"{name}.html").write_text(html, encoding="utf-8")
+
+
+def export_cache(corpus: pathlib.Path) -> int:
+    """
+    Copy raw HTML from the HTTP cache into the corpus
+    :return: Number of pages exported
+    """
+    import json
+
+    with closing(sqlite3.connect(HTTP_CACHE_PATH)) as conn:
+        rows = conn.execute("select key, value from cache").fetchall()
+    for url, value in rows:
+        save_page(corpus, url, json.loads(value)["html"])
+    return len(rows)
+
+
+def fetch_pages(corpus: pathlib.Path, urls_file: str) -> int:
+    """
+    Download pages into the corpus
+    :return: Number of pages downloaded
+    """
+    count = 0
+    with open(urls_file, encoding="utf-8") as f:
+        for url in filter(None, map(str.strip, f)):
+            response = get_session().get(url, timeout=10)
+            if response.ok:
+                save_page(corpus, url, response.text)
+                count += 1
+    return count
+
+
+def check_samples(samples: pathlib.Path, write: bool = False) -> list[str]:
+    """
+    Compare both engines with the expected text of each synthetic page, unbounded and with a budget one character
+    short of the page, which must truncate it without losing any text before the marker
+    :param samples: Directory of .html pages, each with its expected text in a .txt file of the same name
+    :param write: Rewrite the expected text from the reference engine instead
+    :return: Names of the pages an engine strips differently, with the engine and budget
+    """
+    mismatches = []
+    for path in sorted(samples.glob("*.html")):
+        html = path.read_text(encoding="utf-8")
+        expected = path.with_suffix(".txt")
+        if write:
+            expected.write_text(strip_html_bs4(html), encoding="utf-8")
+            continue
+        text = expected.read_text(encoding="utf-8")
+        budget = len(text) - 1
+        mismatches += [
+            f"{path.name} ({engine}, {max_chars or 'no'} char budget)"
+            for engine in STRIP_ENGINES
+            for max_chars, expected_text in [(None, text), (budget, text[:budget] + TRUNCATION_MARKER)]
+            if strip_html(html, engine=engine, max_chars=max_chars) != expected_text
+        ]
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--from-cache", action="store_true")
+    parser.add_argument("--fetch", metavar="URLS_FILE")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--write-expected", action="store_true", help="Rewrite the expected text of the samples")
+    args = parser.parse_args()
+
+    logger.remove()
+    samples = pathlib.Path(SAMPLES_DIR)
+    sample_mismatches = check_samples(samples, write=args.write_expected)
+    sample_count = len(list(samples.glob("*.html")))
+    print(f"{sample_count} synthetic pages, {len(sample_mismatches)} differ from the expected text")
+    for name in sample_mismatches:
+        print(f"  mismatch: {name}")
+
+    corpus = pathlib.Path(args.corpus)
+    corpus.mkdir(parents=True, exist_ok=True)
+    if args.from_cache:
+        print(f"Exported {export_cache(corpus)} pages from the HTTP cache")
+    if args.fetch:
+        print(f"Fetched {fetch_pages(corpus, args.fetch)} pages")
+
+    if not any(corpus.glob("*.html")):
+        print(f"No pages in {corpus}, use --from-cache or --fetch, benchmarking the synthetic pages instead")
+        corpus = samples
+    pages = [path.read_text(encoding="utf-8") for path in sorted(corpus.glob("*.html"))]
+
+    # The fast engine must produce the same text as the reference engine when unbounded
+    mismatches = [
+        path.name for path, html in zip(sorted(corpus.glob("*.html")), pages)
+        if strip_html(html, engine="fast", max_chars=None) != strip_html_bs4(html)
+    ]
+    print(f"{len(pages)} pages, {sum(map(len, pages)) / 1024:.0f} KiB of HTML, {len(mismatches)} mismatches")
+    for name in mismatches:
+        print(f"  mismatch: {name}")
+
+    def run(**kwargs):
+        return lambda: [strip_html(html, **kwargs) for html in pages]
+
+    print(summary("bs4", timeit(run(engine="bs4", max_chars=None), args.iterations)))
+    print(summary("fast", timeit(run(engine="fast", max_chars=None), args.iterations)))
+    print(summary(f"fast, {HTML_MAX_CHARS} char budget", timeit(run(engine="fast"), args.iterations)))
+    print(summary("fast, main content only", timeit(run(engine="fast", main_only=True), args.iterations)))
+
+    for label, kwargs in [
+        ("bs4", {"engine": "bs4", "max_chars": None}),
+        ("fast, budget", {"engine": "fast"}),
+        ("fast, main content only", {"engine": "fast", "main_only": True}),
+    ]:
+        print(f"{label:<40} {sum(len(strip_html(html, **kwargs)) for html in pages) / len(pages):9.0f} chars per page")
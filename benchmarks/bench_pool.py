@@ -0,0 +1,86 @@
+"""
+benchmarks/bench_pool.py
+Burst of agent runs through the shared pool with a model that Bedrock throttles
+
+Usage: python -m benchmarks.bench_pool [--sessions N] [--workers N] [--queue N] [--throttle-rate R] [--distinct N]
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from loguru import logger
+
+from ask_dcnc.agent import build_agent
+from ask_dcnc.pool import AgentPool, PoolFullError
+from ask_dcnc.prompt import get_system_prompt
+from ask_dcnc.throttle import TokenBucket
+from benchmarks.fakes import ThrottlingChatModel
+from benchmarks.stats import summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--queue", type=int, default=32)
+    parser.add_argument("--throttle-rate", type=float, default=0.2)
+    parser.add_argument("--rate", type=float, default=20.0, help="Requests per second allowed by the token bucket")
+    parser.add_argument("--distinct", type=int, default=0, help="Ask only N distinct questions, sharing in-flight runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.remove()
+    random.seed(args.seed)
+    rate_limiter = TokenBucket(rate=args.rate, capacity=args.workers)
+    llm = ThrottlingChatModel(throttle_rate=args.throttle_rate, rate_limiter=rate_limiter)
+    agent = build_agent(llm=llm, system_prompt=get_system_prompt("Brief"))
+    agent.retry_policy = [agent.retry_policy[0]._replace(initial_interval=0.05, max_interval=1.0)]
+    pool = AgentPool(max_workers=args.workers, queue_limit=args.queue)
+
+    waits, totals, results = [], [], {"answered": 0, "failed": 0, "rejected": 0}
+    lock = threading.Lock()
+
+    def session(i: int) -> None:
+        question = f"Question {i % args.distinct if args.distinct else i}"
+        agent_input = {"messages": [{"role": "user", "content": question}], "time": "", "context": ""}
+        start = time.perf_counter()
+        try:
+            job, _ = pool.submit(
+                run=lambda: agent.stream(input=agent_input, stream_mode="messages"),
+                key=question if args.distinct else None,
+            )
+        except PoolFullError:
+            with lock:
+                results["rejected"] += 1
+            return
+        job.started.wait()
+        wait = time.perf_counter() - start
+        try:
+            list(job)
+            outcome = "answered"
+        except Exception:
+            outcome = "failed"
+        with lock:
+            results[outcome] += 1
+            waits.append(wait * 1000)
+            totals.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(summary("queue wait", waits))
+    print(summary("end to end", totals))
+    print(
+        f"Sessions: {args.sessions}, answered: {results['answered']}, failed: {results['failed']}, "
+        f"rejected: {results['rejected']}"
+    )
+    print(
+        f"LLM calls: {llm.calls}, throttled: {llm.throttles}, "
+        f"final rate limit: {rate_limiter.rate:.2f} requests/s, throughput: {results['answered'] / elapsed:.1f} runs/s"
+    )
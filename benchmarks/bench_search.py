@@ -0,0 +1,55 @@
+"""
+benchmarks/bench_search.py
+Full-text search tools compared with the LIKE queries the agent writes by hand
+
+Build the index first: python -m ask_dcnc.search
+Usage: python -m benchmarks.bench_search [--iterations N]
+"""
+
+import argparse
+from contextlib import closing
+
+from loguru import logger
+
+from ask_dcnc.db import SQLITE_PATH
+from ask_dcnc.search import COURSE_SEARCH_SQL, has_search_index, search
+from ask_dcnc.sql import connect_read_only
+from benchmarks.stats import summary, timeit
+
+QUERIES = [
+    "python studio",
+    "data communications",
+    "network security",
+    "machine learning",
+    "software engineering project",
+]
+
+LIKE_SQL = """
+select distinct c.id, c.title, c.url
+from course c
+         join course_code cc on c.id = cc.id
+where c.title like ? or c.description like ?
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    logger.remove()
+    if not has_search_index(SQLITE_PATH):
+        raise SystemExit("Search index not found, run: python -m ask_dcnc.search")
+
+    with closing(connect_read_only(SQLITE_PATH)) as conn:
+        for query in QUERIES:
+            pattern = "%" + "%".join(query.split()) + "%"
+
+            def like():
+                return conn.execute(LIKE_SQL, (pattern, pattern)).fetchall()
+
+            like_rows = like()
+            fts_rows = search(SQLITE_PATH, COURSE_SEARCH_SQL, query)
+
+            print(f"\"{query}\": LIKE found {len(like_rows)}, FTS found {len(fts_rows)}")
+            print(summary("  like", timeit(like, args.iterations)))
+            print(summary("  fts5", timeit(lambda: search(SQLITE_PATH, COURSE_SEARCH_SQL, query), args.iterations)))
@@ -0,0 +1,78 @@
+"""
+benchmarks/bench_sqlite.py
+Read throughput with concurrent sessions, opening a connection per query as before or borrowing pooled connections
+
+Usage: python -m benchmarks.bench_sqlite [--queries N] [--sessions 1,2,4,8,16]
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+
+from loguru import logger
+
+from ask_dcnc.db import SQLITE_PATH
+from ask_dcnc.sql import pooled_connection
+
+# Shaped like the queries the agent and the router write
+QUERIES = [
+    "select c.id, cc.code, c.title, c.prerequisites, c.url from course c join course_code cc on c.id = cc.id "
+    "where cc.code = 'COSC1010'",
+    "select c.id, cc.code, c.title from course c join course_code cc on c.id = cc.id where c.title like '%Software%'",
+    "select pp.plan_code, pp.alt_title, p.title from program p join program_plan pp on p.code = pp.program_code "
+    "where p.title like '%Engineering%'",
+    "select pe.plan_code, pe.type, pe.title from program_elective pe where pe.type in ('major', 'minor')",
+    "select count(*) from course where description like '%python%'",
+]
+
+
+def connect_per_query(sql: str) -> list:
+    with closing(sqlite3.connect(f"file:{SQLITE_PATH}?mode=ro", uri=True, check_same_thread=False)) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def borrow_pooled(sql: str) -> list:
+    with pooled_connection(SQLITE_PATH) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def run(query, sessions: int, queries: int) -> tuple[float, Counter]:
+    """
+    :return: Queries per second, and errors by message
+    """
+    errors, lock = Counter(), threading.Lock()
+
+    def session(i: int) -> None:
+        for j in range(queries):
+            try:
+                query(QUERIES[(i + j) % len(QUERIES)])
+            except sqlite3.Error as e:
+                with lock:
+                    errors[str(e)] += 1
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sessions * queries / (time.perf_counter() - start), errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=int, default=200, help="Queries per session")
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="Comma-separated numbers of concurrent sessions")
+    args = parser.parse_args()
+
+    logger.remove()
+    borrow_pooled(QUERIES[0])  # Warm up the OS page cache
+    print(f"{'sessions':>8} {'per query':>12} {'pooled':>12} {'speedup':>8}  errors")
+    for sessions in map(int, args.sessions.split(",")):
+        before, before_errors = run(connect_per_query, sessions, args.queries)
+        after, after_errors = run(borrow_pooled, sessions, args.queries)
+        errors = "; ".join(f"{message} x{count}" for message, count in (before_errors + after_errors).items())
+        print(f"{sessions:>8} {before:>10.0f}/s {after:>10.0f}/s {after / before:>7.2f}x  {errors or 'none'}")
@@ -0,0 +1,110 @@
+"""
+benchmarks/fakes.py
+Fake chat models so the agent can be benchmarked without Bedrock
+"""
+
+import json
+import random
+import re
+import time
+import uuid
+from typing import Iterator
+
+from botocore.exceptions import ClientError
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeToolChatModel(FakeMessagesListChatModel):
+    """
+    Replays a fixed list of messages and accepts tool binding like ChatBedrock
+    """
+
+    responses: list = [AIMessage(content="Final Answer: This is a fake answer.")]
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class ThrottlingChatModel(FakeToolChatModel):
+    """
+    Raises Bedrock's ThrottlingException on a share of calls, after waiting like a real LLM call
+    """
+
+    throttle_rate: float = 0.3
+    latency: float = 0.05
+    calls: int = 0
+    throttles: int = 0
+
+    def _generate(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.throttle_rate:
+            self.throttles += 1
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait."}},
+                "InvokeModel",
+            )
+        return super()._generate(*args, **kwargs)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Deterministic model replaying recorded agent steps, keyed on the question of the turn
+    Stateless, so one instance and one compiled agent can serve any number of concurrent sessions
+    """
+
+    scenarios: dict[str, dict]  # Question to {"steps": [[{"name", "args"}, ...], ...], "answer": str}
+    latency: float = 0.0  # Seconds per LLM call, 0 to measure only the non-LLM overhead
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_message(self, messages: list[BaseMessage]) -> AIMessage:
+        last_question = max(i for i, message in enumerate(messages) if isinstance(message, HumanMessage))
+        scenario = self.scenarios[messages[last_question].content]
+        step = sum(1 for message in messages[last_question:] if isinstance(message, AIMessage))
+
+        if step < len(scenario["steps"]):
+            calls = scenario["steps"][step]
+            return AIMessage(
+                content=f"Thought: I will use {', '.join(call['name'] for call in calls)}.",
+                tool_calls=[
+                    {"name": call["name"], "args": call["args"], "id": f"call_{step}_{i}"}
+                    for i, call in enumerate(calls)
+                ],
+            )
+        return AIMessage(content=f"Thought: I have the answer.\nFinal Answer: {scenario['answer']}")
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    def _stream(
+        self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        message = self._next_message(messages)
+        message_id = f"run-{uuid.uuid4()}"
+
+        # Word by word like Bedrock, with the tool calls in the last chunk
+        for token in re.findall(r"\S+\s*|\s+", message.content):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token, id=message_id))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                id=message_id,
+                tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                    for i, call in enumerate(message.tool_calls)
+                ],
+            ))
@@ -0,0 +1,41 @@
+"""
+benchmarks/stats.py
+Timing helpers shared by the benchmarks
+"""
+
+import statistics
+import time
+from typing import Callable
+
+
+def timeit(func: Callable, iterations: int) -> list[float]:
+    """
+    Time a function call repeatedly
+    :param func: Function to call without arguments
+    :param iterations: Number of calls
+    :return: Durations in milliseconds
+    """
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def summary(name: str, durations: list[float]) -> str:
+    """
+    Format timings as a single line
+    :param name: Label of the timed operation
+    :param durations: Durations in milliseconds
+    :return: Summary line with mean, median, p95, and max
+    """
+    ordered = sorted(durations)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"{name:<40} n={len(durations):<5} "
+        f"mean={statistics.mean(durations):9.3f}ms "
+        f"median={statistics.median(durations):9.3f}ms "
+        f"p95={p95:9.3f}ms "
+        f"max={ordered[-1]:9.3f}ms"
+    )
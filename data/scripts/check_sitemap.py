@@ -0,0 +1,66 @@
+"""
+data/scripts/check_sitemap.py
+Check parse_sitemap.py against a local HTTP server serving a sitemap index with a plain and a gzipped child sitemap
+
+Usage: python check_sitemap.py [--urls 20000]
+"""
+
+import argparse
+import functools
+import gzip
+import os
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from parse_sitemap import iter_sitemap
+
+PROGRAM_URL = (
+    'https://www.rmit.edu.au/study-with-us/levels-of-study/undergraduate-study/bachelor-degrees'
+    '/bp{:03d}/bp{:03d}p21auscy'
+)
+NAMESPACE = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def urlset(urls: list[str]) -> str:
+    entries = ''.join(f'<url><loc>{url}</loc><lastmod>2024-01-01</lastmod></url>' for url in urls)
+    return f'<?xml version="1.0" encoding="UTF-8"?><urlset {NAMESPACE}>{entries}</urlset>'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--urls', type=int, default=20000, help='URLs in the plain child sitemap')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        plain = [PROGRAM_URL.format(i, i) for i in range(args.urls)]
+        zipped = [PROGRAM_URL.format(i, i) for i in range(args.urls, args.urls + 10)]
+        with open(os.path.join(root, 'a.xml'), 'w', encoding='utf-8') as f:
+            f.write(urlset(plain))
+        with gzip.open(os.path.join(root, 'b.xml.gz'), 'wt', encoding='utf-8') as f:
+            f.write(urlset(zipped))
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=root))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_port}'
+        with open(os.path.join(root, 'index.xml'), 'w', encoding='utf-8') as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex {NAMESPACE}>'
+                    f'<sitemap><loc>{base}/a.xml</loc><lastmod>2024-01-02</lastmod></sitemap>'
+                    f'<sitemap><loc>{base}/b.xml.gz</loc></sitemap></sitemapindex>')
+
+        since, skipped = {}, set()
+        found = [loc for loc, _, _ in iter_sitemap(f'{base}/index.xml', since, set(), skipped)]
+        assert found == plain + zipped, f'Expected {len(plain) + len(zipped)} URLs, got {len(found)}'
+        assert since == {f'{base}/a.xml': '2024-01-02'}, since
+
+        # A second run skips the child sitemap whose lastmod is unchanged
+        found = [loc for loc, _, _ in iter_sitemap(f'{base}/index.xml', since, set(), skipped)]
+        assert found == zipped and skipped == {f'{base}/a.xml'}, (len(found), skipped)
+        server.shutdown()
+
+    print(f'OK: {len(plain) + len(zipped)} URLs read over HTTP from a sitemap index with a gzipped child')
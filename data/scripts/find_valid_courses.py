@@ -1,34 +1,206 @@
-import time
+"""
+data/scripts/find_valid_courses.py
+Find valid course IDs by probing course guide URLs concurrently, politely, and resumably
+
+Usage: python find_valid_courses.py [--start 1000] [--end 60000] [--workers N] [--concurrency N] [--rate R]
+                                    [--base-url URL] [--output valid_courses.csv]
+Try it against the mock server first: python mock_course_server.py, then --base-url http://127.0.0.1:8766/courses/
+An interrupted sweep resumes from its checkpoints when run again with the same arguments.
+"""
+
+import argparse
+import asyncio
 import csv
-import requests
-from bs4 import BeautifulSoup
+import html
+import json
+import multiprocessing
+import os
+import re
+import time
 
-start = 1000
-end = 59999
-delay = 0.5
-output = 'valid_courses.csv'
+import httpx
 
-if __name__ == '__main__':
-    session = requests.Session()
+from politeness import RETRIES, RETRY_STATUSES, RateLimiter, retry_delay
+
+START = 1000
+END = 60000
+BASE_URL = 'http://www1.rmit.edu.au/courses/'
+OUTPUT = 'valid_courses.csv'
+CONCURRENCY = 16  # Requests in flight per worker process
+RATE = 20.0  # Requests per second across all worker processes
+TIMEOUT = 10
+CHECKPOINT_INTERVAL = 5.0  # Seconds between checkpoint writes
+
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+class Checkpoint:
+    """
+    Course IDs of a shard that have been probed
+    Saved as a watermark below which every ID is done, plus the IDs done above it
+    """
+
+    def __init__(self, path: str, start: int, end: int):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.watermark = start
+        self.done: set[int] = set()
+        self.saved_at = time.monotonic()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            if (state['start'], state['end']) != (start, end):
+                raise SystemExit(f'{path} is for IDs {state["start"]}-{state["end"]}, delete it to start over')
+            self.watermark = state['watermark']
+            self.done = set(state['done'])
+
+    def is_done(self, course_id: int) -> bool:
+        return course_id < self.watermark or course_id in self.done
+
+    def mark(self, course_id: int):
+        self.done.add(course_id)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+        if time.monotonic() - self.saved_at > CHECKPOINT_INTERVAL:
+            self.save()
 
-    with open(output, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
+    def save(self):
+        # Write and rename, so a crash never leaves a half-written checkpoint
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'start': self.start, 'end': self.end, 'watermark': self.watermark, 'done': sorted(self.done)}, f)
+        os.replace(f'{self.path}.tmp', self.path)
+        self.saved_at = time.monotonic()
+
+
+async def probe(client: httpx.AsyncClient, limiter: RateLimiter, url: str) -> httpx.Response:
+    """
+    GET a URL, retrying network errors, throttling, and server errors with exponential backoff and jitter
+    """
+    for attempt in range(RETRIES + 1):
+        await limiter.wait_async()
+        try:
+            response = await client.get(url)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            error = f'HTTP {response.status_code}'
+        except httpx.TransportError as e:
+            retry_after, error = None, f'{type(e).__name__}: {e}'
+        if attempt == RETRIES:
+            raise RuntimeError(error)
+        await asyncio.sleep(retry_delay(attempt, retry_after))
+
+
+async def sweep(shard: int, start: int, end: int, args) -> tuple[int, int]:
+    """
+    Probe the course IDs of one shard, appending valid courses to the shard's part file
+    :return: Number of courses found and of IDs that failed after all retries
+    """
+    part = f'{args.output}.part{shard}'
+    checkpoint = Checkpoint(f'{part}.json', start, end)
+    ids = asyncio.Queue()
+    for course_id in range(checkpoint.watermark, end):
+        if not checkpoint.is_done(course_id):
+            ids.put_nowait(course_id)
+    if ids.empty():
+        return 0, 0
+
+    limiter = RateLimiter(args.rate / args.workers)
+    found, failed = 0, 0
+    new_file = not os.path.exists(part)
+    with open(part, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['course_id', 'url', 'title'])
+
+        async def worker(client: httpx.AsyncClient):
+            nonlocal found, failed
+            while not ids.empty():
+                course_id = ids.get_nowait()
+                url = f'{args.base_url}{course_id:06d}'
+                try:
+                    response = await probe(client, limiter, url)
+                except RuntimeError as e:
+                    # Left out of the checkpoint so the next run tries again
+                    print(f'[ERROR] {url} → {e}')
+                    failed += 1
+                    continue
+                if response.status_code == 200:
+                    match = TITLE_PATTERN.search(response.text)
+                    title = html.unescape(match.group(1)).strip() if match else ''
+                    writer.writerow([f'{course_id:06d}', url, title])
+                    f.flush()
+                    found += 1
+                    print(f'[FOUND] {course_id:06d} → "{title}"')
+                checkpoint.mark(course_id)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        try:
+            async with httpx.AsyncClient(timeout=TIMEOUT, limits=limits, follow_redirects=True) as client:
+                await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        finally:
+            checkpoint.save()
+    return found, failed
+
+
+def run_shard(shard: int, start: int, end: int, args) -> tuple[int, int]:
+    return asyncio.run(sweep(shard, start, end, args))
+
+
+def merge(output: str, shards: int):
+    """
+    Combine the part files into the output, sorted and without the duplicates a crash between a write and a checkpoint
+    can leave, then remove the parts and checkpoints
+    """
+    rows = {}
+    for shard in range(shards):
+        part = f'{output}.part{shard}'
+        if os.path.exists(part):
+            with open(part, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    rows[row['course_id']] = row
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
         writer.writerow(['course_id', 'url', 'title'])
+        for course_id in sorted(rows):
+            writer.writerow([course_id, rows[course_id]['url'], rows[course_id]['title']])
+    for shard in range(shards):
+        for path in (f'{output}.part{shard}', f'{output}.part{shard}.json'):
+            if os.path.exists(path):
+                os.remove(path)
 
-        for i in range(start, end):
-            course_id = f"{i:06d}"
-            url = f"http://www1.rmit.edu.au/courses/{course_id}"
 
-            try:
-                resp = session.get(url, timeout=10)
-            except requests.RequestException as e:
-                print(f"[ERROR] {url} → {e}")
-                continue
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--start', type=int, default=START)
+    parser.add_argument('--end', type=int, default=END, help='First ID not probed')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes, each sweeping a slice of the IDs')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Requests in flight per worker')
+    parser.add_argument('--rate', type=float, default=RATE, help='Requests per second in total, 0 for no limit')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--output', default=OUTPUT)
+    args = parser.parse_args()
 
-            if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                title = soup.title.string.strip()
-                writer.writerow([course_id, url, title])
-                print(f"[FOUND] {course_id} → \"{title}\"")
+    size = -(-(args.end - args.start) // args.workers)
+    shards = [
+        (shard, args.start + shard * size, min(args.start + (shard + 1) * size, args.end), args)
+        for shard in range(args.workers)
+    ]
+    began = time.perf_counter()
+    if args.workers == 1:
+        results = [run_shard(*shards[0])]
+    else:
+        with multiprocessing.Pool(args.workers) as pool:
+            results = pool.starmap(run_shard, shards)
 
-            time.sleep(delay)
+    found = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    print(f'Probed IDs {args.start}-{args.end - 1} in {time.perf_counter() - began:.1f}s, found {found} new courses')
+    if failed:
+        print(f'{failed} IDs failed, run again with the same arguments to retry them')
+    else:
+        merge(args.output, args.workers)
+        print(f'Saved {args.output}')
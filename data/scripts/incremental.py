@@ -0,0 +1,268 @@
+"""
+data/scripts/incremental.py
+Incremental refresh of scraped pages with conditional requests, content hashes, and a changelog
+
+The state of every page, its validators, hashes, and parsed record, is kept in a SQLite file, so a refresh only
+downloads pages the server says have changed, only reparses pages whose HTML changed, and rewrites the output CSV from
+the state.
+Pages are also stripped into the app's snapshot store, so the agent reads them without fetching them at answer time.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
+from typing import Callable
+
+import requests
+
+from ask_dcnc.snapshots import SnapshotStore
+from ask_dcnc.strip import strip_html
+from politeness import RETRIES, RETRY_STATUSES, RateLimiter, retry_delay
+
+STATE_PATH = '../raw_data/pages.sqlite'
+CHANGELOG_PATH = '../raw_data/changelog.csv'
+SNAPSHOT_PATH = '../snapshots.sqlite'  # The app's data/snapshots.sqlite
+WORKERS = 8
+RATE = 10.0  # Requests per second across all workers, retries included
+TIMEOUT = 10
+GONE_STATUSES = {404, 410}
+
+SCHEMA = '''
+create table if not exists page (
+    url text primary key,
+    kind text not null,
+    key text not null,
+    etag text,
+    last_modified text,
+    html_hash text,
+    record_hash text,
+    record text,
+    checked_at real,
+    changed_at real
+);
+create index if not exists page_kind on page (kind, key);
+'''
+
+
+@dataclass
+class Changes:
+    added: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unchanged: int = 0
+    not_modified: int = 0  # Unchanged pages the server answered with 304, without sending the page
+    failed: int = 0
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def fetch(
+        session: requests.Session,
+        limiter: RateLimiter,
+        url: str,
+        page: dict | None,
+        full: bool,
+) -> requests.Response:
+    """
+    GET a page, conditionally if its validators are known, retrying network errors, throttling, and server errors with
+    exponential backoff and jitter
+    """
+    headers = {}
+    if page and not full:
+        if page['etag']:
+            headers['If-None-Match'] = page['etag']
+        if page['last_modified']:
+            headers['If-Modified-Since'] = page['last_modified']
+    for attempt in range(RETRIES + 1):
+        limiter.wait()
+        try:
+            response = session.get(url, headers=headers, timeout=TIMEOUT)
+            if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                return response
+            retry_after = response.headers.get('Retry-After')
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == RETRIES:
+                raise
+            retry_after = None
+        time.sleep(retry_delay(attempt, retry_after))
+
+
+def refresh(
+        kind: str,
+        urls: dict[str, str],
+        parse: Callable[[str, str], dict | None],
+        output: str,
+        columns: list[str],
+        full: bool = False,
+        workers: int = WORKERS,
+        rate: float = RATE,
+        state_path: str = STATE_PATH,
+        changelog_path: str = CHANGELOG_PATH,
+        only: set[str] | None = None,
+        snapshot_path: str | None = SNAPSHOT_PATH,
+) -> Changes:
+    """
+    Refresh the pages of one kind and rewrite their output CSV
+    :param kind: "course" or "program", pages of other kinds in the state are left alone
+    :param urls: URL to key, e.g. course ID, of every page that should exist
+    :param parse: Parses the HTML of a URL into an output row, or None if the page is not valid
+    :param output: Output CSV path
+    :param columns: Output CSV columns, in the keys of the parsed rows
+    :param full: Download every page again, ignoring ETag and Last-Modified
+    :param workers: Pages fetched at once
+    :param rate: Requests per second in total, 0 for no limit
+    :param state_path: SQLite file of page states
+    :param changelog_path: CSV the changes are appended to
+    :param only: URLs to check, e.g. those a sitemap says changed, other known pages are kept as they are
+    :param snapshot_path: Snapshot store the stripped pages are written to, None to leave it alone
+    :return: Changes found
+    """
+    changes = Changes()
+    lock = threading.Lock()
+    local = threading.local()
+    limiter = RateLimiter(rate)
+    now = time.time()
+    snapshots = SnapshotStore(snapshot_path) if snapshot_path else None
+
+    with closing(sqlite3.connect(state_path, check_same_thread=False)) as conn:
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA)
+        pages = {row['url']: dict(row) for row in conn.execute('select * from page where kind = ?', (kind,))}
+
+        def save(url: str, **values):
+            with lock, conn:
+                conn.execute(
+                    'insert into page (url, kind, key) values (?, ?, ?) on conflict (url) do nothing',
+                    (url, kind, urls[url]),
+                )
+                assignments = ', '.join(f'{name} = ?' for name in values)
+                conn.execute(f'update page set {assignments} where url = ?', (*values.values(), url))
+
+        def remove(url: str):
+            with lock, conn:
+                conn.execute('delete from page where url = ?', (url,))
+                changes.removed.append(url)
+            if snapshots:
+                snapshots.delete(url)
+
+        def snapshot(url: str, html: str, html_hash: str):
+            # Strip only pages whose HTML is new to the store
+            if snapshots and not snapshots.touch(url, html_hash):
+                snapshots.put(url, kind, strip_html(html), html_hash)
+
+        def check(url: str):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            page = pages.get(url)
+            # Pages missing from the snapshot store are downloaded whole to fill it
+            whole = full or (snapshots is not None and url not in snapshots)
+            try:
+                response = fetch(local.session, limiter, url, page, whole)
+            except requests.RequestException as e:
+                print(f'Request failed: {e} for {url}')
+                with lock:
+                    changes.failed += 1
+                return
+
+            if response.status_code == 304 and page:
+                save(url, checked_at=now)
+                if snapshots:
+                    snapshots.touch(url)
+                with lock:
+                    changes.not_modified += 1
+                return
+            if response.status_code in GONE_STATUSES:
+                if page:
+                    remove(url)
+                return
+            if response.status_code != 200:
+                print(f'HTTP {response.status_code} for {url}')
+                with lock:
+                    changes.failed += 1
+                return
+
+            validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'checked_at': now,
+            }
+            html_hash = hash_text(response.text)
+            if page and page['html_hash'] == html_hash:
+                snapshot(url, response.text, html_hash)
+                save(url, **validators)
+                with lock:
+                    changes.unchanged += 1
+                return
+
+            # Pages often differ only in markup that is not scraped, so compare the parsed rows too
+            record = parse(url, response.text)
+            if record is None:
+                if page:
+                    remove(url)
+                return
+            record_json = json.dumps(record, sort_keys=True, ensure_ascii=False)
+            record_hash = hash_text(record_json)
+            snapshot(url, response.text, html_hash)
+            if page and page['record_hash'] == record_hash:
+                save(url, html_hash=html_hash, **validators)
+                with lock:
+                    changes.unchanged += 1
+                return
+
+            save(url, html_hash=html_hash, record_hash=record_hash, record=record_json, changed_at=now, **validators)
+            with lock:
+                (changes.modified if page else changes.added).append(url)
+            print(f'{"Modified" if page else "Added"} {url}')
+
+        checked = urls if only is None else [url for url in urls if url in only or url not in pages]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(check, checked))
+
+        for url in pages.keys() - urls.keys():
+            remove(url)
+
+        rows = conn.execute(
+            'select url, key, record from page where kind = ? and record is not null order by key', (kind,)
+        ).fetchall()
+
+    # Write and rename, so readers never see a half-written CSV
+    with open(f'{output}.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, quoting=csv.QUOTE_ALL, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(json.loads(row['record']))
+    os.replace(f'{output}.tmp', output)
+
+    write_changelog(kind, changes, pages, urls, changelog_path, now)
+    print(
+        f'{kind}: {len(changes.added)} added, {len(changes.modified)} modified, {len(changes.removed)} removed, '
+        f'{changes.unchanged + changes.not_modified} unchanged ({changes.not_modified} not downloaded), '
+        f'{changes.failed} failed'
+    )
+    return changes
+
+
+def write_changelog(kind: str, changes: Changes, pages: dict, urls: dict[str, str], path: str, now: float):
+    """
+    Append the changes of a refresh to the changelog CSV
+    """
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['time', 'kind', 'change', 'key', 'url'])
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now))
+        for change, changed_urls in (('added', changes.added), ('modified', changes.modified),
+                                     ('removed', changes.removed)):
+            for url in sorted(changed_urls):
+                key = urls.get(url) or pages[url]['key']
+                writer.writerow([timestamp, kind, change, key, url])
@@ -0,0 +1,56 @@
+"""
+data/scripts/mock_course_server.py
+Local stand-in for the course guide, for trying find_valid_courses.py without sending traffic to RMIT
+
+Usage: python mock_course_server.py [--port 8766] [--valid-every N] [--error-rate R] [--latency S]
+"""
+
+import argparse
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COURSE_PATH_PATTERN = re.compile(r'^/courses/(\d{6})$')
+
+
+class CourseHandler(BaseHTTPRequestHandler):
+    valid_every = 7
+    error_rate = 0.0
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.send_error(random.choice([429, 503]))
+            return
+        match = COURSE_PATH_PATTERN.match(self.path)
+        if not match or int(match.group(1)) % self.valid_every:
+            self.send_error(404)
+            return
+        body = f'<html><head><title>Course {match.group(1)} &amp; Studio</title></head><body></body></html>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--valid-every', type=int, default=7, help='Every Nth course ID exists')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='Share of requests answered with 429 or 503')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per response')
+    args = parser.parse_args()
+
+    CourseHandler.valid_every = args.valid_every
+    CourseHandler.error_rate = args.error_rate
+    CourseHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), CourseHandler)
+    server.daemon_threads = True
+    print(f'Serving mock courses on http://127.0.0.1:{args.port}/courses/')
+    server.serve_forever()
@@ -1,15 +1,152 @@
-import xml.etree.ElementTree as ET
+"""
+data/scripts/parse_sitemap.py
+Stream program URLs out of the RMIT sitemap, following sitemap indexes and gzip, and list those changed since last run
+
+Usage: python parse_sitemap.py [SITEMAP] [--output program_urls.txt] [--changed program_urls_changed.txt]
+SITEMAP is a URL or a local .xml or .xml.gz file. Pass the changed list to scrape_program_details.py --only, which
+empties it once every page in it was checked; until then, further runs add to it.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
 import re
+import xml.etree.ElementTree as ET
+from contextlib import ExitStack, contextmanager
+from typing import IO, Iterator
+
+import requests
+
+SITEMAP = 'https://www.rmit.edu.au/sitemap.xml'
+OUTPUT = 'program_urls.txt'
+CHANGED = 'program_urls_changed.txt'
+STATE = 'sitemap_state.json'
+TIMEOUT = 30
+
+NAMESPACE = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+PROGRAM_URL_PATTERN = re.compile(
+    r'/levels-of-study/(undergraduate-study|postgraduate-study|research-programs)/.*(auscy|ausbr|ausbu)$'
+)
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+@contextmanager
+def open_sitemap(location: str) -> Iterator[IO[bytes]]:
+    """
+    Open a sitemap URL or file as a byte stream, decompressing gzip on the fly
+    """
+    with ExitStack() as stack:
+        if re.match(r'^https?://', location):
+            response = stack.enter_context(requests.get(location, stream=True, timeout=TIMEOUT))
+            response.raise_for_status()
+            response.raw.decode_content = True  # Undo Content-Encoding: gzip, a .xml.gz body stays compressed
+            # urllib3 closes the raw stream once the body is read, which breaks the buffer wrapped around it
+            response.raw.auto_close = False
+            stream = stack.enter_context(io.BufferedReader(response.raw))
+        else:
+            stream = stack.enter_context(open(location, 'rb'))
+
+        # Sniff the magic bytes, since .gz sitemaps are not always named or served as such
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            stream = stack.enter_context(gzip.GzipFile(fileobj=stream))
+        yield stream
+
+
+def iter_sitemap(
+        location: str,
+        since: dict[str, str],
+        seen: set[str],
+        skipped: set[str],
+) -> Iterator[tuple[str, str | None, str]]:
+    """
+    Stream the URLs of a sitemap, descending into the sitemaps of a sitemap index
+    :param location: Sitemap URL or file
+    :param since: Last modification times of the child sitemaps at the last run, updated in place
+    :param seen: Sitemaps already read, so index loops are not followed
+    :param skipped: Child sitemaps not read because their lastmod is unchanged, filled in place
+    :return: URL, its lastmod if any, and the sitemap it is listed in
+    """
+    if location in seen:
+        return
+    seen.add(location)
+
+    children = []
+    with open_sitemap(location) as stream:
+        context = ET.iterparse(stream, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag not in (f'{NAMESPACE}url', f'{NAMESPACE}sitemap'):
+                continue
+            loc = (elem.findtext(f'{NAMESPACE}loc') or '').strip()
+            lastmod = (elem.findtext(f'{NAMESPACE}lastmod') or '').strip() or None
+            if loc and elem.tag == f'{NAMESPACE}url':
+                yield loc, lastmod, location
+            elif loc:
+                children.append((loc, lastmod))
+            # Drop parsed entries so memory stays flat however large the sitemap is
+            root.clear()
+
+    for loc, lastmod in children:
+        if lastmod and since.get(loc) == lastmod:
+            print(f'Skipped unchanged sitemap {loc}')
+            skipped.add(loc)
+            continue
+        yield from iter_sitemap(loc, since, seen, skipped)
+        if lastmod:
+            since[loc] = lastmod
+
+
+def load_state(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {'sitemaps': {}, 'urls': {}}
+
+
+def save_state(path: str, state: dict):
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sitemap', nargs='?', default=SITEMAP)
+    parser.add_argument('--output', default=OUTPUT, help='Every program URL, deduplicated')
+    parser.add_argument('--changed', default=CHANGED, help='Program URLs new or changed since they were last scraped')
+    parser.add_argument('--state', default=STATE)
+    parser.add_argument('--full', action='store_true', help='Ignore the last run and list every URL as changed')
+    args = parser.parse_args()
+
+    state = {'sitemaps': {}, 'urls': {}} if args.full else load_state(args.state)
+    known = state['urls']
+    urls: dict[str, dict] = {}
+    changed = []
+    skipped: set[str] = set()
+    for loc, lastmod, sitemap in iter_sitemap(args.sitemap, state['sitemaps'], set(), skipped):
+        if loc in urls or not PROGRAM_URL_PATTERN.search(loc):
+            continue
+        urls[loc] = {'lastmod': lastmod, 'sitemap': sitemap}
+        # Without a lastmod there is no telling, so the page is listed and left to the scraper's conditional request
+        if loc not in known or lastmod is None or known[loc]['lastmod'] != lastmod:
+            changed.append(loc)
 
-tree = ET.parse('sitemap.xml')
-root = tree.getroot()
+    # URLs in skipped sitemaps were not read again, so they are carried over from the last run
+    carried = {loc: entry for loc, entry in known.items() if entry['sitemap'] in skipped and loc not in urls}
+    removed = known.keys() - urls.keys() - carried.keys()
+    state['urls'] = carried | urls
 
-namespace = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+    # The state moves on every run, so changes are kept in the list until scrape_program_details.py --only empties it
+    if os.path.exists(args.changed):
+        with open(args.changed, encoding='utf-8') as f:
+            changed = [line.strip() for line in f if line.strip()] + changed
+    changed = [loc for loc in dict.fromkeys(changed) if loc in state['urls']]
 
-with open("program_urls.txt", "a") as f:
-    for url in root.findall('ns:url', namespace):
-        loc = url.find('ns:loc', namespace)
-        if loc is not None:
-            if re.search(r'/levels-of-study/(undergraduate-study|postgraduate-study|research-programs)/.*(auscy|ausbr|ausbu)$'
-                    , loc.text):
-                f.write(loc.text + '\n')
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.writelines(f'{loc}\n' for loc in sorted(state['urls']))
+    with open(args.changed, 'w', encoding='utf-8') as f:
+        f.writelines(f'{loc}\n' for loc in changed)
+    save_state(args.state, state)
+    print(f'{len(state["urls"])} program URLs, {len(changed)} to scrape, {len(removed)} removed since the last run')
@@ -0,0 +1,67 @@
+"""
+data/scripts/politeness.py
+Rate limiting and retries with backoff shared by the scripts that crawl RMIT's site
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+RETRIES = 4
+BACKOFF = 1.0  # Seconds before the first retry, doubled for every further retry
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Spaces requests evenly at a fixed rate, across threads or the tasks of an event loop
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        :return: Seconds to wait before sending the next request
+        """
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        return max(delay, 0.0)
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    async def wait_async(self):
+        await asyncio.sleep(self.reserve())
+
+
+def parse_retry_after(value: str | None) -> float:
+    """
+    :param value: Retry-After header, in seconds or an HTTP date
+    :return: Seconds to wait, 0 if missing or unparseable
+    """
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    """
+    :param attempt: Attempts made so far, minus one
+    :param retry_after: Retry-After header of the response, if any
+    :return: Seconds before the next attempt, exponential backoff with jitter unless the server asks for longer
+    """
+    return max(parse_retry_after(retry_after), BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
@@ -1,42 +1,43 @@
-import os
-import time
+import argparse
 import csv
-import requests
+
 from bs4 import BeautifulSoup
 
+from incremental import SNAPSHOT_PATH, refresh
+
 INPUT_CSV = '../raw_data/valid_courses.csv'
 OUTPUT_CSV = '../raw_data/valid_courses_complete.csv'
-DELAY = 0.001
+COLUMNS = ['course_id', 'url', 'title', 'body_html']
+
+
+def parse_course(url: str, html: str) -> dict | None:
+    soup = BeautifulSoup(html, 'html.parser')
+    if not soup.title or not soup.title.string:
+        return None
+    div = soup.find('div', class_='contentArea')
+    return {
+        'course_id': url.rstrip('/').rsplit('/', 1)[-1],
+        'url': url,
+        'title': soup.title.string.strip(),
+        'body_html': div.decode_contents() if div else '',
+    }
+
 
 if __name__ == '__main__':
-    ids = []
+    parser = argparse.ArgumentParser(description='Scrape course guides, downloading and reparsing only changed pages')
+    parser.add_argument('--full', action='store_true', help='Download every page again')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=10.0, help='Requests per second in total, 0 for no limit')
+    parser.add_argument('--snapshots', default=SNAPSHOT_PATH, help='Snapshot store the app reads, SNAPSHOT_PATH')
+    args = parser.parse_args()
+
+    urls = {}
     with open(INPUT_CSV, newline='', encoding='utf-8') as f:
         reader = csv.reader(f)
         next(reader, None)  # skip header
         for row in reader:
-            ids.append(int(row[0]))
-
-    with open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-        writer.writerow(['course_id', 'url', 'title', 'body_html'])
-
-        for i in ids:
-            course_id = f"{i:06d}"
-            url = f"http://www1.rmit.edu.au/courses/{course_id}"
-            try:
-                resp = requests.get(url, timeout=10)
-            except requests.RequestException as e:
-                print(e)
-                continue
-
-            if resp.status_code != 200:
-                print(f"{course_id} is invalid")
-            else:
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                title = soup.title.string.strip()
-                div = soup.find('div', class_='contentArea')
-                body = div.decode_contents() if div else ''
-                writer.writerow([course_id, url, title, body])
-                print(f"Found {course_id} {title}")
-
-            time.sleep(DELAY)
+            course_id = f"{int(row[0]):06d}"
+            urls[f"http://www1.rmit.edu.au/courses/{course_id}"] = course_id
+
+    refresh('course', urls, parse_course, OUTPUT_CSV, COLUMNS, full=args.full, workers=args.workers, rate=args.rate,
+            snapshot_path=args.snapshots)
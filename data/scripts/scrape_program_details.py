@@ -1,10 +1,9 @@
-import csv
+import argparse
 
-import requests
-import re
 from bs4 import BeautifulSoup
 
 from ask_dcnc_data import get_db
+from incremental import SNAPSHOT_PATH, refresh
 
 
 def fetch_urls( ):
@@ -18,36 +17,32 @@ def fetch_urls( ):
         conn.close( )
 
 
-def fetch_program_details( url: str ):
-    # Get webpage
-    html = requests.get( url, timeout = 10 )
-    html.raise_for_status( )
-
-    soup = BeautifulSoup( markup = html.text, features = "html.parser" )
-
-    sections = [ ]
-
-    for tag in soup.find_all( class_ = "rmit-bs" ):
-        sections.append( tag )
-    return sections
+def parse_program_details( url: str, html: str ) -> dict:
+    soup = BeautifulSoup( markup = html, features = "html.parser" )
+    sections = soup.find_all( class_ = "rmit-bs" )
+    return { "url": url, "html": "".join( str( tag ) for tag in sections ) }
 
 
 if __name__ == "__main__":
-    urls = fetch_urls( )
-
-    with open( "../raw_data/programs.csv", "w", newline = "", encoding = "utf-8" ) as f:
-        write = csv.writer( f, quoting = csv.QUOTE_ALL )
-        write.writerow( [ "url", "html" ] )
-
-        for url in urls:
-            # Get the HTML
-            try:
-                html = fetch_program_details( url )
-                html_str = "".join( str( tag ) for tag in html )
-                print( f"Fetched {url}" )
-                write.writerow( [ url, html_str ] )
-
-            except requests.HTTPError as e:
-                print( f"HTTP error: {e} for {url}" )
-            except requests.RequestException as e:
-                print( f"Request failed: {e} for {url}" )
+    parser = argparse.ArgumentParser(
+        description = "Scrape program pages, downloading and reparsing only changed pages"
+    )
+    parser.add_argument( "--full", action = "store_true", help = "Download every page again" )
+    parser.add_argument( "--workers", type = int, default = 8 )
+    parser.add_argument( "--rate", type = float, default = 10.0, help = "Requests per second in total, 0 for no limit" )
+    parser.add_argument( "--snapshots", default = SNAPSHOT_PATH, help = "Snapshot store the app reads, SNAPSHOT_PATH" )
+    parser.add_argument( "--only", help = "File of URLs to check, e.g. program_urls_changed.txt, emptied when done" )
+    args = parser.parse_args( )
+
+    urls = { url: url for url in fetch_urls( ) }
+    only = None
+    if args.only:
+        with open( args.only, encoding = "utf-8" ) as f:
+            only = { line.strip( ) for line in f if line.strip( ) }
+    changes = refresh( "program", urls, parse_program_details, "../raw_data/programs.csv", [ "url", "html" ],
+                       full = args.full, workers = args.workers, rate = args.rate,
+                       only = only, snapshot_path = args.snapshots )
+
+    # Consume the list, unless a page failed and has to be checked again next time
+    if args.only and not changes.failed:
+        open( args.only, "w", encoding = "utf-8" ).close( )
@@ -8,10 +8,30 @@ import sys
 from datetime import datetime
 
 import streamlit as st
-from langchain_core.messages import AIMessage
 from loguru import logger
 
-from ask_dcnc import get_agent, get_system_prompt, get_time_str
+from ask_dcnc import (
+    AUTO_MODEL,
+    FAST_PATH,
+    HistoryState,
+    PoolFullError,
+    Tracer,
+    answer_lookup,
+    cache_answer,
+    choose_models,
+    compact_history,
+    get_agent,
+    get_agent_pool,
+    get_answer_key,
+    get_cached_answer,
+    get_metrics,
+    get_prompt_time,
+    get_time_str,
+    route,
+    stream_answer,
+    stream_with_fallback,
+    wait_for_turn,
+)
 
 __version__ = st.session_state.version
 
@@ -44,6 +64,10 @@ if "thoughts" not in st.session_state:
 if "thought_times" not in st.session_state:
     st.session_state.thought_times = []
 
+# Initialise the summary of turns compacted out of the chat history
+if "history" not in st.session_state:
+    st.session_state.history = HistoryState()
+
 st.title(body="AskDCNC", anchor=False)
 
 # Persistent state for LLM model, answer style, and temperature
@@ -53,12 +77,15 @@ if "answer_style" not in st.session_state:
     st.session_state.answer_style = "Brief"
 if "llm_temperature" not in st.session_state:
     st.session_state.llm_temperature = 0.5
+if "use_answer_cache" not in st.session_state:
+    st.session_state.use_answer_cache = True
 
 with st.sidebar:
     if st.button(label=":material/edit_note: New Chat", type="primary", use_container_width=True):
         st.session_state.messages = []
         st.session_state.thoughts = []
         st.session_state.thought_times = []
+        st.session_state.history = HistoryState()
         st.rerun()
 
     st.write("")
@@ -69,13 +96,15 @@ with st.sidebar:
         "anthropic.claude-3-5-sonnet-20240620-v1:0": "Claude 3.5 Sonnet",
         # "anthropic.claude-3-7-sonnet-20250219-v1:0": "Claude 3.7 Sonnet",
         # "us.meta.llama4-maverick-17b-instruct-v1:0": "Llama 4 Maverick 17B Instruct",
+        AUTO_MODEL: "Auto",
     }
     st.session_state.llm_model = st.selectbox(
         label="LLM Model",
         options=llm_model_options.keys(),
         format_func=lambda option: llm_model_options[option],
         index=st.session_state.llm_model_index,
-        help="Claude 3.5 Sonnet is recommended for accuracy. Some models may be unavailable."
+        help="Claude 3.5 Sonnet is recommended for accuracy. Some models may be unavailable. "
+             "Auto sends simple questions to Claude 3 Haiku and complex ones to Claude 3.5 Sonnet."
     )
     st.session_state.llm_model_index = list(llm_model_options.keys()).index(st.session_state.llm_model)
 
@@ -102,6 +131,13 @@ with st.sidebar:
         help="Temperature controls the creativity of the model's responses.",
     )
 
+    st.session_state.use_answer_cache = st.toggle(
+        label="Reuse Answers",
+        value=st.session_state.use_answer_cache,
+        help="Instantly answer questions that have been asked before. Turn off to always get a fresh answer, which is "
+             "then not saved for reuse either.",
+    )
+
     st.divider()
     st.info("Version " + __version__)
 
@@ -137,6 +173,13 @@ if user_question := st.chat_input(
     start_time = datetime.now()
     logger.debug(f"User question: {user_question}")
 
+    # Record LLM calls and tool invocations of this turn
+    tracer = Tracer(
+        metrics=get_metrics(),
+        llm_model=st.session_state.llm_model,
+        answer_style=st.session_state.answer_style,
+    )
+
     # Display user message in chat message container
     with st.chat_message(name="user", avatar=USER_AVATAR):
         st.markdown(user_question)
@@ -146,65 +189,135 @@ if user_question := st.chat_input(
     st.session_state.messages.append(
         {"role": "user", "content": user_question},
     )
-    messages = st.session_state.messages.copy()
-
-    # Get LangGraph prebuilt ReAct agent
-    agent = get_agent(
-        system_prompt=get_system_prompt(),
-    )
-
-    # Get LLM response
-    stream = agent.stream(
-        input={"messages": messages},
-        stream_mode="values",
+    is_first_turn = len(st.session_state.messages) == 1
+
+    # Reuse the answer to an identical first-turn question
+    answer_key = get_answer_key(
+        question=user_question,
+        llm_model=st.session_state.llm_model,
+        answer_style=st.session_state.answer_style,
+        temperature=st.session_state.llm_temperature,
     )
+    cached_answer = None
+    joined = False
+    if is_first_turn and st.session_state.use_answer_cache:
+        cached_answer = get_cached_answer(answer_key)
 
-    # Display "thoughts" box while the user waits
     temp_container = st.empty()
-    st.session_state.thoughts.append([])
-    with temp_container.container():
-        with st.chat_message(name="assistant", avatar=ASSISTANT_AVATAR):
-            with st.spinner(text="Thinking", show_time=True):
-                with st.expander(label="Thoughts", expanded=True):
-                    for step in stream:
-                        if "messages" in step:
-                            message = step['messages'][-1]
-                            logger.debug(message)
-                            if isinstance(message, AIMessage):
-                                response = message.content
-
-                                # Trim "Thought:" prefix
-                                if response.startswith("Thought:"):
-                                    thought = response[len("Thought:"):].strip()
-
-                                st.write(response)
-                                st.session_state.thoughts[-1].append(response)
-
-    # Remove the final response from the thoughts
-    st.session_state.thoughts[-1].pop()
-    if not st.session_state.thoughts[-1]:
-        st.session_state.thoughts[-1].append("")
-
-    # Final response
-    if response:
-        # Trim "Final Answer:" prefix
-        if "Final Answer:" in response:
-            responses = response.split("Final Answer:")
-            st.session_state.thoughts[-1].append(responses[0].strip())
-            response = responses[1].strip()
-
-        # Add the final response to the chat history
+    if cached_answer:
+        response, thoughts, time_diff = cached_answer
+        st.session_state.thoughts.append(thoughts)
         st.session_state.messages.append({"role": "assistant", "content": response})
-        logger.debug("Assistant response:\n" + response)
+        logger.debug("Cached assistant response:\n" + response)
+    else:
+        # Prefetch rows for course and program codes in the question
+        lookup = route(user_question) if FAST_PATH != "off" else None
+        st.session_state.thoughts.append([])
+
+        # Send the latest turns verbatim and a summary of the rest
+        messages = compact_history(st.session_state.messages, st.session_state.history)
+
+        # Models to try in order
+        if st.session_state.llm_model == AUTO_MODEL:
+            llm_models = choose_models(user_question, lookup)
+        else:
+            llm_models = [st.session_state.llm_model]
+
+        if lookup and lookup.is_pure:
+            # Pure lookups skip the ReAct loop
+            with temp_container.container():
+                with st.chat_message(name="assistant", avatar=ASSISTANT_AVATAR):
+                    with st.spinner(text="Looking up", show_time=True):
+                        response = answer_lookup(
+                            lookup=lookup,
+                            messages=messages,
+                            llm_model=llm_models[0],
+                            temperature=st.session_state.llm_temperature,
+                            answer_style=st.session_state.answer_style,
+                            time=get_prompt_time(),
+                            history=st.session_state.history.summary,
+                            callbacks=[tracer],
+                        )
+            st.session_state.thoughts[-1] += [lookup.summary, response]
+        else:
+            # Get cached LangGraph prebuilt ReAct agents
+            agents = [
+                (llm_model, get_agent(
+                    llm_model=llm_model,
+                    temperature=st.session_state.llm_temperature,
+                    answer_style=st.session_state.answer_style,
+                ))
+                for llm_model in llm_models
+            ]
+
+            # Queue the agent run on the shared pool, which streams the LLM response token by token
+            agent_input = {
+                "messages": messages,
+                "time": get_prompt_time(),
+                "context": lookup.context if lookup else "",
+                "history": st.session_state.history.summary,
+            }
+            try:
+                # Sessions asking the same first-turn question at the same time share one run, whether or not
+                # they reuse finished answers, since a run in flight is as fresh as a new one
+                job, joined = get_agent_pool().submit(
+                    run=lambda: stream_with_fallback(agents, agent_input, config={"callbacks": [tracer]}),
+                    key=answer_key if is_first_turn else None,
+                )
+            except PoolFullError as e:
+                logger.warning(f"Agent run rejected: {e}")
+                st.session_state.messages.pop()
+                st.session_state.thoughts.pop()
+                temp_container.warning("AskDCNC is very busy right now. Please try again in a minute.")
+                st.stop()
+
+            # Display the queue position, then the "thoughts" box while the user waits, then the answer below it
+            with temp_container.container():
+                with st.chat_message(name="assistant", avatar=ASSISTANT_AVATAR):
+                    with st.spinner(text="Thinking", show_time=True):
+                        wait_for_turn(job, st.empty())
+                        st.write_stream(stream_answer(
+                            stream=job,
+                            thoughts_expander=st.expander(label="Thoughts", expanded=True),
+                            thoughts=st.session_state.thoughts[-1],
+                        ))
+
+            response = st.session_state.thoughts[-1][-1] if st.session_state.thoughts[-1] else ""
+
+        # Remove the final response from the thoughts
+        if st.session_state.thoughts[-1]:
+            st.session_state.thoughts[-1].pop()
+        if not st.session_state.thoughts[-1]:
+            st.session_state.thoughts[-1].append("")
+
+        # Final response
+        if response:
+            # Trim "Final Answer:" prefix
+            if "Final Answer:" in response:
+                responses = response.split("Final Answer:")
+                st.session_state.thoughts[-1].append(responses[0].strip())
+                response = responses[1].strip()
+
+            # Add the final response to the chat history
+            st.session_state.messages.append({"role": "assistant", "content": response})
+            logger.debug("Assistant response:\n" + response)
+
+        time_diff = datetime.now() - start_time
+        if is_first_turn and response and st.session_state.use_answer_cache:
+            cache_answer(answer_key, response, st.session_state.thoughts[-1], time_diff)
+
+    # Spans of a joined run are recorded by the session that queued it
+    tracer.finish(question=user_question, cached=bool(cached_answer), joined=joined, answered=bool(response))
 
     # Display the thoughts and final response in the chat box
-    end_time = datetime.now()
     temp_container.empty()
     with st.chat_message(name="assistant", avatar=ASSISTANT_AVATAR):
-        time_diff = end_time - start_time
         if st.session_state.thoughts[-1][0]:
             with st.expander(label=get_time_str(time_diff)):
                 for thought in st.session_state.thoughts[-1]:
                     st.write(thought)
         st.markdown(response)
         st.session_state.thought_times.append(time_diff)
+
+    # Summarise turns leaving the window while the user reads the answer, not when they ask the next question
+    compact_history(st.session_state.messages, st.session_state.history)
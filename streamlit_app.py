@@ -2,6 +2,8 @@ import streamlit as st
 import toml
 
 import ask_dcnc.client
+import ask_dcnc.schema
+import ask_dcnc.tracing
 
 with open("pyproject.toml", "r", encoding="utf-8") as f:
     st.session_state.version = toml.load(f)["project"]["version"]
@@ -41,4 +43,6 @@ st.logo("static/images/rmit_university_logo_144p.png")
 
 pg.run()
 
-ask_dcnc.client.get_aws_keys()  # Obtain AWS keys first thing to speed up response time
+ask_dcnc.client.get_credential_manager()  # Obtain AWS keys first thing and keep them fresh in the background
+ask_dcnc.schema.get_schema_digest()  # Build the schema digest for the system prompt
+ask_dcnc.tracing.serve_metrics()  # Serve Prometheus metrics if METRICS_PORT is set
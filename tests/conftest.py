@@ -0,0 +1,30 @@
+"""
+tests/conftest.py
+Shared fixtures
+"""
+
+import sqlite3
+
+import pytest
+
+from ask_dcnc.ingest import SCHEMA_SQL
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    """
+    Small database with the schema of dcnc.sqlite, so tests need neither the bundled database nor a rebuild
+    """
+    path = str(tmp_path / "dcnc.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(SCHEMA_SQL)
+        conn.execute("insert into course_coordinator values (1, 'Jane Example', null, null, null)")
+        conn.executemany("insert into course values (?, ?, 1, '', ?, ?)", [
+            ("004301", "Introduction to Programming", "Programming in Python", "https://www.rmit.edu.au/courses/4301"),
+            ("045677", "Practical Data Science", "Data science process", "https://www.rmit.edu.au/courses/45677"),
+        ])
+        conn.executemany("insert into course_code values (?, ?)", [("004301", "COSC1519"), ("045677", "COSC2670")])
+        conn.execute("insert into program values ('BP094', 'Bachelor of Computer Science', null)")
+        conn.execute("insert into program_plan values ('BP094P23', 'BP094', null, null)")
+    conn.close()
+    return path
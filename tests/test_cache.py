@@ -0,0 +1,97 @@
+"""
+tests/test_cache.py
+Eviction, expiry, and invalidation of the query and HTTP caches
+"""
+
+import pytest
+
+from ask_dcnc import cache as cache_module
+from ask_dcnc.cache import DiskCache, LRUCache
+from ask_dcnc.sql import normalize_query
+
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = LRUCache(max_entries=2, max_size=1000)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"  # "b" is now the least recently used
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.entries) == (3, 1, 1, 2)
+
+
+def test_lru_is_bounded_by_size():
+    cache = LRUCache(max_entries=10, max_size=10)
+    cache.put("a", "x" * 6)
+    cache.put("b", "y" * 6)
+    assert cache.get("a") is None
+    assert cache.stats().size == 6
+    cache.put("c", "z" * 11)  # Larger than the whole cache, never stored
+    assert cache.get("c") is None and cache.get("b") == "y" * 6
+
+
+def test_lru_is_cleared_when_the_version_changes():
+    cache = LRUCache(max_entries=10, max_size=1000)
+    cache.put("a", "1", version=1)
+    assert cache.get("a", version=1) == "1"
+    assert cache.get("a", version=2) is None
+    assert cache.stats().invalidations == 1
+
+
+def test_equivalent_queries_share_a_key():
+    assert normalize_query("SELECT  title\nFROM course WHERE id = '004301';") == \
+        normalize_query("select title from course where id='004301'")
+    # String literals keep their case and spacing
+    assert normalize_query("select * from course where title = 'Data  Science'") != \
+        normalize_query("select * from course where title = 'data science'")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+
+def test_disk_cache_expires_entries(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "http.sqlite"), ttl=60, max_size=1000)
+    cache.put("a", {"text": "1"})
+    clock.now += 59
+    assert cache.get("a") == {"text": "1"}
+    clock.now += 2
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.invalidations, stats.entries) == (1, 1, 1, 0)
+
+
+def test_disk_cache_evicts_least_recently_used_entry(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "http.sqlite"), ttl=None, max_size=20)
+    cache.put("a", "x" * 6)  # 8 characters once serialised
+    clock.now += 1
+    cache.put("b", "y" * 6)
+    clock.now += 1
+    assert cache.get("a") == "x" * 6  # "b" is now the least recently used
+    clock.now += 1
+    cache.put("c", "z" * 6)
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 6 and cache.get("c") == "z" * 6
+    assert cache.stats().evictions == 1
+
+
+def test_disk_cache_skips_oversized_values_and_persists(tmp_path, clock):
+    path = str(tmp_path / "http.sqlite")
+    cache = DiskCache(path, ttl=None, max_size=10)
+    cache.put("a", "x" * 20)
+    cache.put("b", "y")
+    assert cache.get("a") is None
+    assert DiskCache(path, ttl=None, max_size=10).get("b") == "y"
@@ -0,0 +1,164 @@
+"""
+tests/test_client.py
+AWS credential refresh with stubbed Cognito clients
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+from langchain_aws import ChatBedrock
+
+from ask_dcnc import client
+from ask_dcnc.client import CredentialManager, fetch_aws_keys, get_token_retry_policy
+
+
+def make_credentials(n: int, lifetime: float = 3600) -> dict:
+    return {
+        "AccessKeyId": f"key-{n}",
+        "SecretKey": f"secret-{n}",
+        "SessionToken": f"token-{n}",
+        "Expiration": datetime.now(timezone.utc) + timedelta(seconds=lifetime),
+    }
+
+
+class StubFetch:
+    """
+    Stands in for `fetch_aws_keys`, counting calls and returning new credentials every time
+    """
+
+    def __init__(self, delay: float = 0.0, lifetime: float = 3600):
+        self.delay = delay
+        self.lifetime = lifetime
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> dict:
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls += 1
+            return make_credentials(self.calls, self.lifetime)
+
+
+class StubIdpClient:
+    def initiate_auth(self, **kwargs):
+        return {"AuthenticationResult": {"IdToken": "id-token"}}
+
+
+class StubIdentityClient:
+    def __init__(self):
+        self.logins = []
+
+    def get_id(self, IdentityPoolId, Logins):
+        self.logins.append(Logins)
+        return {"IdentityId": "identity"}
+
+    def get_credentials_for_identity(self, IdentityId, Logins):
+        self.logins.append(Logins)
+        return {"IdentityId": IdentityId, "Credentials": make_credentials(1)}
+
+
+def expired_token_error() -> ClientError:
+    return ClientError(
+        {"Error": {"Code": "ExpiredTokenException", "Message": "The security token is expired"}},
+        "InvokeModel",
+    )
+
+
+def test_fetch_aws_keys_with_stub_clients():
+    identity_client = StubIdentityClient()
+    credentials = fetch_aws_keys(idp_client=StubIdpClient(), identity_client=identity_client)
+    assert credentials["AccessKeyId"] == "key-1"
+    assert all("id-token" in logins.values() for logins in identity_client.logins)
+
+
+def test_concurrent_refreshes_fetch_once():
+    fetch = StubFetch(delay=0.2)
+    manager = CredentialManager(fetch=fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fetch.calls == 1
+    assert all(credentials is results[0] for credentials in results)
+
+
+def test_stale_refresh_is_coalesced():
+    fetch = StubFetch()
+    manager = CredentialManager(fetch=fetch)
+    stale = manager.get()
+    fresh = manager.refresh(stale=stale)
+    assert fresh is not stale
+    # A second caller holding the same stale credentials gets the ones already replaced
+    assert manager.refresh(stale=stale) is fresh
+    assert fetch.calls == 2
+
+
+def test_listeners_receive_new_credentials():
+    manager = CredentialManager(fetch=StubFetch())
+    received = []
+    manager.subscribe(lambda credentials: 1 / 0)  # A failing listener does not stop the others
+    manager.subscribe(received.append)
+    first = manager.get()
+    second = manager.refresh(stale=first)
+    assert received == [first, second]
+
+
+def test_background_thread_refreshes_ahead_of_expiry():
+    fetch = StubFetch(lifetime=1.2)
+    manager = CredentialManager(fetch=fetch, refresh_margin=1.0, retry_interval=0.05)
+    manager.get()
+    manager.start()
+    try:
+        time.sleep(0.6)
+    finally:
+        manager.stop()
+    assert fetch.calls >= 2
+    assert manager.expires_at > time.time()
+
+
+def test_invalidate_coalesces_callers():
+    fetch = StubFetch()
+    manager = CredentialManager(fetch=fetch, retry_interval=60)
+    manager.get()
+    manager.invalidate()
+    assert fetch.calls == 1  # Just obtained, so not replaced again
+    manager._refreshed_at -= 120
+    manager.invalidate()
+    manager.invalidate()
+    assert fetch.calls == 2
+
+
+def test_rebuild_bedrock_clients_in_place():
+    llm = ChatBedrock(
+        region_name="us-east-1",
+        model_id="anthropic.claude-3-haiku-20240307-v1:0",
+        aws_access_key_id="key-0",
+        aws_secret_access_key="secret-0",
+        aws_session_token="token-0",
+    )
+    client._bedrock_llms[id(llm)] = llm
+    old_client = llm.client
+
+    manager = CredentialManager(fetch=StubFetch())
+    manager.subscribe(client._rebuild_bedrock_clients)
+    manager.get()
+
+    assert llm.aws_access_key_id.get_secret_value() == "key-1"
+    assert llm.aws_session_token.get_secret_value() == "token-1"
+    assert llm.client is not old_client
+
+
+def test_token_retry_policy_replaces_expired_credentials():
+    fetch = StubFetch()
+    manager = CredentialManager(fetch=fetch, retry_interval=0)
+    manager.get()
+    policy = get_token_retry_policy(manager=lambda: manager)
+
+    assert policy.retry_on(expired_token_error())
+    assert fetch.calls == 2
+    assert not policy.retry_on(ValueError("not an AWS error"))
+    assert fetch.calls == 2
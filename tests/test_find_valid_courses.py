@@ -0,0 +1,43 @@
+"""
+tests/test_find_valid_courses.py
+Resuming the course ID sweep from its checkpoint
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "scripts"))
+
+from find_valid_courses import Checkpoint  # noqa: E402
+
+
+def test_checkpoint_watermark_follows_contiguous_ids(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "part0.json"), 1000, 1010)
+    for course_id in (1000, 1002, 1003):
+        checkpoint.mark(course_id)
+    assert checkpoint.watermark == 1001
+    assert checkpoint.done == {1002, 1003}
+    checkpoint.mark(1001)
+    assert checkpoint.watermark == 1004 and checkpoint.done == set()
+
+
+def test_checkpoint_resumes_where_it_stopped(tmp_path):
+    path = str(tmp_path / "part0.json")
+    checkpoint = Checkpoint(path, 1000, 1010)
+    for course_id in (1000, 1001, 1005):
+        checkpoint.mark(course_id)
+    checkpoint.save()
+
+    resumed = Checkpoint(path, 1000, 1010)
+    assert [course_id for course_id in range(1000, 1010) if not resumed.is_done(course_id)] == \
+        [1002, 1003, 1004, 1006, 1007, 1008, 1009]
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_checkpoint_of_another_range_is_refused(tmp_path):
+    path = str(tmp_path / "part0.json")
+    Checkpoint(path, 1000, 1010).save()
+    with pytest.raises(SystemExit):
+        Checkpoint(path, 1000, 2000)
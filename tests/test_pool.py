@@ -0,0 +1,104 @@
+"""
+tests/test_pool.py
+Admission control of the agent pool and model fallback
+"""
+
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+from langgraph.prebuilt import create_react_agent
+
+from ask_dcnc.models import stream_with_fallback
+from ask_dcnc.pool import AgentPool, PoolFullError
+from ask_dcnc.throttle import get_retry_policy
+from benchmarks.fakes import FakeToolChatModel, ReplayChatModel, ThrottlingChatModel
+
+QUESTION = "What is COSC1519?"
+
+
+def blocked_run(release: threading.Event, chunks: list | None = None):
+    def run():
+        release.wait(5)
+        return chunks or []
+    return run
+
+
+def test_pool_rejects_runs_beyond_the_queue_limit():
+    pool = AgentPool(max_workers=1, queue_limit=1)
+    release = threading.Event()
+    running, _ = pool.submit(blocked_run(release))
+    assert running.started.wait(5)
+    waiting, _ = pool.submit(blocked_run(release))
+    assert waiting.position == 1
+    with pytest.raises(PoolFullError):
+        pool.submit(blocked_run(release))
+    release.set()
+    assert list(waiting) == []
+    assert pool.submit(blocked_run(release))[0] is not None
+
+
+def test_pool_joins_identical_runs():
+    pool = AgentPool(max_workers=2, queue_limit=2)
+    release = threading.Event()
+    calls = []
+
+    def run():
+        calls.append(1)
+        release.wait(5)
+        yield from ["a", "b"]
+
+    job, joined = pool.submit(run, key="answer")
+    same_job, same_joined = pool.submit(run, key="answer")
+    release.set()
+    assert (joined, same_joined) == (False, True)
+    assert same_job is job and job.subscribers == 2
+    assert list(job) == list(same_job) == ["a", "b"]
+    assert calls == [1]
+    # A finished run is no longer joined
+    assert pool.submit(run, key="answer")[1] is False
+
+
+def build_agent(model):
+    agent = create_react_agent(model, tools=[])
+    agent.retry_policy = [get_retry_policy()._replace(initial_interval=0.01, jitter=False)]
+    return agent
+
+
+def answer(chunks) -> str:
+    return "".join(message.content for message, _ in chunks)
+
+
+def test_fallback_on_throttling():
+    primary = ThrottlingChatModel(throttle_rate=1.0, latency=0.0)
+    fallback = FakeToolChatModel(responses=[AIMessage(content="Final Answer: fallback")])
+    chunks = stream_with_fallback(
+        [("primary", build_agent(primary)), ("fallback", build_agent(fallback))],
+        {"messages": [("user", QUESTION)]},
+    )
+    assert answer(chunks) == "Final Answer: fallback"
+    # Every model but the last gives up on throttling after FALLBACK_MAX_ATTEMPTS
+    assert primary.calls == 2
+
+
+def test_fallback_on_slow_first_token_holds_the_pool_slot():
+    scenarios = {QUESTION: {"steps": [], "answer": "primary"}}
+    primary = ReplayChatModel(scenarios=scenarios, latency=0.5)
+    fallback = FakeToolChatModel(responses=[AIMessage(content="Final Answer: fallback")])
+    agents = [("primary", build_agent(primary)), ("fallback", build_agent(fallback))]
+
+    pool = AgentPool(max_workers=1, queue_limit=1)
+    start = time.monotonic()
+    job, _ = pool.submit(
+        lambda: stream_with_fallback(agents, {"messages": [("user", QUESTION)]}, latency_budget=0.1)
+    )
+    assert answer(job) == "Final Answer: fallback"
+    assert time.monotonic() - start < 0.5
+    # The abandoned primary keeps the slot until it stops at its first token
+    assert pool.running == 1
+    deadline = time.monotonic() + 5
+    while pool.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.running == 0
+    assert time.monotonic() - start >= 0.5
@@ -0,0 +1,46 @@
+"""
+tests/test_sql.py
+Local validation of agent queries against a read-only database
+"""
+
+from langchain_community.utilities import SQLDatabase
+
+from ask_dcnc.sql import LocalQueryCheckerTool, check_query
+
+
+def test_valid_query_is_returned_unchanged(db_path):
+    query = "select title from course join course_code using (id) where code = 'COSC2670'"
+    assert check_query(db_path, query) == query
+
+
+def test_writes_are_rejected(db_path):
+    for query in (
+        "insert into course (id) values ('x')",
+        "update course set title = 'x'",
+        "drop table course",
+    ):
+        assert check_query(db_path, query) == "Error: The database is read-only. Only SELECT queries are allowed."
+
+
+def test_unknown_column_suggests_close_matches(db_path):
+    result = check_query(db_path, "select titel from course")
+    assert result.startswith("Error: no such column: titel.")
+    assert "course.title" in result
+
+
+def test_unknown_table_suggests_close_matches(db_path):
+    result = check_query(db_path, "select * from courses")
+    assert result.startswith("Error: no such table: courses.")
+    assert "Did you mean: course" in result
+
+
+def test_syntax_errors_and_empty_queries(db_path):
+    assert check_query(db_path, "select from where").startswith("Error:")
+    assert check_query(db_path, "  ") == "Error: The query is empty."
+
+
+def test_tool_has_the_interface_of_the_llm_checker(db_path):
+    tool = LocalQueryCheckerTool(db=SQLDatabase.from_uri(f"sqlite:///{db_path}"))
+    assert tool.name == "sql_db_query_checker"
+    assert tool.invoke({"query": "select code from course_code"}) == "select code from course_code"
+    assert tool.invoke({"query": "delete from course"}).startswith("Error: The database is read-only")